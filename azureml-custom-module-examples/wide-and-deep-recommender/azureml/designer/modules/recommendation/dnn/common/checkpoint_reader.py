@@ -0,0 +1,196 @@
+import os
+import re
+import struct
+import numpy as np
+
+# checkpoints are saved as tensor bundles, whose index file is a LevelDB table mapping variable names to serialized
+# BundleEntryProto, and whose data files hold the raw bytes of tensors
+_CHECKPOINT_STATE_FILE = 'checkpoint'
+_INDEX_SUFFIX = '.index'
+_TABLE_MAGIC = 0xdb4775248b80fb57
+_FOOTER_SIZE = 48
+_NO_COMPRESSION = 0
+_HEADER_KEY = b''
+_LITTLE_ENDIAN = 0
+# field numbers of BundleHeaderProto, BundleEntryProto and TensorShapeProto
+_HEADER_SHARDS_COUNT = 1
+_HEADER_ENDIANNESS = 2
+_ENTRY_DTYPE = 1
+_ENTRY_SHAPE = 2
+_ENTRY_SHARD_ID = 3
+_ENTRY_OFFSET = 4
+_ENTRY_SIZE = 5
+_ENTRY_SLICES = 7
+_SHAPE_DIM = 2
+_DIM_SIZE = 1
+# numpy dtypes of tensorflow DataType enums, except strings and other non-numeric types
+_DTYPES = {1: np.float32, 2: np.float64, 3: np.int32, 4: np.uint8, 5: np.int16, 6: np.int8, 9: np.int64,
+           10: np.bool_, 17: np.uint16, 19: np.float16, 22: np.uint32, 23: np.uint64}
+_WIRE_VARINT = 0
+_WIRE_FIXED64 = 1
+_WIRE_BYTES = 2
+_WIRE_FIXED32 = 5
+
+
+def _read_varint(buffer: bytes, pos: int):
+    result = 0
+    shift = 0
+    while True:
+        byte = buffer[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _parse_proto(buffer: bytes):
+    """Parse a serialized protobuf message into a dict of field number to list of values.
+
+    Varint and fixed fields are parsed as ints, and length-delimited fields as bytes, which are parsed again if they
+    are nested messages.
+    """
+    fields = {}
+    pos = 0
+    while pos < len(buffer):
+        tag, pos = _read_varint(buffer, pos)
+        field_number, wire_type = tag >> 3, tag & 0x7
+        if wire_type == _WIRE_VARINT:
+            value, pos = _read_varint(buffer, pos)
+        elif wire_type == _WIRE_FIXED64:
+            value, pos = struct.unpack_from('<Q', buffer, pos)[0], pos + 8
+        elif wire_type == _WIRE_BYTES:
+            size, pos = _read_varint(buffer, pos)
+            value, pos = buffer[pos:pos + size], pos + size
+        elif wire_type == _WIRE_FIXED32:
+            value, pos = struct.unpack_from('<I', buffer, pos)[0], pos + 4
+        else:
+            raise NotImplementedError(f"protobuf wire type {wire_type} is not supported")
+        fields.setdefault(field_number, []).append(value)
+    return fields
+
+
+def _read_block(data: bytes, handle: bytes):
+    """Read the entries of the table block located by the encoded block handle.
+
+    :return: list of (key, value) tuples
+    """
+    offset, pos = _read_varint(handle, 0)
+    size, _ = _read_varint(handle, pos)
+    compression = data[offset + size]
+    if compression != _NO_COMPRESSION:
+        raise NotImplementedError(f"compression type {compression} of checkpoint index is not supported")
+
+    block = data[offset:offset + size]
+    restarts_count = struct.unpack_from('<I', block, size - 4)[0]
+    entries_end = size - 4 * (restarts_count + 1)
+    entries = []
+    key = b''
+    pos = 0
+    while pos < entries_end:
+        shared, pos = _read_varint(block, pos)
+        non_shared, pos = _read_varint(block, pos)
+        value_size, pos = _read_varint(block, pos)
+        key = key[:shared] + block[pos:pos + non_shared]
+        pos += non_shared
+        entries.append((key, block[pos:pos + value_size]))
+        pos += value_size
+    return entries
+
+
+def latest_checkpoint(checkpoints_dir: str):
+    """Find the latest checkpoint in the directory, which is equal to tf.train.latest_checkpoint for checkpoints
+    saved as tensor bundles.
+
+    :return: the path prefix of the latest checkpoint, or None if no checkpoint is found
+    """
+    state_path = os.path.join(checkpoints_dir, _CHECKPOINT_STATE_FILE)
+    if not os.path.isfile(state_path):
+        return None
+    with open(state_path, 'r') as f:
+        match = re.search(r'^model_checkpoint_path:\s*"(.*)"\s*$', f.read(), flags=re.MULTILINE)
+    if match is None:
+        return None
+    checkpoint_path = match.group(1)
+    if not os.path.isabs(checkpoint_path):
+        checkpoint_path = os.path.join(checkpoints_dir, checkpoint_path)
+    return checkpoint_path if os.path.isfile(checkpoint_path + _INDEX_SUFFIX) else None
+
+
+def load_checkpoint(checkpoints_dir: str):
+    """Load the latest checkpoint in the directory without tensorflow, see CheckpointReader for details.
+
+    :raise ValueError: if no checkpoint is found
+    """
+    checkpoint_path = latest_checkpoint(checkpoints_dir)
+    if checkpoint_path is None:
+        raise ValueError(f"Cannot find checkpoints file in {checkpoints_dir}")
+    return CheckpointReader(checkpoint_path=checkpoint_path)
+
+
+class CheckpointReader:
+    """The class reads variables of a checkpoint saved as a tensor bundle, which is the format saved by tensorflow 2.
+
+    It is a numpy counterpart of the reader returned by tf.train.load_checkpoint, which reads checkpoints without
+    importing tensorflow. Only unpartitioned numeric variables saved in little endian are read, and the others raise
+    NotImplementedError.
+    """
+
+    def __init__(self, checkpoint_path: str):
+        """Read the index of the checkpoint.
+
+        :param checkpoint_path: the path prefix of the checkpoint, e.g. returned by latest_checkpoint
+        """
+        self.checkpoint_path = checkpoint_path
+        with open(checkpoint_path + _INDEX_SUFFIX, 'rb') as f:
+            data = f.read()
+        footer = data[-_FOOTER_SIZE:]
+        if struct.unpack_from('<Q', footer, _FOOTER_SIZE - 8)[0] != _TABLE_MAGIC:
+            raise NotImplementedError(f"{checkpoint_path} is not a checkpoint saved as a tensor bundle")
+        # the footer starts with the metaindex handle, which is skipped, followed by the index handle, where each
+        # handle is encoded as varints of offset and size
+        _, index_start = _read_varint(footer, 0)
+        _, index_start = _read_varint(footer, index_start)
+        _, index_end = _read_varint(footer, index_start)
+        _, index_end = _read_varint(footer, index_end)
+
+        self._entries = {}
+        for _, handle in _read_block(data, footer[index_start:index_end]):
+            self._entries.update(_read_block(data, handle))
+        header = _parse_proto(self._entries.pop(_HEADER_KEY, b''))
+        self._shards_count = header.get(_HEADER_SHARDS_COUNT, [1])[0]
+        if header.get(_HEADER_ENDIANNESS, [_LITTLE_ENDIAN])[0] != _LITTLE_ENDIAN:
+            raise NotImplementedError(f"big endian checkpoint {checkpoint_path} is not supported")
+        self._entries = {key.decode(): value for key, value in self._entries.items()}
+
+    def get_variable_to_shape_map(self):
+        return {name: self._get_shape(_parse_proto(entry)) for name, entry in self._entries.items()}
+
+    def has_tensor(self, name: str):
+        return name in self._entries
+
+    def get_tensor(self, name: str):
+        """Read the value of the variable.
+
+        :return: numpy array
+        :raise KeyError: if the variable is not found
+        """
+        entry = _parse_proto(self._entries[name])
+        dtype_enum = entry.get(_ENTRY_DTYPE, [0])[0]
+        if dtype_enum not in _DTYPES:
+            raise NotImplementedError(f"dtype {dtype_enum} of variable {name} is not supported")
+        if _ENTRY_SLICES in entry:
+            raise NotImplementedError(f"partitioned variable {name} is not supported")
+        shard_id = entry.get(_ENTRY_SHARD_ID, [0])[0]
+        offset = entry.get(_ENTRY_OFFSET, [0])[0]
+        size = entry.get(_ENTRY_SIZE, [0])[0]
+        data_path = f"{self.checkpoint_path}.data-{shard_id:05d}-of-{self._shards_count:05d}"
+        with open(data_path, 'rb') as f:
+            f.seek(offset)
+            buffer = f.read(size)
+        return np.frombuffer(buffer, dtype=_DTYPES[dtype_enum]).reshape(self._get_shape(entry)).copy()
+
+    @staticmethod
+    def _get_shape(entry: dict):
+        shape = _parse_proto(entry.get(_ENTRY_SHAPE, [b''])[0])
+        return [_parse_proto(dim).get(_DIM_SIZE, [0])[0] for dim in shape.get(_SHAPE_DIM, [])]
@@ -0,0 +1,274 @@
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_numeric_dtype
+from azureml.designer.modules.recommendation.dnn.common.constants import RANDOM_SEED
+
+
+class QuantileSketch:
+    """KLL sketch of numeric values, which estimates ranks and quantiles in bounded memory, and can be merged.
+
+    Values are kept in levels, where a value at level h stands for 2 ** h values. Once a level exceeds its capacity,
+    it is sorted and every other value is promoted to the next level, so about k * 3 values are kept in total, and
+    the rank error is about 1.7 / k of the number of values.
+    """
+
+    def __init__(self, k=2048, random_seed=RANDOM_SEED):
+        self.k = k
+        self.levels = [np.empty(0)]
+        self._random_state = np.random.RandomState(random_seed)
+
+    @property
+    def count(self):
+        return int(sum(len(values) << level for level, values in enumerate(self.levels)))
+
+    def update(self, values: np.ndarray):
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compact()
+
+    def merge(self, other):
+        self.levels.extend(np.empty(0) for _ in range(len(other.levels) - len(self.levels)))
+        for level, values in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], values])
+        self._compact()
+
+    def _capacity(self, level):
+        # lower levels hold less values, since their values stand for less values
+        return max(2, int(self.k * (2 / 3) ** (len(self.levels) - level - 1)))
+
+    def _compact(self):
+        level = 0
+        while level < len(self.levels):
+            values = self.levels[level]
+            if len(values) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                values = np.sort(values)
+                # an odd value stays at the level, so the promoted values stand for exactly the values removed
+                self.levels[level] = values[:len(values) % 2]
+                promoted = values[len(values) % 2 + self._random_state.randint(2)::2]
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+
+    def _weighted_values(self):
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(values), 1 << level) for level, values in enumerate(self.levels)])
+        order = np.argsort(values, kind='stable')
+        return values[order], weights[order]
+
+    def quantiles(self, qs):
+        values, weights = self._weighted_values()
+        if len(values) == 0:
+            return np.full(len(qs), np.nan)
+        cum_weights = np.cumsum(weights)
+        positions = np.searchsorted(cum_weights, np.asarray(qs) * cum_weights[-1], side='left')
+        return values[np.minimum(positions, len(values) - 1)]
+
+    def ranks(self, xs):
+        """Estimate the number of values less than each x."""
+        values, weights = self._weighted_values()
+        cum_weights = np.concatenate([[0], np.cumsum(weights)])
+        return cum_weights[np.searchsorted(values, xs, side='left')]
+
+    def values(self):
+        """Get the values kept by the sketch, which are values of the column."""
+        return np.concatenate(self.levels)
+
+
+class DistinctCountSketch:
+    """Sketch counting distinct values, which can be merged.
+
+    Value hashes are kept to count exactly, until there are more than exact_limit of them, and then a HyperLogLog
+    sketch with 2 ** precision registers counts distinct values with a relative error about 1.04 / 2 ** (precision / 2).
+    """
+
+    def __init__(self, precision=14, exact_limit=2 ** 14):
+        self.precision = precision
+        self.exact_limit = exact_limit
+        self.hashes = np.empty(0, dtype=np.uint64)
+        self.registers = None
+
+    @property
+    def count(self):
+        if self.registers is None:
+            return len(self.hashes)
+        registers_count = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / registers_count)
+        estimate = alpha * registers_count ** 2 / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros_count = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * registers_count and zeros_count > 0:
+            # linear counting is more accurate for small cardinalities
+            estimate = registers_count * np.log(registers_count / zeros_count)
+        return int(round(estimate))
+
+    def update(self, values: pd.Series):
+        self._add_hashes(np.unique(pd.util.hash_pandas_object(values, index=False).values))
+
+    def merge(self, other):
+        if other.registers is None:
+            self._add_hashes(other.hashes)
+            return
+        if self.registers is None:
+            self._to_registers()
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def _add_hashes(self, hashes: np.ndarray):
+        if self.registers is None:
+            self.hashes = np.union1d(self.hashes, hashes)
+            if len(self.hashes) > self.exact_limit:
+                self._to_registers()
+            return
+        rest_bits = 64 - self.precision
+        buckets = (hashes >> np.uint64(rest_bits)).astype(np.int64)
+        rests = (hashes & np.uint64((1 << rest_bits) - 1)).astype(np.float64)
+        # the position of the leading 1 bit in the rest bits, whose exponent is exact as rests are less than 2 ** 53
+        _, exponents = np.frexp(rests)
+        np.maximum.at(self.registers, buckets, (rest_bits + 1 - exponents).astype(np.uint8))
+
+    def _to_registers(self):
+        hashes, self.hashes = self.hashes, None
+        self.registers = np.zeros(1 << self.precision, dtype=np.uint8)
+        self._add_hashes(hashes)
+
+
+class FrequentItemsSketch:
+    """Sketch of the most frequent values and their counts, which keeps at most capacity values, and can be merged.
+
+    Counts are exact unless there are more than capacity distinct values, in which case values dropped from the
+    sketch lose their counts, so counts of values around the capacity-th are underestimated.
+    """
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.counts = pd.Series([], dtype=np.int64)
+
+    def update(self, values: pd.Series):
+        self._add_counts(values.value_counts(dropna=True))
+
+    def merge(self, other):
+        self._add_counts(other.counts)
+
+    def _add_counts(self, counts: pd.Series):
+        counts = counts if self.counts.empty else self.counts.add(counts, fill_value=0)
+        self.counts = counts.astype(np.int64).nlargest(self.capacity)
+
+    def most_frequent(self, n: int):
+        return self.counts.nlargest(n)
+
+
+class ColumnSketch:
+    """Mergeable statistics of a column, which are the statistics visualized for a DataFrameDirectory.
+
+    Infinite numeric values are treated as missing values, as they are in DataFrameVisualizer. Mean and variance are
+    exact, quantiles are estimated by a QuantileSketch, and the extreme values are kept exactly, so that the outliers
+    of the boxplot are exact, and so are the ranks in the tails, where few values are left to estimate ranks from.
+    The smallest and largest values are disjoint, so all values are kept exactly once until there are more than
+    extremes_count * 2 of them, in which case the statistics are exact.
+    Distinct values are counted for all columns, and the most frequent values are kept for non-numeric columns.
+    """
+
+    def __init__(self, numeric: bool, extremes_count=1000):
+        self.numeric = numeric
+        self.extremes_count = extremes_count
+        self.rows_count = 0
+        self.count = 0
+        self.distinct = DistinctCountSketch()
+        if numeric:
+            self.mean = 0.
+            self.m2 = 0.
+            self.quantiles = QuantileSketch()
+            self.smallest = np.empty(0)
+            self.largest = np.empty(0)
+        else:
+            self.frequent_items = FrequentItemsSketch()
+
+    @classmethod
+    def from_column(cls, column: pd.Series):
+        if column.dtype.name == 'category':
+            column = column.astype(object)
+        sketch = cls(numeric=is_numeric_dtype(column) and not is_bool_dtype(column))
+        sketch.update(column)
+        return sketch
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else np.nan
+
+    @property
+    def min(self):
+        return self.smallest[0] if len(self.smallest) > 0 else np.nan
+
+    @property
+    def max(self):
+        extremes = self.extremes()
+        return extremes[-1] if len(extremes) > 0 else np.nan
+
+    @property
+    def exact(self):
+        """Whether all values are kept as the smallest and largest values."""
+        return self.count <= self.extremes_count * 2
+
+    def extremes(self):
+        """Get the sorted smallest and largest values, which are all values if the sketch is exact."""
+        return np.concatenate([self.smallest, self.largest])
+
+    def ranks(self, xs):
+        """Estimate the number of values less than each x, which is exact if the sketch is exact, or x is not greater
+        than the largest of the smallest values, or greater than the smallest of the largest values."""
+        xs = np.asarray(xs, dtype=np.float64)
+        if self.exact:
+            return np.searchsorted(self.extremes(), xs, side='left').astype(np.float64)
+        ranks = self.quantiles.ranks(xs).astype(np.float64)
+        low = xs <= self.smallest[-1]
+        ranks[low] = np.searchsorted(self.smallest, xs[low], side='left')
+        high = xs > self.largest[0]
+        ranks[high] = self.count - len(self.largest) + np.searchsorted(self.largest, xs[high], side='left')
+        return ranks
+
+    def update(self, column: pd.Series):
+        self.rows_count += len(column)
+        self.distinct.update(column.dropna())
+        if not self.numeric:
+            self.frequent_items.update(column)
+            self.count += int(column.count())
+            return
+
+        values = column.to_numpy(dtype=np.float64, na_value=np.nan)
+        values = values[np.isfinite(values)]
+        other = ColumnSketch(numeric=True, extremes_count=self.extremes_count)
+        other.count = len(values)
+        if other.count > 0:
+            other.mean = float(values.mean())
+            other.m2 = float(np.square(values - other.mean).sum())
+            other.quantiles.update(values)
+            other.smallest, other.largest = self._take_extremes(values)
+        self._merge_numeric(other)
+
+    def merge(self, other):
+        self.rows_count += other.rows_count
+        self.distinct.merge(other.distinct)
+        if not self.numeric:
+            self.frequent_items.merge(other.frequent_items)
+            self.count += other.count
+            return
+        self._merge_numeric(other)
+
+    def _merge_numeric(self, other):
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        # mean and squared deviations are merged by the parallel algorithm of Chan et al.
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+        self.mean += delta * other.count / count
+        self.count = count
+        self.quantiles.merge(other.quantiles)
+        self.smallest, self.largest = self._take_extremes(np.concatenate([self.extremes(), other.extremes()]))
+
+    def _take_extremes(self, values: np.ndarray):
+        # values of both sketches are disjoint, so values are split into disjoint smallest and largest values as well
+        if len(values) <= self.extremes_count * 2:
+            values = np.sort(values)
+            return values[:self.extremes_count], values[self.extremes_count:]
+        smallest = np.sort(np.partition(values, self.extremes_count - 1)[:self.extremes_count])
+        largest = np.sort(np.partition(values, -self.extremes_count)[-self.extremes_count:])
+        return smallest, largest
@@ -11,5 +11,23 @@ USER_FEATURE_DATASET = "User feature dataset"
 RANDOM_SEED = 42
 
 MODEL_SAVE_FILE = "_model.pkl"
+MODEL_MANIFEST_FILE = "_model.json"
+# version of the model artifact layout, which is a json manifest with id vocabs and feature tables in Arrow files
+MODEL_FORMAT_VERSION = 1
+
+# number of instances fed to the model at once when making predictions
+PREDICTION_BATCH_SIZE = 8192
 
 TUPLE_SEP = ","
+
+# memory budget in bytes for the user-item pairs scored at once when recommending items from the whole catalog
+SCORE_MEMORY_BUDGET = 1024 ** 3
+
+# number of candidates retrieved for each user, before they are ranked by the model
+RETRIEVAL_CANDIDATES_COUNT = 500
+
+# number of instances kept in the buffer which shuffles instances across shards when streaming transaction shards
+SHUFFLE_BUFFER_SIZE = 100000
+
+# number of parquet shards read in parallel when converting parquet shards to a DataFrameDirectory
+PARQUET_READ_WORKERS = 4
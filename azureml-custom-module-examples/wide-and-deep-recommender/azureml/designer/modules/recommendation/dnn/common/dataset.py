@@ -1,20 +1,143 @@
+import os
+import numpy as np
 import pandas as pd
-from azureml.studio.core.data_frame_schema import DataFrameSchema
+import pyarrow as pa
+import pyarrow.parquet as pq
+from azureml.studio.core.data_frame_schema import DataFrameSchema, ElementTypeName
+from azureml.studio.core.utils.labeled_list import LabeledList
 from azureml.designer.modules.recommendation.dnn.common.constants import TRANSACTIONS_USER_COL, TRANSACTIONS_ITEM_COL, \
     FEATURES_ID_COL, TRANSACTIONS_RATING_COL
 from azureml.designer.modules.recommendation.dnn.common.entry_param import EntryParam
-from azureml.studio.core.io.data_frame_directory import load_data_frame_from_directory, DataFrameDirectory
+from azureml.designer.modules.recommendation.dnn.common.utils import list_parquet_shards
+from azureml.studio.core.io.any_directory import DirectoryLoadError
+from azureml.studio.core.io.data_frame_directory import load_data_frame_from_directory, DataFrameDirectory, \
+    PARQUET_FORMAT
 
 
 class Dataset(metaclass=EntryParam):
-    def __init__(self, df: pd.DataFrame, column_attributes=None, name: str = None):
-        self.df = df
+    """The class describes a dataset, whose data is a pandas DataFrame.
+
+    A dataset loaded from a DataFrameDirectory is lazy, which means columns are read from the parquet file on first
+    access, and the DataFrame is only built from the columns when it is required. So a dataset of which only a few
+    columns are used, or which is projected to a few columns by select_columns, only reads these columns.
+    If compact_ids is set, id columns read lazily are kept as categorical columns of the dictionary-encoded ids, instead
+    of being decoded to a string object per row.
+    """
+    # indices of id columns, which are read as dictionary-encoded arrow arrays when the dataset is lazy, so that
+    # each distinct id is converted to a python object only once
+    _ID_COLUMNS = ()
+
+    def __init__(self, df: pd.DataFrame = None, column_attributes=None, name: str = None, data_path: str = None):
+        """
+        :param df: data of the dataset
+        :param column_attributes: column attributes of the data, which are required if the data is given by data_path
+        :param name: name of the dataset
+        :param data_path: parquet file of the data, whose columns are read lazily, if df is not given
+        """
+        self._df = df
         self.name = name
+        # source of a lazy dataset, which is the parquet file and the names of columns in it
+        self._data_path = None
+        self._data_schema = None
+        self._column_names = None
+        self._rows_count = None
+        # columns read from the parquet file, which are arrow arrays until they are converted to pandas
+        self._arrays = {}
+        self._series = {}
+        self.compact_ids = False
+        if df is None and data_path is not None:
+            parquet_file = pq.ParquetFile(data_path)
+            self._data_path = data_path
+            self._data_schema = parquet_file.schema.to_arrow_schema()
+            self._column_names = pd.Index(column_attributes.names)
+            self._rows_count = parquet_file.metadata.num_rows
         if column_attributes is None:
             self.column_attributes = self.build_column_attributes()
         else:
             self.column_attributes = column_attributes
 
+    @property
+    def df(self):
+        if self._df is None:
+            columns = [self.get_column(col_idx) for col_idx in range(self.column_size)]
+            # columns are not copied, since they are only referenced by the DataFrame once the lazy source is cleared
+            self._df = pd.concat(columns, axis=1, copy=False) if columns else \
+                pd.DataFrame(index=pd.RangeIndex(self._rows_count))
+            self._clear_lazy_source()
+        return self._df
+
+    @df.setter
+    def df(self, df: pd.DataFrame):
+        self._df = df
+        self._clear_lazy_source()
+
+    def _clear_lazy_source(self):
+        self._data_path = None
+        self._data_schema = None
+        self._column_names = None
+        self._rows_count = None
+        self._arrays = {}
+        self._series = {}
+
+    def get_column(self, col_idx: int):
+        """Get the column of the index as a pandas Series, which is read from the parquet file if the dataset is lazy.
+
+        :param col_idx: index of the column
+        :return: pd.Series
+        """
+        if self._df is not None:
+            return self._df.iloc[:, col_idx]
+        name = self._column_names[col_idx]
+        if name not in self._series:
+            column = self._read_column_array(col_idx).to_pandas()
+            if self.get_element_type(col_idx) == ElementTypeName.CATEGORY:
+                column = column.astype('category')
+            elif column.dtype.name == 'category' and not self.compact_ids:
+                # dictionary-encoded ids are decoded by taking the distinct ids, so rows share the id objects
+                column = column.astype(object)
+            column.name = name
+            self._series[name] = column
+            self._arrays.pop(name, None)
+        return self._series[name]
+
+    def _read_column_array(self, col_idx: int):
+        name = self._column_names[col_idx]
+        if name not in self._arrays:
+            field = self._data_schema.field(name)
+            is_id_string = col_idx in self._ID_COLUMNS and (pa.types.is_string(field.type) or
+                                                            pa.types.is_binary(field.type))
+            table = pq.read_table(self._data_path, columns=[name], read_dictionary=[name] if is_id_string else None)
+            self._arrays[name] = table.column(0)
+        return self._arrays[name]
+
+    def _set_column(self, col_idx: int, column: pd.Series):
+        if self._df is not None:
+            name = self._df.columns[col_idx]
+            if self._df.columns.is_unique:
+                # the column is replaced instead of updated in place, so that a new dtype, e.g. of compact ids, is kept
+                self._df[name] = column
+            else:
+                self._df.iloc[:, col_idx] = column
+        else:
+            name = self._column_names[col_idx]
+            self._series[name] = column.rename(name)
+            self._arrays.pop(name, None)
+
+    def select_columns(self, col_indices):
+        """Keep the columns of the indices only, without reading any column if the dataset is lazy.
+
+        :param col_indices: list or slice of column indices
+        """
+        if self._df is not None:
+            self.df = self._df.iloc[:, col_indices]
+            self.build_column_attributes()
+            return
+        indices = np.arange(self.column_size)[col_indices]
+        self._column_names = self._column_names[indices]
+        self._arrays = {name: array for name, array in self._arrays.items() if name in self._column_names}
+        self._series = {name: column for name, column in self._series.items() if name in self._column_names}
+        self.column_attributes = LabeledList.from_items(self.column_attributes[int(idx)] for idx in indices)
+
     def get_column_type(self, col_key):
         return self.column_attributes[col_key].column_type
 
@@ -27,19 +150,24 @@ class Dataset(metaclass=EntryParam):
 
     @property
     def column_size(self):
-        return self.df.shape[1]
+        return self.df.shape[1] if self._df is not None else len(self._column_names)
 
     @property
     def row_size(self):
-        return self.df.shape[0]
+        return self.df.shape[0] if self._df is not None else self._rows_count
 
     @property
     def columns(self):
-        return self.df.columns
+        return self.df.columns if self._df is not None else self._column_names
 
     @classmethod
     def load(cls, load_from: str):
         if isinstance(load_from, str):
+            dfd = cls._load_directory_meta(load_from)
+            data_path = dfd.full_data_path(load_from)
+            # the data is read lazily, unless there is no schema to describe the columns without reading the data
+            if dfd.file_format == PARQUET_FORMAT and dfd.schema is not None and os.path.isfile(data_path):
+                return cls(column_attributes=dfd.schema_instance.column_attributes, data_path=data_path)
             dfd = load_data_frame_from_directory(load_from_dir=load_from)
             return cls(df=dfd.data, column_attributes=dfd.schema_instance.column_attributes)
         elif isinstance(load_from, DataFrameDirectory):
@@ -47,45 +175,53 @@ class Dataset(metaclass=EntryParam):
         else:
             raise NotImplementedError(f"Cannot load data from {load_from} of type {type(load_from)}")
 
+    @staticmethod
+    def _load_directory_meta(load_from: str):
+        try:
+            return DataFrameDirectory.load(load_from, load_data=False)
+        except BaseException as e:
+            raise DirectoryLoadError(dir_name=load_from, original_error=e) from e
+
 
 class TransactionDataset(Dataset):
     """The class describes transactions for recommendation task.
 
     A valid transaction dataset should have at least two columns, where the first column represents user ids,
     the second column represent item ids, and an optional rating column as the last column."""
+    _ID_COLUMNS = (TRANSACTIONS_USER_COL, TRANSACTIONS_ITEM_COL)
 
     @property
     def users(self):
         if self.column_size - 1 >= TRANSACTIONS_USER_COL:
-            return self.df.iloc[:, TRANSACTIONS_USER_COL]
+            return self.get_column(TRANSACTIONS_USER_COL)
         else:
             return None
 
     @users.setter
     def users(self, users: pd.Series):
         if self.column_size - 1 >= TRANSACTIONS_USER_COL:
-            self.df.iloc[:, TRANSACTIONS_USER_COL] = users
+            self._set_column(TRANSACTIONS_USER_COL, users)
         else:
             self.df[users.name] = users
 
     @property
     def items(self):
         if self.column_size - 1 >= TRANSACTIONS_ITEM_COL:
-            return self.df.iloc[:, TRANSACTIONS_ITEM_COL]
+            return self.get_column(TRANSACTIONS_ITEM_COL)
         else:
             return None
 
     @items.setter
     def items(self, items: pd.Series):
         if self.column_size - 1 >= TRANSACTIONS_ITEM_COL:
-            self.df.iloc[:, TRANSACTIONS_ITEM_COL] = items
+            self._set_column(TRANSACTIONS_ITEM_COL, items)
         else:
             self.df[items.name] = items
 
     @property
     def ratings(self):
         if self.column_size - 1 >= TRANSACTIONS_RATING_COL:
-            return self.df.iloc[:, TRANSACTIONS_RATING_COL]
+            return self.get_column(TRANSACTIONS_RATING_COL)
         else:
             return None
 
@@ -93,7 +229,7 @@ class TransactionDataset(Dataset):
     def ratings(self, ratings: pd.Series):
         if self.column_size - 1 >= TRANSACTIONS_RATING_COL:
             # if data has rating column, then set rating column values with ratings, and ignore ratings name
-            self.df.iloc[:, TRANSACTIONS_RATING_COL] = ratings
+            self._set_column(TRANSACTIONS_RATING_COL, ratings)
         else:
             # if data doesn't have rating column, then add a rating column with ratings, as well as its name
             self.df[ratings.name] = ratings
@@ -104,15 +240,91 @@ class FeatureDataset(Dataset):
 
     The feature column should have at least two columns, where the first column represents user/item ids, and
     the remaining columns represents all features."""
+    _ID_COLUMNS = (FEATURES_ID_COL,)
 
     @property
     def ids(self):
-        return self.df.iloc[:, FEATURES_ID_COL]
+        return self.get_column(FEATURES_ID_COL)
 
     @ids.setter
     def ids(self, ids):
-        self.df.iloc[:, FEATURES_ID_COL] = ids
+        self._set_column(FEATURES_ID_COL, ids)
 
     @property
     def features(self):
         return self.df.iloc[:, FEATURES_ID_COL + 1:]
+
+
+class TransactionShards(metaclass=EntryParam):
+    """The class describes transactions stored as a directory of parquet shards, which are read one shard at a time.
+
+    Each shard is a parquet file with the same columns as a transaction dataset, so that transactions larger than
+    memory can be streamed shard by shard.
+    """
+    _DATA_FRAME_DIRECTORY_META_FILE = "_meta.yaml"
+
+    def __init__(self, paths: list, name: str = None):
+        self.paths = paths
+        self.name = name
+        # number of instances in each shard, which is updated to the number of valid instances by preprocess
+        self.instances_counts = np.array([pq.ParquetFile(path).metadata.num_rows for path in paths], dtype=np.int64)
+        # unique user and item ids of all shards, which are collected by preprocess
+        self.users = None
+        self.items = None
+        self._schema = pq.read_schema(paths[0]) if paths else None
+        self._column_attributes = None
+
+    @classmethod
+    def is_shards_directory(cls, load_from: str):
+        """Check if the directory contains parquet shards instead of a DataFrameDirectory."""
+        return os.path.isdir(load_from) and \
+            not os.path.exists(os.path.join(load_from, cls._DATA_FRAME_DIRECTORY_META_FILE)) and \
+            len(list_parquet_shards(load_from)) > 0
+
+    @classmethod
+    def load(cls, load_from: str):
+        return cls(paths=list_parquet_shards(load_from))
+
+    @property
+    def shards_count(self):
+        return len(self.paths)
+
+    @property
+    def column_size(self):
+        return len(self._schema.names)
+
+    @property
+    def row_size(self):
+        return int(self.instances_counts.sum())
+
+    @property
+    def columns(self):
+        return pd.Index(self._schema.names)
+
+    def get_column_type(self, col_key):
+        # column types are inferred from the first shard, as the schema is shared by all shards
+        if self._column_attributes is None:
+            self._column_attributes = self.read_shard(0).column_attributes
+        return self._column_attributes[col_key].column_type
+
+    def read_shard(self, shard_idx: int):
+        df = pq.read_table(self.paths[shard_idx], columns=self._schema.names).to_pandas()
+        return TransactionDataset(df=df, name=self.name)
+
+
+class TrainingTransactions(metaclass=EntryParam):
+    """The entry param type of training transactions, which are loaded as either TransactionShards or
+    TransactionDataset, and never as an instance of this class."""
+
+    @staticmethod
+    def load(load_from):
+        """Load training transactions, which are streamed if given by a directory of parquet shards.
+
+        A DataFrameDirectory is loaded as a TransactionDataset in memory instead, and loaded transactions are
+        returned as they are.
+        """
+        if isinstance(load_from, (TransactionDataset, TransactionShards)):
+            return load_from
+        if isinstance(load_from, str) and TransactionShards.is_shards_directory(load_from):
+            return TransactionShards.load(load_from)
+        return TransactionDataset.load(load_from)
@@ -1,10 +1,12 @@
+import os
 import pandas as pd
 import numpy as np
 from azureml.studio.core.logger import common_logger
 from azureml.studio.internal.error import ErrorMapping, ColumnNotFoundError
 from azureml.designer.modules.recommendation.dnn.common.dataset import FeatureDataset
 from azureml.studio.core.data_frame_schema import ColumnTypeName
-from azureml.designer.modules.recommendation.dnn.common.utils import convert_to_str, convert_to_float
+from azureml.designer.modules.recommendation.dnn.common.utils import convert_to_str, convert_to_float, \
+    get_indexer, write_arrow_table, read_arrow_table
 
 
 class FeatureMeta:
@@ -23,15 +25,26 @@ class FeatureMeta:
     def is_numeric_feature(self):
         return self.vocab is None
 
+    def to_dict(self):
+        return {"name": self.name, "type_": self.type_, "fill": self.fill,
+                "vocab": None if self.vocab is None else np.asarray(self.vocab).tolist()}
+
+    @classmethod
+    def from_dict(cls, meta: dict):
+        vocab = None if meta["vocab"] is None else np.array(meta["vocab"], dtype=object)
+        return cls(name=meta["name"], type_=meta["type_"], fill=meta["fill"], vocab=vocab)
+
 
 class FeatureBuilder:
     """The tool class helps recommenders to build training/test dataset with normalized features.
 
     The class has three main functionality:
     1. Record (user/item) ids vocab in id_vocab attribute. This attr is usually init during training stage and re-used
-    in score stage.
+    in score stage. The ids can also be encoded as integer codes, which are positions in id_vocab, or converted to
+    compact ids, which are categorical ids holding these codes.
     2. Record features in _features_df and _features_meta attributes. These attrs would be used to build dataset with
-    features, which is usually used in hybrid recommendation.
+    features, which is usually used in hybrid recommendation. An id index and filled feature columns are cached, so
+    that features are gathered by positions instead of merged.
     3. Provide update method to update features for unseen ids during training.
     """
 
@@ -48,11 +61,16 @@ class FeatureBuilder:
         :param feat_key_suffix: when rename features, this string will be append the new names, this param is useful
         when there will be many feature builders and to avoid duplicate feature keys
         """
+        # the Arrow files of id vocab and features, which are only recorded by the load method
+        self._artifact_paths = None
         ids = convert_to_str(ids).dropna().unique()
         self.id_vocab = pd.Series(ids, name=id_key)
+        self._id_index = pd.Index(ids)
 
         self._features_df = None
+        self._features_table = None
         self._feature_metas = {}
+        self._reset_feature_cache()
         if features is not None:
             common_logger.info(f"Get {features.features.shape[1]} features")
             features_df = pd.DataFrame({id_key: convert_to_str(features.ids)})
@@ -81,26 +99,122 @@ class FeatureBuilder:
         """
         # should ensure returned ids are equal order and length with the input
         common_logger.info("Build ids")
-        ids = convert_to_str(ids.dropna())
-        features_df = pd.DataFrame({self.id_key: ids}).reset_index(drop=True)
+        ids, positions = self.build_indices(ids=ids)
+        features = {self.id_key: ids}
 
         if self.feature_metas:
             common_logger.info(f"Build {len(self.feature_metas)} features for {self.id_key} ids.")
-            features_df = pd.merge(features_df, self._features_df, how='left', on=[self.id_key])
-            for key, meta in self.feature_metas.items():
-                feature = features_df[key]
-                features_df[key] = self._fill_feature_na(feature=feature, feature_meta=meta)
+            for key, feature in self._get_feature_columns().items():
+                features[key] = feature.take(positions)
+
+        return pd.DataFrame(features)
+
+    def to_categorical_ids(self, ids: pd.Series):
+        """Convert ids to compact ids, which are a categorical column of string ids, whose categories are id_vocab
+        followed by unseen ids.
+
+        So codes of known ids are their positions in id_vocab, and compact ids of the feature builder share the same
+        codes, which are encoded by encode_ids without looking up strings.
+        :param ids: ids, which are converted to strings as the build method does
+        :return: pd.Series of categorical type, with the same index as ids
+        """
+        ids = convert_to_str(ids, categorical=True)
+        categories = ids.cat.categories
+        vocab_size = len(self._id_index)
+        if len(categories) >= vocab_size and categories[:vocab_size].equals(self._id_index):
+            return ids
+
+        positions = self._id_index.get_indexer(categories)
+        unseen = positions < 0
+        positions[unseen] = vocab_size + np.arange(np.count_nonzero(unseen))
+        # missing ids are coded as -1, which takes the -1 appended
+        codes = np.append(positions, -1).take(ids.cat.codes.values)
+        categories = self._id_index.append(categories[unseen])
+        return pd.Series(pd.Categorical.from_codes(codes, categories=categories), index=ids.index, name=ids.name)
+
+    def encode_ids(self, ids: pd.Series):
+        """Encode ids as int32 codes, which are the positions of ids in id_vocab.
+
+        :param ids: string ids, which are usually returned by the build or build_indices method, or compact ids
+        :return: int32 numpy array, unseen ids are encoded as oov_code.
+        """
+        codes = get_indexer(index=self._id_index, ids=ids).astype(np.int32)
+        codes[codes < 0] = self.oov_code
+        return codes
+
+    def encode_signatures(self, ids: pd.Series):
+        """Encode ids as signature codes, where ids with the same model inputs share the same code.
+
+        Known ids have distinct id codes, so they have distinct signatures unless duplicated. Unseen ids share the OOV
+        code, so unseen ids with equal features, e.g. cold-start ids whose features are all filled, share a signature.
+        :param ids: string ids, without missing values
+        :return: int64 numpy array, signature codes in range [0, signatures_count) in the order of first occurrences.
+        """
+        ids, positions = self.build_indices(ids=ids)
+        keys = self.encode_ids(ids=ids).astype(np.int64)
+        unseen = keys == self.oov_code
+        if unseen.any() and self.feature_metas:
+            # unseen ids are told apart by feature values, since different feature rows may hold equal values
+            unique_positions, position_codes = np.unique(positions[unseen], return_inverse=True)
+            rows = pd.DataFrame({key: feature[unique_positions]
+                                 for key, feature in self._get_feature_columns().items()})
+            row_codes = rows.groupby(list(rows.columns), sort=False).ngroup().values
+            keys[unseen] = self.oov_code + row_codes[position_codes]
+        return pd.factorize(keys)[0].astype(np.int64)
+
+    def build_indices(self, ids: pd.Series):
+        """Build ids with the positions of their features in the feature tables.
+
+        This is the normalized counterpart of the build method, which only returns positions instead of copying
+        features for each id. The features can then be gathered from the feature tables by the positions.
+        :param ids: the identifiers to built with feature positions
+        :return: tuple of (ids, positions), where ids is a pd.Series of string ids, which are still compact ids if
+        compact ids are given, and positions is an int64 numpy array, ids without features are mapped to the fill row
+        at the end of the feature tables.
+        """
+        ids = convert_to_str(ids.dropna(), categorical=ids.dtype.name == 'category').reset_index(drop=True)
+        if not self._has_features():
+            return ids, np.zeros(len(ids), dtype=np.int64)
+
+        self._build_feature_cache()
+        positions = get_indexer(index=self._features_index, ids=ids).astype(np.int64)
+        positions[positions < 0] = len(self._features_index)
+        return ids, positions
 
-        return features_df
+    def build_feature_tables(self):
+        """Build normalized feature tables, whose rows are aligned with the positions returned by build_indices.
 
-    def update(self, features: FeatureDataset):
-        """Update existing features with the new features dataset.
+        Missing values are filled, and a fill row is appended at the end for ids without features.
+        :return: dict of feature key to numpy array, numeric features are of float32 type, and the others are strings.
+        """
+        tables = {}
+        for key, feature in self._get_feature_columns().items():
+            if self.feature_metas[key].is_numeric_feature():
+                tables[key] = feature.astype(np.float32)
+            else:
+                tables[key] = feature
+
+        return tables
+
+    @property
+    def feature_rows_count(self):
+        self._load_artifacts()
+        if self._features_table is not None:
+            return self._features_table.num_rows
+        return 0 if self._features_df is None else len(self._features_df)
+
+    def update(self, features: FeatureDataset, ids: pd.Series = None):
+        """Update existing features with the new features dataset, and optionally extend the id vocab with new ids.
 
         The method checks the compatibility between existing features and new features dataset. Then update
         unseen identifiers features according to new features. The features for existing identifiers would not be
         updated.
         :param features: FeatureDataset, the new features dataset provided to update the existing features.
+        :param ids: optional ids, e.g. of new transactions to continue training with, unseen ids are appended to the
+        id vocab, so that the codes of existing ids are kept. Vocabs of categorical features are not extended.
         """
+        if ids is not None:
+            self._extend_id_vocab(ids=ids)
         if not self.feature_metas or not features:
             common_logger.info(f"Update feature metas with None features or feature metas")
             return
@@ -118,6 +232,15 @@ class FeatureBuilder:
         new_features_df = new_features_df[~existed_ids]
 
         self._features_df = new_features_df
+        self._reset_feature_cache()
+
+    def _extend_id_vocab(self, ids: pd.Series):
+        ids = convert_to_str(ids).dropna().unique()
+        new_ids = ids[self._id_index.get_indexer(ids) < 0]
+        common_logger.info(f"Extend {len(self.id_vocab)} {self.id_key} ids with {len(new_ids)} new ids")
+        if len(new_ids) > 0:
+            self.id_vocab = pd.Series(np.append(self.id_vocab.values, new_ids), name=self.id_key)
+            self._id_index = pd.Index(self.id_vocab.values)
 
     def _check_features(self, features: FeatureDataset):
         """Check compatibility between recorded features and the given features.
@@ -136,6 +259,51 @@ class FeatureBuilder:
                 ErrorMapping.verify_element_type(type_=column_type, expected_type=feature_meta.type_, column_name=name,
                                                  arg_name=features.name)
 
+    def _has_features(self):
+        # the memory-mapped table is checked first, so that the features are not converted to a data frame
+        self._load_artifacts()
+        return self._features_table is not None or self._features_df is not None
+
+    def _get_features_column(self, key: str):
+        """Get a column of features, which is converted from the memory-mapped features table if the features are
+        not converted to _features_df, so that only the columns used are converted."""
+        self._load_artifacts()
+        if self._features_table is not None:
+            # ids are unique, so deduplicating string objects only costs time, while rows of string features share
+            # the objects of distinct values
+            column = self._features_table.column(key).to_pandas(deduplicate_objects=key != self.id_key)
+            return pd.Series(column, name=key)
+        return self._features_df[key]
+
+    def _reset_feature_cache(self):
+        self._features_index = None
+        self._feature_columns = None
+
+    def _build_feature_cache(self):
+        """Build the id index and the filled feature columns of _features_df.
+
+        Missing values of feature columns are filled, and a fill row is appended to each column for ids without
+        features, so that building features is a single gather by the positions from the id index.
+        """
+        if self._features_index is not None or not self._has_features():
+            return
+
+        # features_df ids are unique, because duplicated ids are dropped in update method
+        self._features_index = pd.Index(self._get_features_column(self.id_key).values)
+        self._feature_columns = {}
+        for key, meta in self.feature_metas.items():
+            feature = self._fill_feature_na(feature=self._get_features_column(key), feature_meta=meta)
+            if meta.is_numeric_feature():
+                self._feature_columns[key] = np.append(feature.values.astype(np.float64), meta.fill)
+            else:
+                # updated features are not normalized, so convert them to strings as the model input does
+                feature = convert_to_str(feature).values
+                self._feature_columns[key] = np.append(feature, meta.fill)
+
+    def _get_feature_columns(self):
+        self._build_feature_cache()
+        return self._feature_columns
+
     @staticmethod
     def _fill_feature_na(feature: pd.Series, feature_meta: FeatureMeta):
         if feature_meta.type_ == ColumnTypeName.NUMERIC:
@@ -178,6 +346,133 @@ class FeatureBuilder:
 
         return feature_meta
 
+    def save(self, save_to: str, prefix: str):
+        """Save id vocab and features into Arrow files under the save_to directory.
+
+        :param save_to: the directory to save files
+        :param prefix: the prefix of file names, to avoid conflicts between feature builders
+        :return: dict, the json serializable manifest, which records feature metas and file names.
+        """
+        ids_file = f"{prefix}_ids.arrow"
+        write_arrow_table(df=self.id_vocab.to_frame(), path=os.path.join(save_to, ids_file))
+        features_file = None
+        if self._features_df is not None:
+            features_file = f"{prefix}_features.arrow"
+            write_arrow_table(df=self._features_df.reset_index(drop=True), path=os.path.join(save_to, features_file))
+
+        return {"id_key": self.id_key,
+                "ids_file": ids_file,
+                "features_file": features_file,
+                "feature_metas": dict((key, meta.to_dict()) for key, meta in self.feature_metas.items())}
+
+    @classmethod
+    def load(cls, load_from: str, manifest: dict):
+        """Load the feature builder saved by the save method.
+
+        Only feature metas are loaded at once, the Arrow files are memory-mapped on first access of the id vocab or
+        features, and features are converted column by column when they are built, see _build_feature_cache.
+        """
+        feature_builder = cls.__new__(cls)
+        feature_builder._feature_metas = dict((key, FeatureMeta.from_dict(meta))
+                                              for key, meta in manifest["feature_metas"].items())
+        feature_builder._reset_feature_cache()
+        features_file = manifest["features_file"]
+        feature_builder._artifact_paths = (manifest["id_key"], os.path.join(load_from, manifest["ids_file"]),
+                                           os.path.join(load_from, features_file) if features_file else None)
+        return feature_builder
+
+    def _load_artifacts(self):
+        """Read the id vocab and memory-map the features table from the Arrow files recorded by the load method.
+
+        It is called on first access of id_vocab, _id_index and features, and does nothing after that or for feature
+        builders which are not loaded.
+        """
+        if self._artifact_paths is None:
+            return
+
+        id_key, ids_path, features_path = self._artifact_paths
+        for path in (ids_path, features_path):
+            if path is not None and not os.path.exists(path):
+                raise FileNotFoundError(f"Failed to load {id_key} ids and features, because {path} is removed. The "
+                                        f"directory of the loaded model should be kept while the model is used.")
+
+        common_logger.info(f"Load {id_key} ids and features")
+        # ids are unique, so deduplicating string objects only costs time, and the id vocab and the id index share
+        # the strings converted from the memory-mapped column
+        ids = read_arrow_table(path=ids_path).column(id_key).to_pandas(deduplicate_objects=False)
+        self._lazy_id_vocab = pd.Series(ids, name=id_key)
+        self._lazy_id_index = pd.Index(self._lazy_id_vocab.values)
+        # _features_df is converted from the table only when it is used as a whole, see _convert_features_table
+        self._features_table = read_arrow_table(path=features_path) if features_path else None
+        self._lazy_features_df = None
+        self._artifact_paths = None
+
+    @property
+    def id_vocab(self):
+        self._load_artifacts()
+        return self._lazy_id_vocab
+
+    @id_vocab.setter
+    def id_vocab(self, id_vocab: pd.Series):
+        self._lazy_id_vocab = id_vocab
+
+    @property
+    def _id_index(self):
+        self._load_artifacts()
+        return self._lazy_id_index
+
+    @_id_index.setter
+    def _id_index(self, id_index: pd.Index):
+        self._lazy_id_index = id_index
+
+    @property
+    def _features_df(self):
+        self._convert_features_table()
+        return self._lazy_features_df
+
+    @_features_df.setter
+    def _features_df(self, features_df: pd.DataFrame):
+        self._lazy_features_df = features_df
+
+    def _convert_features_table(self):
+        """Convert the memory-mapped features table to _features_df, which replaces the table from then on.
+
+        Features are converted as a whole only when they are updated, saved or pickled.
+        """
+        self._load_artifacts()
+        if self._features_table is not None:
+            self._lazy_features_df = self._features_table.to_pandas()
+            self._features_table = None
+
+    def __getstate__(self):
+        self._convert_features_table()
+        state = self.__dict__.copy()
+        # the feature cache can be rebuilt from _features_df, so it is not pickled
+        state["_features_index"] = None
+        state["_feature_columns"] = None
+        return state
+
+    def __setstate__(self, state):
+        # feature builders pickled by previous versions hold the lazy attributes by their own names
+        for name, lazy_name in (("id_vocab", "_lazy_id_vocab"), ("_id_index", "_lazy_id_index"),
+                                ("_features_df", "_lazy_features_df")):
+            if name in state:
+                state[lazy_name] = state.pop(name)
+        self.__dict__.update(state)
+        if "_artifact_paths" not in state:
+            self._artifact_paths = None
+        # feature builders pickled by previous versions do not have the id index and feature cache
+        if "_lazy_id_index" not in state:
+            self._id_index = pd.Index(self.id_vocab.values)
+        if "_feature_columns" not in state:
+            self._reset_feature_cache()
+        if "_features_table" not in state:
+            self._features_table = None
+
+    @property
+    def oov_code(self):
+        return len(self.id_vocab)
+
     @property
     def feature_metas(self):
         return self._feature_metas
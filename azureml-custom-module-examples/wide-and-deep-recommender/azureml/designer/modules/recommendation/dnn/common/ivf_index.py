@@ -0,0 +1,97 @@
+import numpy as np
+from azureml.designer.modules.recommendation.dnn.common.constants import RANDOM_SEED
+
+
+class IVFIndex:
+    """The class clusters vectors into inverted lists with k-means, so that candidates are retrieved by a few lists.
+
+    The vectors of list c are at positions indices[indptr[c]:indptr[c + 1]], and assignments[i] is the list of vector
+    i. Lists are probed in the descending order of scores given by the caller, e.g. the model scores of the list
+    centroids for a query, so the index works for any score smooth over the vector space, not only inner products.
+    Centroids are in the space of vectors scaled by the weights.
+    """
+
+    def __init__(self, vectors: np.ndarray, lists_count: int, weights: np.ndarray = None, iterations=10,
+                 max_training_vectors=65536, chunk_size=65536, random_seed=RANDOM_SEED):
+        """Cluster vectors with k-means, which is trained on a random sample of vectors.
+
+        :param vectors: float array with shape (n, dimension), which can be memory-mapped
+        :param lists_count: number of lists, no more than the number of vectors
+        :param weights: float array with shape (dimension,), the scale of each dimension in distances, so that vectors
+        are clustered by the dimensions which matter for scores. None means no scaling.
+        :param iterations: number of k-means iterations
+        :param max_training_vectors: max number of vectors sampled to train k-means
+        :param chunk_size: number of vectors assigned at once, which bounds the memory of distances
+        :param random_seed: the seed of sampling and centroid initialization
+        """
+        random_state = np.random.RandomState(random_seed)
+        vectors_count = len(vectors)
+        lists_count = max(1, min(lists_count, vectors_count))
+        self.chunk_size = chunk_size
+        self.weights = None if weights is None else np.asarray(weights, dtype=np.float32)
+
+        training_positions = np.sort(random_state.choice(vectors_count, min(vectors_count, max_training_vectors),
+                                                         replace=False))
+        training_vectors = self._scale(vectors[training_positions])
+        self.centroids = training_vectors[random_state.choice(len(training_vectors), lists_count, replace=False)]
+        for _ in range(iterations):
+            self._update_centroids(training_vectors, self._assign(training_vectors, scaled=True))
+
+        self.assignments = self._assign(vectors)
+        self.indices = np.argsort(self.assignments, kind='stable')
+        self.list_sizes = np.bincount(self.assignments, minlength=lists_count)
+        self.indptr = np.zeros(lists_count + 1, dtype=np.int64)
+        np.cumsum(self.list_sizes, out=self.indptr[1:])
+
+    @property
+    def lists_count(self):
+        return len(self.centroids)
+
+    def _scale(self, vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        return vectors if self.weights is None else vectors * self.weights
+
+    def _assign(self, vectors: np.ndarray, scaled=False):
+        """Assign each vector to the list of its nearest centroid, chunk by chunk.
+
+        :param scaled: whether vectors are already scaled by weights, like the centroids
+        """
+        centroid_norms = np.square(self.centroids).sum(axis=1)
+        assignments = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), self.chunk_size):
+            chunk = vectors[start:start + self.chunk_size]
+            chunk = chunk if scaled else self._scale(chunk)
+            # squared norms of vectors do not change the nearest centroid, so they are omitted
+            distances = centroid_norms - 2 * chunk @ self.centroids.T
+            assignments[start:start + len(chunk)] = np.argmin(distances, axis=1)
+        return assignments
+
+    def _update_centroids(self, vectors: np.ndarray, assignments: np.ndarray):
+        # centroids of empty lists are kept, so that they may be assigned in the following iterations
+        counts = np.bincount(assignments, minlength=self.lists_count)
+        nonempty = counts > 0
+        for dim in range(vectors.shape[1]):
+            sums = np.bincount(assignments, weights=vectors[:, dim], minlength=self.lists_count)
+            self.centroids[nonempty, dim] = sums[nonempty] / counts[nonempty]
+
+    def probe(self, list_scores: np.ndarray, candidates_count: int):
+        """Retrieve candidates for queries from the lists with top scores.
+
+        Lists are probed in the descending score order until the query gets at least candidates_count candidates, or
+        all lists are probed.
+        :param list_scores: float array with shape (queries, lists_count), the score of each list for each query
+        :param candidates_count: min number of candidates to retrieve for each query
+        :return: tuple of (query_positions, vector_positions), int64 arrays of retrieved query-vector pairs, where
+        pairs of the same query are contiguous.
+        """
+        order = np.argsort(-list_scores, axis=1, kind='stable')
+        sizes = self.list_sizes[order]
+        probed = np.cumsum(sizes, axis=1) - sizes < candidates_count
+        queries, ranks = np.nonzero(probed)
+        lists = order[queries, ranks]
+        lengths = self.list_sizes[lists]
+        # the retrieved vectors are concatenated ranges of indices, which are gathered at once
+        offsets = np.cumsum(lengths) - lengths
+        starts = np.repeat(self.indptr[lists] - offsets, lengths)
+        vector_positions = self.indices[starts + np.arange(lengths.sum())]
+        return np.repeat(queries, lengths).astype(np.int64), vector_positions
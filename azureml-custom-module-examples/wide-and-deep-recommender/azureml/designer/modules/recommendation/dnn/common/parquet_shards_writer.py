@@ -0,0 +1,170 @@
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from azureml.studio.core.data_frame_schema import DataFrameSchema, ColumnTypeName
+from azureml.studio.core.io.data_frame_directory import save_data_frame_to_directory
+from azureml.studio.core.io.data_frame_visualizer import DataFrameVisualizer, BoxplotLayout, HistogramLayout, \
+    HistogramBin, ElementEncoder
+from azureml.studio.core.logger import common_logger, TimeProfile
+from azureml.designer.modules.recommendation.dnn.common.column_sketch import ColumnSketch
+from azureml.designer.modules.recommendation.dnn.common.constants import PARQUET_READ_WORKERS
+from azureml.designer.modules.recommendation.dnn.common.utils import list_parquet_shards, read_ahead
+
+_DATA_FILE_PATH = '_data.parquet'
+
+
+class SketchDataFrameVisualizer(DataFrameVisualizer):
+    """Visualizer of a DataFrame whose statistics are given by column sketches, instead of computed on the data.
+
+    The data is only a sample of the rows, which is shown as the rows of the DataFrame. Internals of the
+    DataFrameVisualizer of azureml-designer-core 0.0.33 are overridden, so the version is pinned by the module spec.
+    """
+
+    def __init__(self, data: pd.DataFrame, schema, column_sketches: list, rows_count: int):
+        self.column_sketches = column_sketches
+        self.rows_count = rows_count
+        super().__init__(data=data, schema=schema, compute_stats=True)
+
+    def compute_statistics(self, data):
+        # statistics are given by the column sketches
+        return pd.DataFrame()
+
+    def _get_data_frame_visualization(self):
+        visualization = super()._get_data_frame_visualization()
+        visualization['numberOfRows'] = self.rows_count
+        return visualization
+
+    def _get_statistics(self):
+        features = [
+            self._attr_visualization(i, name, 'float64', 'Numeric') for i, name in enumerate(self.ALL_STAT_NAMES)
+        ]
+        records = [] if self.rows_count == 0 else [self._sketch_statistics(sketch) for sketch in self.column_sketches]
+        return self.visualization_item(records, features, self.num_of_cols, len(self.ALL_STAT_NAMES))
+
+    def _sketch_statistics(self, sketch: ColumnSketch):
+        stats = {self.UNIQUE_KEY: sketch.distinct.count, self.MISSING_KEY: sketch.rows_count - sketch.count}
+        if sketch.numeric and sketch.count > 0:
+            stats.update({'Mean': sketch.mean, 'Median': sketch.quantiles.quantiles([0.5])[0], 'Min': sketch.min,
+                          'Max': sketch.max, 'Standard Deviation': sketch.std})
+        return [ElementEncoder.encode(stats.get(key, np.nan)) for key in self.ALL_STAT_NAMES]
+
+    def _get_graph_layout(self):
+        features = [
+            self._attr_visualization(i, name, 'object', 'Object') for i, name in enumerate(['Histogram', 'Boxplot'])
+        ]
+        layouts = [] if self.rows_count == 0 else [
+            self._sketch_hist_boxplot(sketch, self.column_attrs[i]) for i, sketch in enumerate(self.column_sketches)
+        ]
+        return self.visualization_item(layouts, features, self.num_of_cols, numberOfColumns=2)
+
+    @staticmethod
+    def _sketch_hist_boxplot(sketch: ColumnSketch, col_attr):
+        if not sketch.numeric:
+            bins = [HistogramBin(x=value, dx='', y=count)
+                    for value, count in sketch.frequent_items.most_frequent(HistogramLayout.NUMBER_OF_BINS).items()]
+            return {"Bins": [bin_.to_json() for bin_ in bins], "NumberOfRecords": sketch.rows_count}, None
+        if sketch.count == 0 or col_attr['type'] != ColumnTypeName.NUMERIC:
+            return {"Bins": [], "NumberOfRecords": sketch.rows_count}, None
+        return SketchDataFrameVisualizer._numeric_histogram(sketch), SketchDataFrameVisualizer._boxplot(sketch)
+
+    @staticmethod
+    def _numeric_histogram(sketch: ColumnSketch):
+        # bins are the same as np.histogram, which are equal intervals from min to max, including max in the last bin
+        min_value, max_value = sketch.min, sketch.max
+        if min_value == max_value:
+            min_value, max_value = min_value - 0.5, max_value + 0.5
+        edges = np.linspace(min_value, max_value, HistogramLayout.NUMBER_OF_BINS + 1)
+        ranks = np.concatenate([[0], sketch.ranks(edges[1:-1]), [sketch.count]])
+        counts = np.diff(np.round(ranks)).astype(np.int64)
+        bins = [HistogramBin(x=edges[i], dx=edges[i + 1] - edges[i], y=counts[i]) for i in range(len(counts))]
+        return {"Bins": [bin_.to_json() for bin_ in bins], "NumberOfRecords": sketch.rows_count}
+
+    @staticmethod
+    def _boxplot(sketch: ColumnSketch):
+        box_bottom, median, box_top = sketch.quantiles.quantiles([0.25, 0.5, 0.75])
+        iqr = box_top - box_bottom
+        lower_whisker_bound, upper_whisker_bound = box_bottom - 1.5 * iqr, box_top + 1.5 * iqr
+        # whiskers are exact when they are among the extreme values, otherwise they are the closest values kept by
+        # the quantile sketch
+        extremes = sketch.extremes()
+        values = extremes if sketch.exact else np.concatenate([extremes, sketch.quantiles.values()])
+        whisker_bottom = values[values >= lower_whisker_bound].min()
+        whisker_top = values[values <= upper_whisker_bound].max()
+        outliers_count = BoxplotLayout.MAX_NUMBER_OF_OUTLIERS
+        outliers = extremes[extremes < whisker_bottom][:outliers_count].tolist() + \
+            extremes[extremes > whisker_top][-outliers_count:].tolist()
+        return {
+            "median": ElementEncoder.encode(median),
+            "boxBottom": ElementEncoder.encode(box_bottom),
+            "boxTop": ElementEncoder.encode(box_top),
+            "whiskerBottom": ElementEncoder.encode(whisker_bottom),
+            "whiskerTop": ElementEncoder.encode(whisker_top),
+            "outliers": ElementEncoder.encode(outliers)
+        }
+
+
+def _data_schema(path: str, columns: list = None):
+    """Get the arrow schema of the data in a parquet shard, without pandas index columns and pandas metadata,
+    since the index of each shard is not meaningful once shards are concatenated."""
+    schema = pq.read_schema(path)
+    index_columns = (schema.pandas_metadata or {}).get('index_columns', [])
+    names = columns if columns is not None else [name for name in schema.names if name not in index_columns]
+    return pa.schema([schema.field(name) for name in names])
+
+
+def _read_shard(path: str, schema: pa.Schema, sample_rows_count: int):
+    table = pq.read_table(path, columns=schema.names)
+    table = pa.Table.from_arrays([table.column(name) for name in schema.names], schema=table.schema).cast(schema)
+    df = table.to_pandas()
+    column_sketches = [ColumnSketch.from_column(df[name]) for name in df.columns[:DataFrameVisualizer.MAX_COL_NUMBER]]
+    return table, column_sketches, df.iloc[:sample_rows_count]
+
+
+def save_parquet_shards_to_directory(save_to: str, load_from: str, columns: list = None,
+                                     max_workers=PARQUET_READ_WORKERS):
+    """Save parquet shards under a directory to a DataFrameDirectory, without loading all rows in memory.
+
+    Shards are read in parallel, and written to the data file of the DataFrameDirectory one by one as row groups.
+    Statistics for the visualization are merged from column sketches of each shard, so only the shards being read
+    and written are kept in memory.
+    :param save_to: directory to save the DataFrameDirectory
+    :param load_from: directory of parquet shards
+    :param columns: names of columns to save, or None to save all columns
+    :param max_workers: number of shards read in parallel
+    """
+    paths = list_parquet_shards(load_from)
+    if not paths:
+        raise ValueError(f"No parquet files are found in {load_from}")
+    schema = _data_schema(paths[0], columns=columns)
+    common_logger.info(f"Save {len(paths)} parquet shards with columns {schema.names} to {save_to}")
+
+    os.makedirs(save_to, exist_ok=True)
+    rows_count = 0
+    column_sketches = None
+    samples = []
+    sample_rows_count = DataFrameVisualizer.MAX_ROW_NUMBER
+    with TimeProfile(f"Write {len(paths)} parquet shards"), \
+            pq.ParquetWriter(os.path.join(save_to, _DATA_FILE_PATH), schema) as writer:
+        shards = read_ahead(lambda path: _read_shard(path, schema, sample_rows_count), paths, ahead=max_workers)
+        for table, shard_sketches, sample in shards:
+            writer.write_table(table)
+            rows_count += table.num_rows
+            if column_sketches is None:
+                column_sketches = shard_sketches
+            else:
+                for sketch, shard_sketch in zip(column_sketches, shard_sketches):
+                    sketch.merge(shard_sketch)
+            if sample_rows_count > 0:
+                samples.append(sample)
+                sample_rows_count -= len(sample)
+
+    sample = pd.concat(samples, ignore_index=True)
+    schema_dict = DataFrameSchema.data_frame_to_dict(sample)
+    visualizer = SketchDataFrameVisualizer(data=sample, schema=schema_dict, column_sketches=column_sketches,
+                                           rows_count=rows_count)
+    # the data file is written already, so it is not overwritten by the sample
+    save_data_frame_to_directory(save_to, data=sample, file_path=_DATA_FILE_PATH, schema=schema_dict,
+                                 visualizers=[visualizer], overwrite_if_exist=False)
+    return rows_count
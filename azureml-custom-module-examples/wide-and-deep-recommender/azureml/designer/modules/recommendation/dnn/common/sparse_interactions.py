@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+from azureml.designer.modules.recommendation.dnn.common.utils import get_indexer
+
+
+class SparseInteractions:
+    """The class records user-item interactions in CSR layout over integer user and item codes.
+
+    Codes are positions in the users and items arrays given at construction. The items interacted by user code u are
+    indices[indptr[u]:indptr[u + 1]], in ascending order and without duplicates.
+    """
+
+    def __init__(self, user_codes: np.ndarray, item_codes: np.ndarray, users_count: int, items_count: int):
+        """Build CSR structure from interaction codes, where interactions with negative codes are ignored.
+
+        :param user_codes: int array, user codes in range [0, users_count) of interactions
+        :param item_codes: int array, item codes in range [0, items_count) of interactions
+        :param users_count: number of users
+        :param items_count: number of items
+        """
+        valid = (user_codes >= 0) & (item_codes >= 0)
+        # encode each pair as one int64 key, so that pairs are sorted and deduplicated at once
+        keys = np.unique(user_codes[valid].astype(np.int64) * items_count + item_codes[valid])
+        self.indices = keys % items_count
+        self.indptr = np.zeros(users_count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(keys // items_count, minlength=users_count), out=self.indptr[1:])
+        self.users_count = users_count
+        self.items_count = items_count
+
+    @classmethod
+    def from_ids(cls, users, items, interaction_users, interaction_items):
+        """Build interactions from ids, where interactions of ids not in users or items are ignored.
+
+        :param users: unique user ids, whose positions are the user codes
+        :param items: unique item ids, whose positions are the item codes
+        :param interaction_users: user ids of interactions, which may be compact ids
+        :param interaction_items: item ids of interactions, with the same length as interaction_users
+        """
+        user_codes = get_indexer(pd.Index(users), interaction_users)
+        item_codes = get_indexer(pd.Index(items), interaction_items)
+        return cls(user_codes=user_codes, item_codes=item_codes, users_count=len(users), items_count=len(items))
+
+    def __len__(self):
+        return len(self.indices)
+
+    def block_mask(self, user_start: int, user_end: int, item_start: int, item_end: int):
+        """Get the dense interaction mask of a block of users and items.
+
+        :return: bool array with shape (user_end - user_start, item_end - item_start), where True means interacted.
+        """
+        mask = np.zeros((user_end - user_start, item_end - item_start), dtype=bool)
+        row_sizes = np.diff(self.indptr[user_start:user_end + 1])
+        rows = np.repeat(np.arange(user_end - user_start), row_sizes)
+        columns = self.indices[self.indptr[user_start]:self.indptr[user_end]]
+        in_block = (columns >= item_start) & (columns < item_end)
+        mask[rows[in_block], columns[in_block] - item_start] = True
+        return mask
+
+    def take_rows(self, user_codes: np.ndarray):
+        """Get the interactions of a subset of users, whose codes become their positions in user_codes."""
+        row_sizes = np.diff(self.indptr)[user_codes]
+        rows = np.repeat(np.arange(len(user_codes)), row_sizes)
+        offsets = np.arange(row_sizes.sum()) - np.repeat(np.cumsum(row_sizes) - row_sizes, row_sizes)
+        item_codes = self.indices[np.repeat(self.indptr[user_codes], row_sizes) + offsets]
+        return SparseInteractions(user_codes=rows, item_codes=item_codes, users_count=len(user_codes),
+                                  items_count=self.items_count)
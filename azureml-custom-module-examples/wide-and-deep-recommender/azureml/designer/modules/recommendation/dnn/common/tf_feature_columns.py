@@ -1,5 +1,6 @@
 from abc import abstractmethod
-import tensorflow as tf
+import numpy as np
+from azureml.designer.modules.recommendation.dnn.common.utils import tf
 
 
 class FeatureColumn:
@@ -16,6 +17,17 @@ class FeatureColumn:
     def build(self):
         pass
 
+    @abstractmethod
+    def to_dict(self):
+        """Dump build info into a json serializable dict, which can be loaded by feature_column_from_dict."""
+        pass
+
+    @property
+    @abstractmethod
+    def name(self):
+        """The name of the built tensorflow feature column, which scopes the variables of the column."""
+        pass
+
     def reset(self):
         """This method would be used to reset _feature_column attr to be None, usually is called before model saving."""
         self._feature_column = None
@@ -41,6 +53,43 @@ class CategoricalVocabListFeatureColumn(FeatureColumn):
 
         return self.feature_column
 
+    def to_dict(self):
+        return {"type": type(self).__name__, "key": self.key, "vocab": np.asarray(self.vocab).tolist()}
+
+    @property
+    def name(self):
+        return self.key
+
+
+class CategoricalIdentityFeatureColumn(FeatureColumn):
+    """Categorical feature column fed with integer codes in range [0, num_buckets).
+
+    Compared with CategoricalVocabListFeatureColumn, the vocabulary is not embedded into the graph, and the codes are
+    looked up on the host. If the codes are the vocab positions, and the OOV code is len(vocab), the column is
+    equivalent to a vocab list column with one OOV bucket, and shares its variables and crossed feature hashes.
+    """
+
+    def __init__(self, key: str, num_buckets: int):
+        super().__init__()
+        self.key = key
+        self.num_buckets = num_buckets
+
+    def build(self):
+        if not self._feature_column:
+            self._feature_column = tf.feature_column.categorical_column_with_identity(
+                key=self.key,
+                num_buckets=self.num_buckets
+            )
+
+        return self.feature_column
+
+    def to_dict(self):
+        return {"type": type(self).__name__, "key": self.key, "num_buckets": int(self.num_buckets)}
+
+    @property
+    def name(self):
+        return self.key
+
 
 class NumericFeatureColumn(FeatureColumn):
     def __init__(self, key: str, shape=(1,)):
@@ -54,6 +103,13 @@ class NumericFeatureColumn(FeatureColumn):
 
         return self.feature_column
 
+    def to_dict(self):
+        return {"type": type(self).__name__, "key": self.key, "shape": list(self.shape)}
+
+    @property
+    def name(self):
+        return self.key
+
 
 class CrossedFeatureColumn(FeatureColumn):
     def __init__(self, categorical_features, hash_bucket_size):
@@ -68,6 +124,15 @@ class CrossedFeatureColumn(FeatureColumn):
 
         return self.feature_column
 
+    def to_dict(self):
+        return {"type": type(self).__name__,
+                "categorical_features": [feature.to_dict() for feature in self.categorical_features],
+                "hash_bucket_size": int(self.hash_bucket_size)}
+
+    @property
+    def name(self):
+        return "_X_".join(sorted(feature.name for feature in self.categorical_features))
+
 
 class EmbeddingFeatureColumn(FeatureColumn):
     def __init__(self, categorical_feature, dimension, max_norm=None):
@@ -85,6 +150,14 @@ class EmbeddingFeatureColumn(FeatureColumn):
 
         return self.feature_column
 
+    def to_dict(self):
+        return {"type": type(self).__name__, "categorical_feature": self.categorical_feature.to_dict(),
+                "dimension": int(self.dimension), "max_norm": float(self.max_norm)}
+
+    @property
+    def name(self):
+        return f"{self.categorical_feature.name}_embedding"
+
 
 def is_basic_feature(feature):
     """Check if a feature column represents the basic feature.
@@ -94,7 +167,42 @@ def is_basic_feature(feature):
     in the input dataset."""
     if not isinstance(feature, FeatureColumn):
         raise TypeError(f"feature should be of {FeatureColumn.__name__} type")
-    return isinstance(feature, (CategoricalVocabListFeatureColumn, NumericFeatureColumn))
+    return isinstance(feature, (CategoricalVocabListFeatureColumn, CategoricalIdentityFeatureColumn,
+                                NumericFeatureColumn))
+
+
+def feature_column_from_dict(spec: dict, basic_features: dict = None):
+    """Load the feature column dumped by the to_dict method.
+
+    :param spec: dict returned by the to_dict method
+    :param basic_features: dict of (type name, key) to loaded basic features, which is shared among calls, so that
+    basic features are loaded as the same instances wherever they are referred.
+    :return: FeatureColumn
+    """
+    basic_features = basic_features if basic_features is not None else {}
+    type_name = spec["type"]
+    if type_name == CrossedFeatureColumn.__name__:
+        return CrossedFeatureColumn(
+            categorical_features=[feature_column_from_dict(f, basic_features) for f in spec["categorical_features"]],
+            hash_bucket_size=spec["hash_bucket_size"])
+    if type_name == EmbeddingFeatureColumn.__name__:
+        return EmbeddingFeatureColumn(
+            categorical_feature=feature_column_from_dict(spec["categorical_feature"], basic_features),
+            dimension=spec["dimension"], max_norm=spec["max_norm"])
+
+    basic_feature_key = (type_name, spec["key"])
+    if basic_feature_key not in basic_features:
+        if type_name == CategoricalVocabListFeatureColumn.__name__:
+            feature = CategoricalVocabListFeatureColumn(key=spec["key"], vocab=np.array(spec["vocab"], dtype=object))
+        elif type_name == CategoricalIdentityFeatureColumn.__name__:
+            feature = CategoricalIdentityFeatureColumn(key=spec["key"], num_buckets=spec["num_buckets"])
+        elif type_name == NumericFeatureColumn.__name__:
+            feature = NumericFeatureColumn(key=spec["key"], shape=tuple(spec["shape"]))
+        else:
+            raise NotImplementedError(f"Unsupported feature column type {type_name}")
+        basic_features[basic_feature_key] = feature
+
+    return basic_features[basic_feature_key]
 
 
 def parse_basic_features(feature_columns):
@@ -111,7 +219,8 @@ def parse_basic_features(feature_columns):
             for basic_feature in feature.categorical_features:
                 basic_features.add(basic_feature)
         elif isinstance(feature, EmbeddingFeatureColumn):
-            basic_features.add(feature.categorical_feature)
+            # the embedded feature can be a crossed feature
+            basic_features.update(parse_basic_features(feature_columns=[feature.categorical_feature]))
         else:
             raise NotImplementedError
 
@@ -0,0 +1,178 @@
+import numpy as np
+import pandas as pd
+
+
+class TopKRecommendations:
+    """The class records padded top k recommendations for a set of users.
+
+    users is a 1-D array of user ids, items and ratings are 2-D arrays with shape (len(users), k), where row i holds
+    the recommended items and their scored ratings for users[i] in descending rating order. Users with less than k
+    candidates are padded with None items and 0 ratings.
+    """
+
+    def __init__(self, users, items: np.ndarray, ratings: np.ndarray):
+        self.users = np.asarray(users)
+        self.items = items
+        self.ratings = ratings
+
+    @property
+    def k(self):
+        return self.items.shape[1]
+
+    def __len__(self):
+        return len(self.users)
+
+    @classmethod
+    def empty(cls, k: int):
+        return cls(users=np.array([], dtype=object), items=np.empty((0, k), dtype=object),
+                   ratings=np.zeros((0, k)))
+
+    @classmethod
+    def concat(cls, recommendations_list, k: int):
+        if not recommendations_list:
+            return cls.empty(k=k)
+        return cls(users=np.concatenate([r.users for r in recommendations_list]),
+                   items=np.concatenate([r.items for r in recommendations_list]),
+                   ratings=np.concatenate([r.ratings for r in recommendations_list]))
+
+
+def factorize_ids(ids):
+    """Encode ids as integer codes, where the codes follow the sorted order of the unique ids.
+
+    Categorical ids are factorized by their codes, and only the unique ids are sorted, so that the order does not
+    depend on the order of categories.
+    :return: tuple of (codes, uniques), uniques is a numpy array of the sorted unique ids.
+    """
+    if not isinstance(getattr(ids, 'dtype', None), pd.api.types.CategoricalDtype):
+        codes, uniques = pd.factorize(ids, sort=True)
+        return codes, np.asarray(uniques)
+
+    codes, uniques = pd.factorize(ids)
+    uniques = np.asarray(uniques)
+    order = np.argsort(uniques, kind='stable')
+    ranks = np.empty_like(order)
+    ranks[order] = np.arange(len(order))
+    return np.where(codes < 0, -1, ranks[codes]), uniques[order]
+
+
+def segmented_top_k(group_codes: np.ndarray, group_count: int, scores: np.ndarray, k: int):
+    """Select top k scores for each group of a ragged, flattened score array.
+
+    The selection is equal to calling pd.DataFrame.nlargest(n=k, keep='first') for each group, which means ties are
+    broken by the original position, and NaN scores are never selected. Ties are also broken by the original position
+    in groups of no more than k scores, where nlargest sorts the group without a stable order.
+    :param group_codes: int array, group codes in range [0, group_count) for each score
+    :param group_count: number of groups
+    :param scores: float array with the same length as group_codes
+    :param k: number of scores to select per group
+    :return: int array with shape (group_count, k), positions of the selected scores in descending score order,
+    padded with -1 for groups with less than k valid scores.
+    """
+    positions = np.full((group_count, k), -1, dtype=np.int64)
+    valid_positions = np.flatnonzero(~np.isnan(scores))
+    if len(valid_positions) == 0 or k <= 0:
+        return positions
+
+    codes = group_codes[valid_positions]
+    # np.lexsort is stable, so equal scores in the same group keep their original order
+    order = np.lexsort((-scores[valid_positions], codes))
+    sorted_codes = codes[order]
+    group_sizes = np.bincount(sorted_codes, minlength=group_count)
+    group_starts = np.cumsum(group_sizes) - group_sizes
+    ranks = np.arange(len(order)) - group_starts[sorted_codes]
+    selected = ranks < k
+    positions[sorted_codes[selected], ranks[selected]] = valid_positions[order[selected]]
+    return positions
+
+
+def dense_top_k(scores: np.ndarray, k: int):
+    """Select top k scores for each row of a dense 2-D score block.
+
+    Rows usually represent users and columns represent candidate items. Only k candidates per row are sorted, which
+    is much cheaper than a full sort when k is small compared with the number of columns. Semantics are the same as
+    segmented_top_k, ties are broken by column position and NaN scores are never selected.
+    :param scores: float array with shape (rows, columns)
+    :param k: number of scores to select per row
+    :return: int array with shape (rows, k), column positions of the selected scores, padded with -1.
+    """
+    row_count, column_count = scores.shape
+    if k <= 0 or column_count == 0:
+        return np.full((row_count, max(k, 0)), -1, dtype=np.int64)
+
+    if k < column_count:
+        neg_scores = -scores
+        # np.partition sorts NaN to the end, so a NaN kth value means the row has no more than k valid scores
+        kth_values = np.partition(neg_scores, k - 1, axis=1)[:, k - 1:k]
+        selected = neg_scores < kth_values
+        ties = neg_scores == kth_values
+        ties &= np.cumsum(ties, axis=1) <= (k - selected.sum(axis=1, keepdims=True))
+        selected |= ties
+        short_rows = np.isnan(kth_values[:, 0])
+        selected[short_rows] = ~np.isnan(scores[short_rows])
+        rows, columns = np.nonzero(selected)
+    else:
+        rows, columns = np.nonzero(~np.isnan(scores))
+
+    # rows and columns are in row major order, so segmented top k keeps column order for ties
+    positions = segmented_top_k(group_codes=rows, group_count=row_count, scores=scores[rows, columns], k=k)
+    padded = positions < 0
+    if len(columns) > 0:
+        positions = np.where(padded, -1, columns[np.where(padded, 0, positions)])
+    return positions
+
+
+def grouped_top_k(group_codes: np.ndarray, group_count: int, scores: np.ndarray, k: int):
+    """Select top k scores for each group, with the same semantics and return value as segmented_top_k.
+
+    If each group occupies a contiguous block of the same size, which is the layout of user-item cartesian pairs,
+    the scores are reshaped to a dense block and selected with dense_top_k, otherwise fall back to segmented_top_k.
+    """
+    if group_count > 0 and len(scores) % group_count == 0:
+        block_size = len(scores) // group_count
+        block_codes = group_codes[::block_size] if block_size > 0 else group_codes
+        if block_size > 0 and (group_codes.reshape(group_count, block_size) == block_codes[:, np.newaxis]).all() \
+                and len(np.unique(block_codes)) == group_count:
+            column_positions = dense_top_k(scores.reshape(group_count, block_size), k=k)
+            positions = np.full((group_count, k), -1, dtype=np.int64)
+            offsets = np.arange(group_count)[:, np.newaxis] * block_size
+            positions[block_codes] = np.where(column_positions < 0, -1, column_positions + offsets)
+            return positions
+
+    return segmented_top_k(group_codes=group_codes, group_count=group_count, scores=scores, k=k)
+
+
+def take_padded(values: np.ndarray, positions: np.ndarray, fill):
+    """Gather values by positions, where -1 positions are filled with the fill value.
+
+    If values is a 2-D array, positions are column positions of each row, otherwise positions index the 1-D values.
+    Values of a pd.Categorical, e.g. compact ids, are gathered by codes, and only the gathered values are decoded.
+    """
+    if isinstance(values, pd.Categorical):
+        codes = take_padded(values.codes, positions=positions, fill=-1)
+        return take_padded(np.asarray(values.categories), positions=codes, fill=fill)
+    values = np.asarray(values)
+    dtype = object if fill is None else values.dtype
+    result = np.full(positions.shape, fill, dtype=dtype)
+    valid = positions >= 0
+    if values.ndim == 2:
+        rows = np.broadcast_to(np.arange(len(positions))[:, np.newaxis], positions.shape)
+        result[valid] = values[rows[valid], positions[valid]]
+    else:
+        result[valid] = values[positions[valid]]
+    return result
+
+
+def merge_top_k(running: TopKRecommendations, block: TopKRecommendations):
+    """Merge top k recommendations of the same users, where block candidates come after running candidates.
+
+    Both arguments must have the same users in the same order, and the merged result is the same as selecting top k
+    from the candidates of both at once.
+    """
+    items = np.concatenate([running.items, block.items], axis=1)
+    ratings = np.concatenate([running.ratings, block.ratings], axis=1)
+    # padded candidates are marked with NaN scores, so that they will never be selected
+    scores = ratings.astype(np.float64)
+    scores[pd.isnull(items)] = np.nan
+    positions = dense_top_k(scores, k=running.k)
+    return TopKRecommendations(users=running.users, items=take_padded(items, positions=positions, fill=None),
+                               ratings=take_padded(ratings, positions=positions, fill=0))
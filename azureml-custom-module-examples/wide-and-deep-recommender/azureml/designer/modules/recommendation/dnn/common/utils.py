@@ -1,11 +1,31 @@
+import os
+import importlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
+import pyarrow as pa
 from azureml.studio.core.utils.missing_value_utils import has_na, drop_na
 from azureml.studio.core.data_frame_schema import ElementTypeName
 from azureml.studio.core.logger import common_logger
 from pandas.api.types import is_datetime64_ns_dtype, is_timedelta64_ns_dtype
 
 
+class LazyModule:
+    """The proxy of a module, which imports the module on the first access of its attributes."""
+
+    def __init__(self, name: str):
+        self._name = name
+
+    def __getattr__(self, name):
+        return getattr(importlib.import_module(self._name), name)
+
+
+# tensorflow is accessed through this proxy, so that models are loaded and scored by the NumPy inference backend
+# without importing tensorflow, while training and the TensorFlow backend import it on first use
+tf = LazyModule("tensorflow")
+
+
 # This method is from azureml.studio.common.utils.datetimeutils, and will be removed in the future.
 def is_datetime_dtype(argument):
     return is_datetime64_ns_dtype(argument)
@@ -44,13 +64,75 @@ def _drop_na_and_convert(column, new_type):
     return column_new
 
 
-# This method is from azureml.studio.common.datatable.data_type_conversions, and will be removed in the future.
-def convert_to_str(column):
-    column_new = _drop_na_and_convert(column, ElementTypeName.STRING)
-    # Replace pd.NaT (missing value in date-time column) with np.nan
-    # Otherwise this column cannot be dumped into parquet
-    column_new.replace(to_replace=pd.NaT, value=np.nan, inplace=True)
-    return column_new
+# Object columns of these inferred types hold values which are equal only if their strings are equal, so strings can
+# be converted from the distinct values only. In other object columns, equal values such as 1, 1.0 and True in a mixed
+# column have different strings.
+_FACTORIZABLE_OBJECT_TYPES = ('string', 'bytes', 'integer', 'empty')
+
+
+def convert_to_str(column, categorical=False):
+    """Convert values of the column to strings, keeping the index of the column, and missing values as np.nan.
+
+    Only the distinct values are converted, and rows of the same value share the same string object.
+    :param column: pd.Series
+    :param categorical: if True, return a categorical column, whose categories are the strings of distinct values
+    :return: pd.Series
+    """
+    if categorical and column.dtype.name == 'category' and \
+            pd.api.types.infer_dtype(column.cat.categories, skipna=True) == 'string':
+        # categories are strings already, e.g. compact ids converted before
+        return column
+
+    na_mask = column.isna().values
+    if column.dtype == object and pd.api.types.infer_dtype(column, skipna=True) not in _FACTORIZABLE_OBJECT_TYPES:
+        if na_mask.any():
+            strings = np.full(len(column), np.nan, dtype=object)
+            strings[~na_mask] = column[~na_mask].astype(str).values
+        else:
+            strings = column.astype(str).values
+        if categorical:
+            return pd.Series(pd.Categorical(strings), index=column.index, name=column.name)
+        return pd.Series(strings, index=column.index, name=column.name, dtype=object)
+
+    if column.dtype.kind == 'f':
+        # factorize the bits of floats, since -0.0 equals 0.0, but has a different string
+        codes = np.full(len(column), -1, dtype=np.int64)
+        codes[~na_mask], uniques = pd.factorize(column.values[~na_mask].view(f'i{column.dtype.itemsize}'))
+        uniques = uniques.view(column.dtype)
+    else:
+        codes, uniques = pd.factorize(column)
+    # distinct values are converted as a column, e.g. datetimes omit the time if all times are 00:00:00
+    unique_strings = pd.Series(uniques).astype(str).values
+    if categorical:
+        return pd.Series(pd.Categorical.from_codes(codes, categories=unique_strings),
+                         index=column.index, name=column.name)
+    # missing values are coded as -1, which takes the np.nan appended
+    strings = np.append(unique_strings.astype(object), np.nan)[codes]
+    return pd.Series(strings, index=column.index, name=column.name, dtype=object)
+
+
+def get_indexer(index: pd.Index, ids):
+    """Get positions of ids in the index, where -1 means not found.
+
+    Ids are usually highly repeated, so only unique ids are looked up in the index, and then broadcast back. Categorical
+    ids are looked up by their categories, unless most categories are not used, and categories starting with the index,
+    e.g. compact ids built by FeatureBuilder.to_categorical_ids, are not looked up at all.
+    :param index: pd.Index of unique ids
+    :param ids: pd.Series or array of ids
+    :return: int numpy array
+    """
+    values = ids.values if isinstance(ids, pd.Series) else ids
+    if isinstance(values, pd.Categorical) and len(values.categories) <= len(values):
+        codes, uniques = values.codes, values.categories
+        if len(uniques) >= len(index) and uniques[:len(index)].equals(index):
+            positions = np.append(np.arange(len(index)), index.get_indexer(uniques[len(index):]))
+        else:
+            positions = index.get_indexer(uniques)
+    else:
+        codes, uniques = pd.factorize(values)
+        positions = index.get_indexer(np.asarray(uniques))
+    # missing ids are coded as -1, which takes the -1 appended
+    return np.append(positions, -1).take(codes)
 
 
 def convert_to_int(column):
@@ -78,3 +160,51 @@ def convert_to_float(column):
     column.fillna(value=np.nan, inplace=True)
 
     return column.astype(ElementTypeName.FLOAT)
+
+
+def write_arrow_table(df: pd.DataFrame, path: str):
+    """Write the data frame to an Arrow IPC file, which can be memory-mapped when read."""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    with pa.OSFile(path, "wb") as sink:
+        writer = pa.RecordBatchFileWriter(sink, table.schema)
+        writer.write_table(table)
+        writer.close()
+
+
+def read_arrow_table(path: str):
+    """Read the Arrow IPC file written by write_arrow_table through memory map.
+
+    No column is converted to pandas here, columns of the returned pa.Table refer to the memory-mapped file, which
+    is kept open until they are released, so callers convert only the columns they use.
+    :return: pa.Table
+    """
+    return pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+
+
+def list_parquet_shards(directory: str):
+    """List parquet files under the directory in sorted order, skipping names starting with "_" or ".", as pyarrow
+    does when reading a directory of parquet files."""
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if not d.startswith(("_", ".")))
+        paths.extend(os.path.join(root, file) for file in sorted(files) if not file.startswith(("_", ".")))
+    return paths
+
+
+def read_ahead(read_fn, keys, ahead=1):
+    """Read chunks by keys in order, reading the next chunks in background threads.
+
+    So the consumer is not stalled when a chunk is used up, at the cost of keeping the chunks read ahead in memory.
+    :param read_fn: callable reading the chunk of a key
+    :param keys: iterable of keys
+    :param ahead: number of chunks read in parallel ahead of the chunk being used
+    :return: generator of the chunks
+    """
+    with ThreadPoolExecutor(max_workers=ahead) as executor:
+        futures = deque()
+        for key in keys:
+            futures.append(executor.submit(read_fn, key))
+            if len(futures) > ahead:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
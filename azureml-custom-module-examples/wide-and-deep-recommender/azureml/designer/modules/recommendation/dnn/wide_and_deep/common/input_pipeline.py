@@ -0,0 +1,198 @@
+import threading
+import numpy as np
+from azureml.designer.modules.recommendation.dnn.common.constants import SHUFFLE_BUFFER_SIZE
+from azureml.designer.modules.recommendation.dnn.common.utils import tf
+
+# equal to tf.data.experimental.AUTOTUNE, which is not read at import time, since that would import tensorflow
+AUTOTUNE = -1
+
+
+class InputPipelineParams:
+    """The tool class records tuning knobs of the tf.data input pipeline.
+
+    :param prefetch_buffer_size: number of batches prepared in advance, AUTOTUNE by default
+    :param num_parallel_calls: number of batches sliced in parallel, AUTOTUNE by default
+    :param cache: whether to cache sliced batches in memory after the first epoch
+    :param feature_lookup: whether to feed feature positions instead of denormalized user/item features, the features
+    are gathered in-graph from constant feature tables, which must not exceed the 2GB graph limit
+    :param shuffle_buffer_size: number of instances kept in the shuffle buffer when streaming transaction shards
+    """
+
+    def __init__(self, prefetch_buffer_size=AUTOTUNE, num_parallel_calls=AUTOTUNE, cache=False, feature_lookup=False,
+                 shuffle_buffer_size=SHUFFLE_BUFFER_SIZE):
+        self.prefetch_buffer_size = prefetch_buffer_size
+        self.num_parallel_calls = num_parallel_calls
+        self.cache = cache
+        self.feature_lookup = feature_lookup
+        self.shuffle_buffer_size = shuffle_buffer_size
+
+    def __setstate__(self, state):
+        # input pipeline params saved before shard streaming was introduced do not have shuffle buffer size
+        state.setdefault("shuffle_buffer_size", SHUFFLE_BUFFER_SIZE)
+        self.__dict__.update(state)
+
+    def __str__(self):
+        return f"Prefetch buffer size: {self.prefetch_buffer_size}\n" \
+            f"Parallel calls: {self.num_parallel_calls}\n" \
+            f"Cache: {self.cache}\n" \
+            f"Feature lookup: {self.feature_lookup}\n" \
+            f"Shuffle buffer size: {self.shuffle_buffer_size}"
+
+
+def _get_tf_dtype(values: np.ndarray):
+    if values.dtype.kind in ('O', 'U', 'S'):
+        return tf.string
+    return tf.as_dtype(values.dtype)
+
+
+def lookup_features(features: dict, lookup_tables: dict):
+    """Gather features from constant lookup tables by feature positions.
+
+    :param features: dict of feature key to tensor, where the index keys of lookup_tables map to position tensors.
+    :param lookup_tables: dict of index key to feature tables, which are dicts of feature key to 1-D numpy array.
+    :return: dict of feature key to tensor, where position tensors are replaced by the gathered features.
+    """
+    features = dict(features)
+    for index_key, tables in lookup_tables.items():
+        positions = features.pop(index_key)
+        for key, table in tables.items():
+            features[key] = tf.gather(tf.constant(table), positions)
+
+    return features
+
+
+def _build_features_and_labels_fn(keys: list, lookup_tables: dict, with_labels: bool):
+    """Build the map fn converting a batch of tensors, in the order of keys and then labels, to model inputs."""
+
+    def _to_features_and_labels(*batch):
+        for tensor in batch:
+            tensor.set_shape([None])
+        batch_features = dict(zip(keys, batch[:len(keys)]))
+        if lookup_tables:
+            batch_features = lookup_features(features=batch_features, lookup_tables=lookup_tables)
+        if not with_labels:
+            return batch_features
+        return batch_features, batch[-1]
+
+    return _to_features_and_labels
+
+
+def build_dataset(features: dict, labels: np.ndarray = None, batch_size=64, epochs=1,
+                  params: InputPipelineParams = None, lookup_tables: dict = None, shuffle_seed=None):
+    """Build a tf.data pipeline which feeds columnar numpy arrays batch by batch.
+
+    Batches are sliced from the numpy arrays on the fly, instead of embedding the arrays into the graph as constants,
+    so that the pipeline works for datasets larger than the 2GB graph limit. Slicing is executed in parallel and
+    prefetched, so that the model is not blocked by the input pipeline.
+    :param features: dict of feature key to 1-D numpy array, all arrays are of the same length.
+    :param labels: optional 1-D numpy array of the same length as features.
+    :param batch_size: number of instances per batch
+    :param epochs: number of times to iterate over the dataset
+    :param params: InputPipelineParams, the tuning knobs of the pipeline
+    :param lookup_tables: optional feature tables to gather features from, see lookup_features for details.
+    :param shuffle_seed: optional tuple of ints, if provided, instances are reshuffled in each epoch with the random
+    state seeded by (*shuffle_seed, epoch), otherwise instances are fed in the given order in all epochs.
+    :return: tf.data.Dataset, which yields features dict, or (features dict, labels) tuple if labels is not None.
+    """
+    params = params if params is not None else InputPipelineParams()
+    keys = list(features.keys())
+    arrays = [features[key] for key in keys]
+    if labels is not None:
+        arrays.append(labels)
+    dtypes = [_get_tf_dtype(values) for values in arrays]
+    instances_count = len(arrays[0])
+    batches_count = int(np.ceil(instances_count / batch_size))
+
+    permutations = {}
+    permutations_lock = threading.Lock()
+
+    def _get_permutation(epoch):
+        # batches are sliced in parallel, so batches of adjacent epochs may be sliced at the same time
+        with permutations_lock:
+            if epoch not in permutations:
+                permutations.pop(epoch - 2, None)
+                random_state = np.random.RandomState([*shuffle_seed, epoch])
+                permutations[epoch] = random_state.permutation(instances_count)
+            return permutations[epoch]
+
+    def _slice_batch(batch_idx):
+        epoch, batch_idx = divmod(int(batch_idx), batches_count)
+        batch_start = batch_idx * batch_size
+        if shuffle_seed is None:
+            return [values[batch_start:batch_start + batch_size] for values in arrays]
+        positions = _get_permutation(epoch)[batch_start:batch_start + batch_size]
+        return [values[positions] for values in arrays]
+
+    # batches of all epochs are indexed at once if reshuffled per epoch, otherwise the batches of one epoch are repeated
+    reshuffle = shuffle_seed is not None
+    dataset = tf.data.Dataset.range(batches_count * epochs if reshuffle else batches_count)
+    dataset = dataset.map(lambda batch_idx: tf.numpy_function(_slice_batch, [batch_idx], dtypes),
+                          num_parallel_calls=params.num_parallel_calls)
+    dataset = dataset.map(_build_features_and_labels_fn(keys=keys, lookup_tables=lookup_tables,
+                                                        with_labels=labels is not None))
+    if not reshuffle:
+        if params.cache:
+            dataset = dataset.cache()
+        dataset = dataset.repeat(epochs)
+    dataset = dataset.prefetch(params.prefetch_buffer_size)
+
+    return dataset
+
+
+def batch_chunks(chunks, batch_size, shuffle_buffer_size=0, random_state: np.random.RandomState = None):
+    """Split chunks of columnar numpy arrays into batches, shuffling instances through a buffer.
+
+    Each chunk is appended to the instances left in the buffer, and if a random state is provided, the buffer is
+    permuted before full batches are taken from it, until at most shuffle_buffer_size instances are left. So an
+    instance may be fed in a batch of any later chunk, while only one chunk and the buffer are in memory at a time.
+    Instances left after the last chunk are fed in the last batches, the last one may be smaller than batch_size.
+    :param chunks: iterable of lists of 1-D numpy arrays, arrays of the same chunk are of the same length.
+    :param random_state: optional numpy random state, instances are fed in the given order if not provided.
+    :return: generator of lists of 1-D numpy arrays, which are batches of the chunks.
+    """
+    buffer = None
+    for chunk in chunks:
+        buffer = chunk if buffer is None else [np.concatenate([left, values]) for left, values in zip(buffer, chunk)]
+        instances_count = len(buffer[0])
+        taken_count = max(0, instances_count - shuffle_buffer_size) // batch_size * batch_size
+        if taken_count == 0:
+            continue
+        if random_state is not None:
+            permutation = random_state.permutation(instances_count)
+            buffer = [values[permutation] for values in buffer]
+        for batch_start in range(0, taken_count, batch_size):
+            yield [values[batch_start:batch_start + batch_size] for values in buffer]
+        buffer = [values[taken_count:] for values in buffer]
+
+    if buffer is None:
+        return
+    if random_state is not None:
+        permutation = random_state.permutation(len(buffer[0]))
+        buffer = [values[permutation] for values in buffer]
+    for batch_start in range(0, len(buffer[0]), batch_size):
+        yield [values[batch_start:batch_start + batch_size] for values in buffer]
+
+
+def build_generator_dataset(generator, keys: list, dtypes: list, with_labels=True, params: InputPipelineParams = None,
+                            lookup_tables: dict = None):
+    """Build a tf.data pipeline which feeds the batches yielded by a python generator.
+
+    Unlike build_dataset, the instances are not required to be in memory at once, e.g. they are read from files.
+    The generator is run ahead by prefetching, so that reading batches overlaps with training.
+    :param generator: callable returning an iterator of batches, which are lists of 1-D numpy arrays in the order of
+    keys, followed by labels if with_labels is True. It is called again each time the dataset is iterated.
+    :param keys: feature keys of the arrays
+    :param dtypes: tf dtypes of the arrays, including labels
+    :param params: InputPipelineParams, the tuning knobs of the pipeline
+    :param lookup_tables: optional feature tables to gather features from, see lookup_features for details.
+    :return: tf.data.Dataset, which yields features dict, or (features dict, labels) tuple if with_labels is True.
+    """
+    params = params if params is not None else InputPipelineParams()
+    dataset = tf.data.Dataset.from_generator(lambda: (tuple(batch) for batch in generator()),
+                                             output_types=tuple(dtypes),
+                                             output_shapes=tuple(tf.TensorShape([None]) for _ in dtypes))
+    dataset = dataset.map(_build_features_and_labels_fn(keys=keys, lookup_tables=lookup_tables,
+                                                        with_labels=with_labels))
+    dataset = dataset.prefetch(params.prefetch_buffer_size)
+
+    return dataset
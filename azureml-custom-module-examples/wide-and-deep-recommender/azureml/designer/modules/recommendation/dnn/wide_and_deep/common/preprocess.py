@@ -1,23 +1,27 @@
 import numpy as np
-from azureml.designer.modules.recommendation.dnn.common.dataset import TransactionDataset, FeatureDataset
+import pandas as pd
+from azureml.designer.modules.recommendation.dnn.common.dataset import TransactionDataset, FeatureDataset, \
+    TransactionShards
 from azureml.designer.modules.recommendation.dnn.common.utils import convert_to_str
 from azureml.studio.core.logger import time_profile
 
 
 @time_profile
-def preprocess_transactions(transactions: TransactionDataset):
+def preprocess_transactions(transactions: TransactionDataset, compact_ids=False):
     """Preprocess transaction dataset.
 
     The preprocess including:
     1. Drop instances with missing values
-    2. Convert user/item ids to string type
+    2. Convert user/item ids to string type, or to categorical columns of string ids if compact_ids is True, which
+    hold an integer code per instance instead of a string object
     """
+    transactions.compact_ids = compact_ids
     if transactions.ratings is not None:
         transactions.ratings = transactions.ratings.replace(to_replace=[np.inf, -np.inf], value=np.nan)
     if transactions.users is not None:
-        transactions.users = convert_to_str(transactions.users)
+        transactions.users = convert_to_str(transactions.users, categorical=compact_ids)
     if transactions.items is not None:
-        transactions.items = convert_to_str(transactions.items)
+        transactions.items = convert_to_str(transactions.items, categorical=compact_ids)
 
     transactions.df = transactions.df.dropna().reset_index(drop=True)
     transactions.build_column_attributes()
@@ -25,6 +29,30 @@ def preprocess_transactions(transactions: TransactionDataset):
     return transactions
 
 
+@time_profile
+def preprocess_transaction_shards(shards: TransactionShards):
+    """Preprocess transaction shards in a lightweight pass, which reads one shard at a time.
+
+    The pass counts the instances of each shard kept by preprocess_transactions, and collects unique user/item ids
+    as string type, which are converted after deduplication. Shards are preprocessed by preprocess_transactions
+    again when they are read for training, so only one shard is in memory at a time.
+    """
+    users = []
+    items = []
+    for shard_idx in range(shards.shards_count):
+        shard = shards.read_shard(shard_idx)
+        ratings = shard.ratings.replace(to_replace=[np.inf, -np.inf], value=np.nan)
+        valid = shard.users.notna() & shard.items.notna() & ratings.notna()
+        shards.instances_counts[shard_idx] = valid.sum()
+        users.append(convert_to_str(pd.Series(shard.users[valid].unique(), name=shard.users.name)))
+        items.append(convert_to_str(pd.Series(shard.items[valid].unique(), name=shard.items.name)))
+        del shard, ratings, valid
+
+    shards.users = pd.Series(pd.concat(users).unique(), name=users[0].name)
+    shards.items = pd.Series(pd.concat(items).unique(), name=items[0].name)
+    return shards
+
+
 @time_profile
 def preprocess_features(features: FeatureDataset):
     """Preprocess feature dataset.
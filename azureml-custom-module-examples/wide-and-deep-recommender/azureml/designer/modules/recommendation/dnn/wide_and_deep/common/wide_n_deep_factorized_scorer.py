@@ -0,0 +1,399 @@
+import numpy as np
+import pandas as pd
+from azureml.studio.core.logger import module_logger, TimeProfile
+from azureml.designer.modules.recommendation.dnn.common.feature_builder import FeatureBuilder
+from azureml.designer.modules.recommendation.dnn.common.checkpoint_reader import load_checkpoint
+from azureml.designer.modules.recommendation.dnn.common.constants import PREDICTION_BATCH_SIZE, RANDOM_SEED
+from azureml.designer.modules.recommendation.dnn.common.tf_feature_columns import CategoricalVocabListFeatureColumn, \
+    CategoricalIdentityFeatureColumn, NumericFeatureColumn, CrossedFeatureColumn, EmbeddingFeatureColumn
+from azureml.designer.modules.recommendation.dnn.wide_and_deep.common.wide_n_deep_model import WideNDeepModel, \
+    ActivationFnSelection
+
+# crossed features are hashed by chaining FingerprintCat64 over the feature codes, seeded with the default hash key
+# of tf.sparse.cross_hashed
+_CROSS_HASH_KEY = 0xDECAFCAFFE
+_FINGERPRINT_MUL = np.uint64(0xc6a4a7935bd1e995)
+_SHIFT_MIX_BITS = np.uint64(47)
+# default epsilon of the batch normalization layers built by the estimator
+_BATCH_NORM_EPSILON = 1e-3
+# default alpha of tf.nn.leaky_relu
+_LEAKY_RELU_ALPHA = 0.2
+# string categorical columns ignore empty strings, which are encoded as the missing code
+_MISSING_VALUE = ''
+_MISSING_CODE = -1
+
+_ACTIVATION_FNS = {ActivationFnSelection.ReLU: lambda x: np.maximum(x, 0),
+                   ActivationFnSelection.Sigmoid: lambda x: 0.5 * (np.tanh(0.5 * x) + 1),
+                   ActivationFnSelection.Tanh: np.tanh,
+                   ActivationFnSelection.Linear: lambda x: x,
+                   ActivationFnSelection.LeakyReLU: lambda x: np.maximum(_LEAKY_RELU_ALPHA * x, x)}
+
+
+def _shift_mix(values: np.ndarray):
+    return values ^ (values >> _SHIFT_MIX_BITS)
+
+
+def _fingerprint_cat64(fp1: np.ndarray, fp2: np.ndarray):
+    with np.errstate(over='ignore'):
+        result = fp1 ^ _FINGERPRINT_MUL
+        result ^= _shift_mix(fp2 * _FINGERPRINT_MUL) * _FINGERPRINT_MUL
+        result *= _FINGERPRINT_MUL
+        result = _shift_mix(result) * _FINGERPRINT_MUL
+        return _shift_mix(result)
+
+
+def cross_hashed(codes_list, hash_bucket_size: int):
+    """Hash crossed categorical codes into buckets, which is equal to tf.sparse.cross_hashed with one code per row.
+
+    :param codes_list: list of int64 arrays of the same length, the codes of the crossed categorical features in the
+    order of crossing.
+    :param hash_bucket_size: number of hash buckets
+    :return: int64 array, the bucket of each row.
+    """
+    hashed = np.full(len(codes_list[0]), _CROSS_HASH_KEY, dtype=np.uint64)
+    for codes in codes_list:
+        hashed = _fingerprint_cat64(hashed, codes.astype(np.uint64))
+    return (hashed % np.uint64(hash_bucket_size)).astype(np.int64)
+
+
+def _take_present(weights: np.ndarray, codes: np.ndarray):
+    """Gather weights by codes, where weights of missing codes are zeros."""
+    present = codes != _MISSING_CODE
+    result = np.zeros((len(codes), *weights.shape[1:]), dtype=weights.dtype)
+    result[present] = weights[codes[present]]
+    return result
+
+
+def _clip_by_norm(embeddings: np.ndarray, max_norm):
+    norms = np.sqrt(np.sum(np.square(embeddings), axis=1, keepdims=True))
+    return embeddings * np.float32(max_norm) / np.maximum(norms, np.float32(max_norm))
+
+
+class SidePartials:
+    """The tool class records partial results of a set of users or items, which are shared by all their pairs.
+
+    :param hidden: float32 array with shape (n, units), the partial pre-activations of the first hidden layer
+    :param logits: float32 array with shape (n,), the partial logits of the wide part
+    :param codes: dict of categorical feature key to int64 codes, the features crossed with the other side
+    """
+
+    def __init__(self, hidden: np.ndarray, logits: np.ndarray, codes: dict):
+        self.hidden = hidden
+        self.logits = logits
+        self.codes = codes
+
+
+class WideNDeepFactorizedScorer:
+    """The class scores user-item pairs with the trained weights of a Wide & Deep model, factorized by sides.
+
+    The first hidden layer is linear over the concatenated inputs, where each input is either a user feature or an
+    item feature, so its pre-activation is the sum of a user part and an item part. The wide part is also the sum of
+    user terms, item terms and crossed terms. Both parts are computed once per user and once per item, and only the
+    crossed terms and the remaining layers are evaluated for each pair, which saves most FLOPs of catalog scoring.
+    Results are equal to the estimator predictions up to float32 rounding. Scoring only runs numpy ops, and weights are
+    read from checkpoints by CheckpointReader, so the scorer also serves as the NumPy inference backend, which neither
+    imports tensorflow nor rebuilds the estimator graph.
+    """
+
+    def __init__(self, model: WideNDeepModel):
+        """Load trained weights from the model checkpoints.
+
+        :param model: the trained model, whose feature columns are built
+        :raise NotImplementedError: if the feature columns of the model cannot be factorized by sides, or their
+        variables are not found in checkpoints.
+        """
+        if model.wide_columns is None or model.deep_columns is None:
+            raise NotImplementedError("feature columns of the model are not built")
+        self._feature_builders = [model.user_feature_builder, model.item_feature_builder]
+        self._side_keys = [{builder.id_key, *builder.feature_metas} for builder in self._feature_builders]
+        self._activation_fn = _ACTIVATION_FNS[model.hyper_params.activation_fn]
+        self._vocab_indexes = {}
+
+        with TimeProfile("Load Wide & Deep weights from checkpoints"):
+            reader = load_checkpoint(model.checkpoints_dir)
+            variable_names = list(reader.get_variable_to_shape_map())
+            variable_names_set = set(variable_names)
+
+            def _load(name):
+                # variables of models trained by other versions may be missing or renamed
+                if name not in variable_names_set:
+                    raise NotImplementedError(f"variable {name} is not found in checkpoints")
+                return reader.get_tensor(name).astype(np.float32)
+
+            self._load_hidden_layers(_load, hidden_units=model.hyper_params.hidden_units,
+                                     batch_norm=model.hyper_params.batch_norm)
+            self._load_deep_inputs(_load, deep_columns=model.deep_columns, variable_names=variable_names)
+            self._load_wide_terms(_load, wide_columns=model.wide_columns)
+
+    @classmethod
+    def build(cls, model: WideNDeepModel):
+        """Build the scorer for the model, or return None if the model cannot be factorized by sides, so that the
+        model is scored by the estimator instead."""
+        try:
+            return cls(model=model)
+        except NotImplementedError as e:
+            module_logger.info(f"Cannot factorize the model by users and items, because {e}")
+            return None
+
+    def _load_hidden_layers(self, load, hidden_units, batch_norm):
+        self._hidden_layers = []
+        for layer_id in range(len(hidden_units)):
+            scope = f"dnn/hiddenlayer_{layer_id}"
+            kernel, bias = load(f"{scope}/kernel"), load(f"{scope}/bias")
+            scale, shift = None, None
+            if batch_norm:
+                bn_scope = f"{scope}/batchnorm_{layer_id}"
+                scale = load(f"{bn_scope}/gamma") / np.sqrt(load(f"{bn_scope}/moving_variance") + _BATCH_NORM_EPSILON)
+                shift = load(f"{bn_scope}/beta") - load(f"{bn_scope}/moving_mean") * scale
+            self._hidden_layers.append((kernel, bias, scale, shift))
+        self._logits_kernel = load("dnn/logits/kernel")
+        self._logits_bias = load("dnn/logits/bias")
+
+    def _load_deep_inputs(self, load, deep_columns, variable_names):
+        # the input layer concatenates feature columns sorted by names, and its rows of the first kernel are split
+        # embeddings of crossed features are pair inputs, which are looked up for each pair
+        first_kernel = self._hidden_layers[0][0]
+        self._deep_inputs = [[], []]
+        self._crossed_inputs = []
+        offset = 0
+        for column in sorted(deep_columns, key=lambda c: c.name):
+            if isinstance(column, EmbeddingFeatureColumn):
+                feature = column.categorical_feature
+                suffix = f"/{column.name}/embedding_weights"
+                name = next((n for n in variable_names if n.startswith("dnn/") and n.endswith(suffix)), None)
+                if name is None:
+                    raise NotImplementedError(f"embedding weights of {column.name} are not found")
+                table = (load(name), column.max_norm)
+                dimension = column.dimension
+            elif isinstance(column, NumericFeatureColumn) and tuple(column.shape) == (1,):
+                feature, table, dimension = column, None, 1
+            else:
+                raise NotImplementedError(f"deep column {column.name} is not supported")
+
+            kernel = first_kernel[offset:offset + dimension]
+            if isinstance(feature, CrossedFeatureColumn):
+                self._check_crossed_feature(feature)
+                self._crossed_inputs.append((feature, table, kernel))
+            else:
+                if table is not None:
+                    self._check_categorical_feature(feature)
+                self._deep_inputs[self._get_side(feature)].append((feature, table, kernel))
+            offset += dimension
+
+        if offset != first_kernel.shape[0]:
+            raise NotImplementedError(f"deep columns of dimension {offset} mismatch the first kernel")
+
+    def _load_wide_terms(self, load, wide_columns):
+        scope = "linear/linear_model"
+        self._wide_terms = [[], []]
+        self._crossed_terms = []
+        for column in wide_columns:
+            weights = load(f"{scope}/{column.name}/weights")[:, 0]
+            if isinstance(column, CrossedFeatureColumn):
+                self._check_crossed_feature(column)
+                self._crossed_terms.append((column, weights))
+            elif isinstance(column, (CategoricalVocabListFeatureColumn, CategoricalIdentityFeatureColumn)):
+                self._check_categorical_feature(column)
+                self._wide_terms[self._get_side(column)].append((column, weights))
+            elif isinstance(column, NumericFeatureColumn) and tuple(column.shape) == (1,):
+                self._wide_terms[self._get_side(column)].append((column, weights))
+            else:
+                raise NotImplementedError(f"wide column {column.name} is not supported")
+        self._linear_bias = load(f"{scope}/bias_weights")
+
+    def _get_side(self, feature):
+        for side, keys in enumerate(self._side_keys):
+            if feature.key in keys:
+                return side
+        raise NotImplementedError(f"feature {feature.key} is neither a user feature nor an item feature")
+
+    def _check_crossed_feature(self, feature: CrossedFeatureColumn):
+        for categorical_feature in feature.categorical_features:
+            self._check_categorical_feature(categorical_feature)
+            self._get_side(categorical_feature)
+
+    def _check_categorical_feature(self, feature):
+        if isinstance(feature, CategoricalIdentityFeatureColumn):
+            if feature.key not in {builder.id_key for builder in self._feature_builders}:
+                raise NotImplementedError(f"identity column {feature.key} is not an id column")
+        elif not isinstance(feature, CategoricalVocabListFeatureColumn):
+            raise NotImplementedError(f"categorical column {feature.name} is not supported")
+
+    def _encode(self, feature, values: pd.Series, feature_builder: FeatureBuilder):
+        """Encode categorical values as the ids looked up by the categorical column, with one OOV bucket.
+
+        Empty strings, which fill missing categorical features, are ignored by vocab list columns as missing values.
+        Their codes are _MISSING_CODE, whose embeddings are zeros and whose wide terms and crossed terms are absent.
+        """
+        if isinstance(feature, CategoricalIdentityFeatureColumn):
+            return feature_builder.encode_ids(ids=values).astype(np.int64)
+
+        if feature.key not in self._vocab_indexes:
+            self._vocab_indexes[feature.key] = pd.Index(feature.vocab)
+        vocab_index = self._vocab_indexes[feature.key]
+        codes = vocab_index.get_indexer(values).astype(np.int64)
+        codes[codes < 0] = len(vocab_index)
+        codes[(values == _MISSING_VALUE).values] = _MISSING_CODE
+        return codes
+
+    def build_user_partials(self, users):
+        return self._build_partials(side=0, ids=users)
+
+    def build_item_partials(self, items):
+        return self._build_partials(side=1, ids=items)
+
+    def export_item_partials(self, items, export_to: str, chunk_size=PREDICTION_BATCH_SIZE):
+        """Build item partials chunk by chunk, and export them as a memory-mapped matrix.
+
+        The hidden partials are item embeddings and item features projected by the first hidden layer, where items
+        are comparable with each other, while the raw embeddings of users and items are only related through it.
+        :param export_to: path of the .npy file, whose columns are hidden partials followed by wide logits
+        :return: tuple of (SidePartials, matrix), where the hidden partials and logits are views of the memory-mapped
+        matrix.
+        """
+        units = self._hidden_layers[0][0].shape[1]
+        matrix = np.lib.format.open_memmap(export_to, mode='w+', dtype=np.float32, shape=(len(items), units + 1))
+        codes = {}
+        for start in range(0, len(items), chunk_size):
+            partials = self.build_item_partials(items=items[start:start + chunk_size])
+            matrix[start:start + len(partials.logits), :units] = partials.hidden
+            matrix[start:start + len(partials.logits), units] = partials.logits
+            for key, chunk_codes in partials.codes.items():
+                codes.setdefault(key, []).append(chunk_codes)
+        matrix.flush()
+        codes = {key: np.concatenate(chunks) for key, chunks in codes.items()}
+        return SidePartials(hidden=matrix[:, :units], logits=matrix[:, units], codes=codes), matrix
+
+    @staticmethod
+    def build_group_partials(partials: SidePartials, group_codes: np.ndarray, groups_count: int):
+        """Build partials of groups, e.g. clusters of items, whose scores bound the scores of their members.
+
+        Hidden partials of a group are the mean of its members, while wide logits are the max of its members, so that
+        a group with a few members of high wide logits is not hidden by the others. Crossed codes of groups are
+        missing, so that crossed terms are not counted for groups.
+        :param group_codes: int array, the group of each member in partials
+        :return: SidePartials of groups, where hidden partials of empty groups are zeros and their logits are -inf.
+        """
+        counts = np.maximum(np.bincount(group_codes, minlength=groups_count), 1)
+        hidden = np.stack([np.bincount(group_codes, weights=partials.hidden[:, dim], minlength=groups_count)
+                           for dim in range(partials.hidden.shape[1])], axis=1) / counts[:, np.newaxis]
+        logits = np.full(groups_count, -np.inf, dtype=np.float32)
+        np.maximum.at(logits, group_codes, partials.logits)
+        codes = {key: np.full(groups_count, _MISSING_CODE, dtype=np.int64) for key in partials.codes}
+        return SidePartials(hidden=hidden.astype(np.float32), logits=logits.astype(np.float32), codes=codes)
+
+    def _build_partials(self, side, ids):
+        feature_builder = self._feature_builders[side]
+        features_df = feature_builder.build(ids=pd.Series(ids))
+        codes = {}
+
+        def _get_values(feature):
+            if isinstance(feature, NumericFeatureColumn):
+                return features_df[feature.key].values.astype(np.float32)
+            if feature.key not in codes:
+                codes[feature.key] = self._encode(feature, values=features_df[feature.key],
+                                                  feature_builder=feature_builder)
+            return codes[feature.key]
+
+        hidden = np.zeros((len(features_df), self._hidden_layers[0][0].shape[1]), dtype=np.float32)
+        for feature, table, kernel in self._deep_inputs[side]:
+            values = _get_values(feature)
+            if table is None:
+                hidden += values[:, np.newaxis] * kernel
+            else:
+                embeddings, max_norm = table
+                hidden += _clip_by_norm(_take_present(embeddings, values), max_norm=max_norm) @ kernel
+
+        logits = np.zeros(len(features_df), dtype=np.float32)
+        for feature, weights in self._wide_terms[side]:
+            values = _get_values(feature)
+            logits += values * weights[0] if isinstance(feature, NumericFeatureColumn) \
+                else _take_present(weights, values)
+
+        crossed_features = [column for column, _ in self._crossed_terms] + \
+            [column for column, _, _ in self._crossed_inputs]
+        crossed_codes = {feature.key: _get_values(feature) for column in crossed_features
+                         for feature in column.categorical_features if self._get_side(feature) == side}
+
+        return SidePartials(hidden=hidden, logits=logits, codes=crossed_codes)
+
+    def score_pairs(self, user_partials: SidePartials, item_partials: SidePartials, user_positions: np.ndarray,
+                    item_positions: np.ndarray):
+        """Score user-item pairs, given by positions of users and items in their partials.
+
+        :return: 1-D float32 numpy array, the predicted ratings of pairs.
+        """
+        net = user_partials.hidden[user_positions]
+        net += item_partials.hidden[item_positions]
+        for column, (embeddings, max_norm), kernel in self._crossed_inputs:
+            buckets = self._cross_pairs(column, user_partials=user_partials, item_partials=item_partials,
+                                        user_positions=user_positions, item_positions=item_positions)
+            net += _clip_by_norm(_take_present(embeddings, buckets), max_norm=max_norm) @ kernel
+        predictions = self._forward_deep(net)
+
+        predictions += user_partials.logits[user_positions]
+        predictions += item_partials.logits[item_positions]
+        predictions += self._linear_bias[0]
+        for column, weights in self._crossed_terms:
+            predictions += _take_present(weights, self._cross_pairs(
+                column, user_partials=user_partials, item_partials=item_partials, user_positions=user_positions,
+                item_positions=item_positions))
+
+        return predictions.astype(np.float32)
+
+    def _forward_deep(self, net: np.ndarray):
+        """Compute the deep logits from the pre-activations of the first hidden layer, excluding its bias."""
+        for layer_id, (kernel, bias, scale, shift) in enumerate(self._hidden_layers):
+            if layer_id > 0:
+                net = net @ kernel
+            net = net + bias
+            net = self._activation_fn(net)
+            if scale is not None:
+                net = net * scale + shift
+        return (net @ self._logits_kernel)[:, 0] + self._logits_bias[0]
+
+    def estimate_hidden_sensitivities(self, user_partials: SidePartials, item_partials: SidePartials,
+                                      pairs_count=1024, random_seed=RANDOM_SEED):
+        """Estimate how much the deep logits change with each pre-activation of the first hidden layer.
+
+        The sensitivity of a unit is the root mean square of the partial derivative over randomly sampled user-item
+        pairs, which is computed by central differences, so that it works for any activation function. Scaling hidden
+        partials by sensitivities makes distances between items comparable with differences of their wide logits.
+        :return: float32 array with shape (units,), the sensitivity of each unit.
+        """
+        random_state = np.random.RandomState(random_seed)
+        user_positions = np.sort(random_state.randint(len(user_partials.logits), size=pairs_count))
+        item_positions = np.sort(random_state.randint(len(item_partials.logits), size=pairs_count))
+        # differences are computed in float64, where rounding errors are negligible compared to the step
+        net = user_partials.hidden[user_positions].astype(np.float64) + item_partials.hidden[item_positions]
+        step = 1e-3 * max(float(np.std(net)), 1.0)
+        sensitivities = np.empty(net.shape[1], dtype=np.float32)
+        for unit in range(net.shape[1]):
+            net[:, unit] += step
+            upper = self._forward_deep(net)
+            net[:, unit] -= 2 * step
+            lower = self._forward_deep(net)
+            net[:, unit] += step
+            sensitivities[unit] = np.sqrt(np.mean(np.square((upper - lower) / (2 * step))))
+        return sensitivities
+
+    def _cross_pairs(self, column: CrossedFeatureColumn, user_partials: SidePartials, item_partials: SidePartials,
+                     user_positions: np.ndarray, item_positions: np.ndarray):
+        """Get the hash buckets of the crossed feature for pairs, which are missing if any crossed code is missing."""
+        codes_list = [user_partials.codes[f.key][user_positions] if self._get_side(f) == 0
+                      else item_partials.codes[f.key][item_positions] for f in column.categorical_features]
+        buckets = cross_hashed(codes_list, hash_bucket_size=column.hash_bucket_size)
+        buckets[np.logical_or.reduce([codes == _MISSING_CODE for codes in codes_list])] = _MISSING_CODE
+        return buckets
+
+    def estimate_pair_size(self):
+        """Roughly estimate the memory in bytes taken by one user-item pair during scoring.
+
+        Each pair holds user and item positions, a few copies of hidden activations and the crossed hashes.
+        """
+        _POSITION_SIZE = 8
+        _ACTIVATION_SIZE = 4
+        _COPIES = 3
+        max_units = max(kernel.shape[1] for kernel, _, _, _ in self._hidden_layers)
+        return 2 * _POSITION_SIZE + max_units * _ACTIVATION_SIZE * _COPIES + \
+            (len(self._crossed_terms) + len(self._crossed_inputs)) * 2 * _POSITION_SIZE
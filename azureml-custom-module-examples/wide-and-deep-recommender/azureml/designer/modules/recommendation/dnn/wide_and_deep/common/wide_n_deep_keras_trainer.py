@@ -0,0 +1,244 @@
+import os
+import numpy as np
+import tensorflow as tf
+from time import time
+from azureml.studio.core.logger import module_logger, TimeProfile
+from azureml.designer.modules.recommendation.dnn.common.tf_feature_columns import NumericFeatureColumn, \
+    EmbeddingFeatureColumn
+from azureml.designer.modules.recommendation.dnn.wide_and_deep.common.wide_n_deep_model import WideNDeepModel, \
+    NanLossDuringTrainingError, INPUT_LAYER_SCOPE, LINEAR_MODEL_SCOPE
+
+# variable scopes of the estimator, so that checkpoints saved by the trainer are loaded by the estimator
+_DNN_SCOPE = "dnn"
+_GLOBAL_STEP = "global_step"
+_CHECKPOINT_PREFIX = "model.ckpt"
+# default momentum of the batch normalization layers built by the estimator
+_BATCH_NORM_MOMENTUM = 0.999
+
+
+def _find_variable(variables, name_part: str):
+    matched = [variable for variable in variables if name_part in variable.name]
+    if len(matched) != 1:
+        raise RuntimeError(f"Expect one variable named by {name_part}, but got {[v.name for v in matched]}")
+    return matched[0]
+
+
+class LinearLayer(tf.keras.layers.Layer):
+    """The layer sums weighted wide columns and a bias, which is equal to the linear model of the estimator.
+
+    Categorical columns are weighted by one-dimensional embeddings with the sum combiner, so missing values and
+    OOV buckets are handled in the same way as the linear model. Numeric columns are weighted by their own kernels.
+    """
+
+    def __init__(self, feature_columns, **kwargs):
+        super().__init__(**kwargs)
+        self._categorical_columns = [c for c in feature_columns if not isinstance(c, NumericFeatureColumn)]
+        # numeric values are concatenated by names, which is the order of dense features
+        self._numeric_columns = sorted([c for c in feature_columns if isinstance(c, NumericFeatureColumn)],
+                                       key=lambda c: c.name)
+        self._categorical_input = None
+        self._numeric_input = None
+        if self._categorical_columns:
+            self._categorical_input = tf.keras.layers.DenseFeatures(
+                [tf.feature_column.embedding_column(categorical_column=c.build(), dimension=1, combiner='sum',
+                                                    initializer=tf.compat.v1.zeros_initializer())
+                 for c in self._categorical_columns], name="categorical_weights")
+        if self._numeric_columns:
+            self._numeric_input = tf.keras.layers.DenseFeatures([c.build() for c in self._numeric_columns],
+                                                                name="numeric_values")
+        self._numeric_kernels = []
+        self.bias = None
+
+    def build(self, input_shape):
+        self._numeric_kernels = [self.add_weight(name=f"{c.name}/weights", shape=(int(np.prod(c.shape)), 1),
+                                                 initializer='zeros') for c in self._numeric_columns]
+        self.bias = self.add_weight(name="bias_weights", shape=(1,), initializer='zeros')
+        super().build(input_shape)
+
+    def call(self, features):
+        logits = self.bias
+        if self._categorical_input is not None:
+            logits = logits + tf.reduce_sum(self._categorical_input(features), axis=1, keepdims=True)
+        if self._numeric_input is not None:
+            logits = logits + tf.matmul(self._numeric_input(features), tf.concat(self._numeric_kernels, axis=0))
+        return logits
+
+    def get_checkpoint_variables(self):
+        """Get the variables of the layer, keyed by their names in the linear model of the estimator."""
+        variables = {f"{LINEAR_MODEL_SCOPE}/bias_weights": self.bias}
+        for column in self._categorical_columns:
+            variables[f"{LINEAR_MODEL_SCOPE}/{column.name}/weights"] = _find_variable(
+                self._categorical_input.variables, name_part=f"/{column.name}_embedding/")
+        for column, kernel in zip(self._numeric_columns, self._numeric_kernels):
+            variables[f"{LINEAR_MODEL_SCOPE}/{column.name}/weights"] = kernel
+        return variables
+
+
+class WideNDeepKerasTrainer:
+    """The class trains Wide & Deep models as Keras functional models, with a training step compiled by tf.function.
+
+    The functional model has the same layers, initializers and loss as tf.estimator.DNNLinearCombinedRegressor,
+    and the wide part and the deep part are optimized by their own optimizers. Trained weights are saved as
+    checkpoints with the variable names of the estimator, so models trained by either engine are interchangeable
+    at scoring time. Compared with the estimator, the training step runs as one graph function without session
+    hooks, which saves the per-step overhead of small batches.
+    """
+
+    def __init__(self, model: WideNDeepModel, distributed_lib=None):
+        """Build the Keras model with the hyper parameters and feature columns of the Wide & Deep model.
+
+        :param model: the Wide & Deep model to train, whose feature columns are built
+        :param distributed_lib: horovod.tensorflow module in mpi mode, gradients are allreduced among ranks by it
+        """
+        self.hyper_params = model.hyper_params
+        self._distributed_lib = distributed_lib
+        tf.random.set_seed(model.random_seed)
+        self._wide_optimizer = model.build_optimizer(optimizer_name=self.hyper_params.wide_optimizer,
+                                                     learning_rate=self.hyper_params.wide_lr,
+                                                     distributed_wrapper=False)
+        self._deep_optimizer = model.build_optimizer(optimizer_name=self.hyper_params.deep_optimizer,
+                                                     learning_rate=self.hyper_params.deep_lr,
+                                                     distributed_wrapper=False)
+        activation_fn = model.build_activation_fn(activation_fn_name=self.hyper_params.activation_fn)
+
+        self._deep_columns = model.deep_columns
+        self._input_layer = tf.keras.layers.DenseFeatures([c.build() for c in model.deep_columns],
+                                                          name="input_layer")
+        self._hidden_layers = []
+        for layer_id, units in enumerate(self.hyper_params.hidden_units):
+            dense = tf.keras.layers.Dense(units=units, activation=activation_fn,
+                                          kernel_initializer=tf.compat.v1.glorot_uniform_initializer(),
+                                          name=f"hiddenlayer_{layer_id}")
+            # dropout is only applied in training, the same as the estimator
+            dropout = tf.keras.layers.Dropout(rate=self.hyper_params.dropout) if self.hyper_params.dropout else None
+            batch_norm = tf.keras.layers.BatchNormalization(momentum=_BATCH_NORM_MOMENTUM,
+                                                            name=f"batchnorm_{layer_id}") \
+                if self.hyper_params.batch_norm else None
+            self._hidden_layers.append((dense, dropout, batch_norm))
+        self._logits_layer = tf.keras.layers.Dense(units=1,
+                                                   kernel_initializer=tf.compat.v1.glorot_uniform_initializer(),
+                                                   name="logits")
+        self._linear_layer = LinearLayer(feature_columns=model.wide_columns, name="linear_model")
+        self.keras_model = None
+
+    def _build_keras_model(self, feature_specs: dict):
+        inputs = {key: tf.keras.Input(shape=(), dtype=spec.dtype, name=key) for key, spec in feature_specs.items()}
+        net = self._input_layer(inputs)
+        for dense, dropout, batch_norm in self._hidden_layers:
+            net = dense(net)
+            if dropout is not None:
+                net = dropout(net)
+            if batch_norm is not None:
+                net = batch_norm(net)
+        logits = tf.keras.layers.Add(name="add_logits")([self._logits_layer(net), self._linear_layer(inputs)])
+        self.keras_model = tf.keras.Model(inputs=inputs, outputs=logits, name="wide_n_deep")
+
+    def _get_deep_variables(self):
+        variables = list(self._input_layer.trainable_variables)
+        for dense, _, batch_norm in self._hidden_layers:
+            variables.extend(dense.trainable_variables)
+            if batch_norm is not None:
+                variables.extend(batch_norm.trainable_variables)
+        variables.extend(self._logits_layer.trainable_variables)
+        return variables
+
+    def train(self, dataset: tf.data.Dataset, batches_count: int, epochs: int, warm_start_values: dict = None):
+        """Train the model with the dataset, and log the mean loss of each epoch.
+
+        :param dataset: tf.data.Dataset, which yields (features dict, labels) tuples of all epochs
+        :param batches_count: number of batches per epoch
+        :param epochs: number of epochs
+        :param warm_start_values: optional dict of estimator variable name to numpy array, which initializes the
+        variables of the same names
+        :return: number of trained steps
+        """
+        self._build_keras_model(feature_specs=dataset.element_spec[0])
+        if warm_start_values:
+            self._warm_start(warm_start_values)
+        deep_variables = self._get_deep_variables()
+        wide_variables = list(self._linear_layer.trainable_variables)
+        distributed_lib = self._distributed_lib
+
+        def _train_step(features, labels):
+            with tf.GradientTape() as tape:
+                predictions = tf.squeeze(self.keras_model(features, training=True), axis=1)
+                # the same as the regression head of the estimator, mean squared error over the batch
+                loss = tf.reduce_mean(tf.math.squared_difference(predictions, labels))
+            if distributed_lib is not None:
+                tape = distributed_lib.DistributedGradientTape(tape)
+            gradients = tape.gradient(loss, deep_variables + wide_variables)
+            self._deep_optimizer.apply_gradients(zip(gradients[:len(deep_variables)], deep_variables))
+            self._wide_optimizer.apply_gradients(zip(gradients[len(deep_variables):], wide_variables))
+            return loss
+
+        # steps are run in a graph loop, so the per-step cost of dispatching from python is paid once per call
+        @tf.function
+        def _train_steps(iterator, steps_count):
+            loss_sum = tf.constant(0.0)
+            for _ in tf.range(steps_count):
+                features, labels = next(iterator)
+                loss_sum += _train_step(features, labels)
+            return loss_sum
+
+        iterator = iter(dataset)
+        for epoch in range(epochs):
+            epoch_start_time = time()
+            epoch_loss = 0.0
+            steps_count = batches_count
+            if epoch == 0 and distributed_lib is not None:
+                # variables are created by the first step, and then synchronized from the first rank
+                epoch_loss += float(_train_steps(iterator, tf.constant(1)))
+                distributed_lib.broadcast_variables(self.keras_model.variables, root_rank=0)
+                distributed_lib.broadcast_variables(self._deep_optimizer.variables(), root_rank=0)
+                distributed_lib.broadcast_variables(self._wide_optimizer.variables(), root_rank=0)
+                steps_count -= 1
+            epoch_loss += float(_train_steps(iterator, tf.constant(steps_count)))
+            epoch_loss /= batches_count
+            if np.isnan(epoch_loss):
+                raise NanLossDuringTrainingError
+            module_logger.info(f"Epoch {epoch + 1}: loss = {epoch_loss}, "
+                               f"{batches_count / (time() - epoch_start_time):.2f} steps/sec")
+
+        return batches_count * epochs
+
+    def _warm_start(self, warm_start_values: dict):
+        # variables missing in the previous model keep their initial values, which is the same as the estimator
+        variables = {name: variable for name, variable in self._get_checkpoint_variables().items()
+                     if name in warm_start_values}
+        for name, variable in variables.items():
+            variable.assign(warm_start_values[name])
+        module_logger.info(f"Warm start {len(variables)} variables")
+
+    def _get_checkpoint_variables(self):
+        """Get the model variables, keyed by their names in the estimator."""
+        variables = {}
+        for column in self._deep_columns:
+            if isinstance(column, EmbeddingFeatureColumn):
+                name = f"{column.name}/embedding_weights"
+                variables[f"{INPUT_LAYER_SCOPE}/{name}"] = _find_variable(self._input_layer.variables,
+                                                                          name_part=f"/{name}")
+        for layer_id, (dense, _, batch_norm) in enumerate(self._hidden_layers):
+            scope = f"{_DNN_SCOPE}/hiddenlayer_{layer_id}"
+            variables[f"{scope}/kernel"] = dense.kernel
+            variables[f"{scope}/bias"] = dense.bias
+            if batch_norm is not None:
+                for name in ["gamma", "beta", "moving_mean", "moving_variance"]:
+                    variables[f"{scope}/batchnorm_{layer_id}/{name}"] = getattr(batch_norm, name)
+        variables[f"{_DNN_SCOPE}/logits/kernel"] = self._logits_layer.kernel
+        variables[f"{_DNN_SCOPE}/logits/bias"] = self._logits_layer.bias
+        variables.update(self._linear_layer.get_checkpoint_variables())
+        return variables
+
+    def save_checkpoint(self, checkpoints_dir: str, global_step: int):
+        """Save trained weights as an estimator checkpoint, optimizer slots are not saved.
+
+        :return: str, the path prefix of the saved checkpoint
+        """
+        with TimeProfile(f"Save checkpoint to {checkpoints_dir}"):
+            os.makedirs(checkpoints_dir, exist_ok=True)
+            variables = self._get_checkpoint_variables()
+            variables[_GLOBAL_STEP] = tf.Variable(global_step, dtype=tf.int64, trainable=False)
+            # paths are relative, because checkpoints are copied to the model directory when the model is saved
+            saver = tf.compat.v1.train.Saver(var_list=variables, max_to_keep=1, save_relative_paths=True)
+            return saver.save(sess=None, save_path=os.path.join(checkpoints_dir, _CHECKPOINT_PREFIX),
+                              global_step=global_step)
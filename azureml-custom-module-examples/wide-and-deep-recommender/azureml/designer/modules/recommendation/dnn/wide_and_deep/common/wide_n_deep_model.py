@@ -2,10 +2,11 @@ import os
 import datetime
 import shutil
 import pandas as pd
-import tensorflow as tf
 import numpy as np
 import importlib
 import pickle
+import json
+import re
 from tempfile import TemporaryDirectory
 from enum import Enum
 from time import time
@@ -14,14 +15,28 @@ from azureml.designer.modules.recommendation.dnn.common.entry_param import Entry
 from azureml.studio.core.error import UserError, InvalidDirectoryError
 from azureml.studio.internal.error import InvalidModelDirectoryError
 from azureml.designer.modules.recommendation.dnn.common.feature_builder import FeatureBuilder
+from azureml.designer.modules.recommendation.dnn.common.utils import read_ahead, tf
+from azureml.designer.modules.recommendation.dnn.common.checkpoint_reader import latest_checkpoint
+from azureml.designer.modules.recommendation.dnn.wide_and_deep.common.input_pipeline import InputPipelineParams, \
+    build_dataset, build_generator_dataset, batch_chunks
 from azureml.designer.modules.recommendation.dnn.common.tf_feature_columns import CategoricalVocabListFeatureColumn, \
-    NumericFeatureColumn, CrossedFeatureColumn, EmbeddingFeatureColumn, parse_basic_features
-from azureml.designer.modules.recommendation.dnn.common.constants import RANDOM_SEED, MODEL_SAVE_FILE
-from azureml.designer.modules.recommendation.dnn.common.dataset import TransactionDataset, FeatureDataset
+    CategoricalIdentityFeatureColumn, NumericFeatureColumn, CrossedFeatureColumn, EmbeddingFeatureColumn, \
+    parse_basic_features, feature_column_from_dict
+from azureml.designer.modules.recommendation.dnn.common.constants import RANDOM_SEED, MODEL_SAVE_FILE, \
+    PREDICTION_BATCH_SIZE, MODEL_MANIFEST_FILE, MODEL_FORMAT_VERSION
+from azureml.designer.modules.recommendation.dnn.common.dataset import TransactionDataset, FeatureDataset, \
+    TransactionShards
+from azureml.designer.modules.recommendation.dnn.wide_and_deep.common.preprocess import preprocess_transactions
 from azureml.studio.core.io.model_directory import ModelDirectory
 from azureml.designer.core.model.core_model import CoreModel
 
 _HVD_LIB = None
+# keys of the feature positions fed to the model in feature lookup mode
+_USER_FEATURE_INDEX_KEY = "__user_feature_index"
+_ITEM_FEATURE_INDEX_KEY = "__item_feature_index"
+# variable scopes of the estimator feature columns, which are shared by checkpoints of all training engines
+INPUT_LAYER_SCOPE = "dnn/input_from_feature_columns/input_layer"
+LINEAR_MODEL_SCOPE = "linear/linear_model"
 
 
 class ActivationFnSelection(Enum):
@@ -32,6 +47,16 @@ class ActivationFnSelection(Enum):
     LeakyReLU = 'LeakyReLU'
 
 
+class InferenceBackend(Enum):
+    TensorFlow = 'TensorFlow'
+    NumPy = 'NumPy'
+
+
+class TrainingEngine(Enum):
+    Estimator = 'Estimator'
+    Keras = 'Keras'
+
+
 class OptimizerSelection(Enum):
     Adagrad = 'Adagrad'
     Adam = 'Adam'
@@ -97,6 +122,21 @@ class WideNDeepModelHyperParams:
 
         return hyper_param_info
 
+    def to_dict(self):
+        hyper_params = dict((key, value.value if isinstance(value, Enum) else value)
+                            for key, value in self.__dict__.items())
+        hyper_params["hidden_units"] = list(self.hidden_units)
+        return hyper_params
+
+    @classmethod
+    def from_dict(cls, hyper_params: dict):
+        hyper_params = dict(hyper_params)
+        hyper_params["wide_optimizer"] = OptimizerSelection(hyper_params["wide_optimizer"])
+        hyper_params["deep_optimizer"] = OptimizerSelection(hyper_params["deep_optimizer"])
+        hyper_params["activation_fn"] = ActivationFnSelection(hyper_params["activation_fn"])
+        hyper_params["hidden_units"] = tuple(hyper_params["hidden_units"])
+        return cls(**hyper_params)
+
 
 class WideNDeepModel(CoreModel, metaclass=EntryParam):
     MODEL_NAME = "Wide & Deep Recommendation Model"
@@ -113,6 +153,12 @@ class WideNDeepModel(CoreModel, metaclass=EntryParam):
         self.wide_columns = wide_columns
         self.deep_columns = deep_columns
         self.estimator = None
+        self._predictor = None
+        self._predictor_version = None
+        self._factorized_scorer = None
+        self.input_pipeline_params = InputPipelineParams()
+        # the backend is chosen at scoring time, so it is not saved with the model
+        self.inference_backend = InferenceBackend.TensorFlow
         # this is a temporary work directory
         self._tmp_dir = TemporaryDirectory()
         self.save_dir = save_dir if save_dir else self._tmp_dir.name
@@ -136,15 +182,35 @@ class WideNDeepModel(CoreModel, metaclass=EntryParam):
             self.save_dir = None
 
     def get_epochs(self):
+        # in mpi mode, transactions are sharded instead of epochs, and each rank iterates its shard for all epochs
+        return self.hyper_params.epochs
+
+    def get_rank_shard(self, transactions: TransactionDataset, random_seed=None):
+        """Get the disjoint shard of transactions for the current rank in mpi mode.
+
+        Transactions are shuffled with the model random seed, which is the same for all ranks, and then dealt to ranks
+        in turn. Shards are padded to the same size by repeating their own transactions, because all ranks should
+        run the same number of steps to allreduce gradients.
+        :param random_seed: optional seed to shuffle transactions, which must be the same for all ranks, the model
+        random seed by default.
+        """
         if not self.mpi_support:
-            return self.hyper_params.epochs
-        else:
-            ave_epochs = int(self.hyper_params.epochs / self.hvd_size)
-            if self.hyper_params.epochs - ave_epochs * self.hvd_size > 0:
-                local_epochs = ave_epochs + 1
-            else:
-                local_epochs = ave_epochs
-            return local_epochs
+            return transactions
+
+        instances_count = transactions.row_size
+        shard_size = self._get_rank_shard_size(instances_count)
+        random_seed = self.random_seed if random_seed is None else random_seed
+        permutation = np.random.RandomState(random_seed).permutation(instances_count)
+        if 0 < instances_count < self.hvd_size:
+            # repeat transactions, so that every rank is dealt at least one transaction
+            permutation = np.resize(permutation, self.hvd_size)
+        positions = np.resize(permutation[self.hvd_rank::self.hvd_size], shard_size)
+        module_logger.info(f"Get {shard_size} of {instances_count} transactions for rank {self.hvd_rank}.")
+        return TransactionDataset(df=transactions.df.iloc[positions].reset_index(drop=True),
+                                  column_attributes=transactions.column_attributes, name=transactions.name)
+
+    def _get_rank_shard_size(self, instances_count):
+        return int(np.ceil(instances_count / self.hvd_size)) if self.mpi_support else instances_count
 
     def default_columns(self):
         """Define a default wide columns and deep columns scheme.
@@ -152,11 +218,12 @@ class WideNDeepModel(CoreModel, metaclass=EntryParam):
         The wide columns include, users, items, users and items crossed features.
         The deep columns include, user embeddings, item embeddings, other categorical feature embeddings
         and numeric features.
+        User and item ids are fed as integer codes, with one more bucket for the OOV code.
         """
-        user = CategoricalVocabListFeatureColumn(key=self.user_feature_builder.id_key,
-                                                 vocab=self.user_feature_builder.id_vocab)
-        item = CategoricalVocabListFeatureColumn(key=self.item_feature_builder.id_key,
-                                                 vocab=self.item_feature_builder.id_vocab)
+        user = CategoricalIdentityFeatureColumn(key=self.user_feature_builder.id_key,
+                                                num_buckets=self.user_feature_builder.oov_code + 1)
+        item = CategoricalIdentityFeatureColumn(key=self.item_feature_builder.id_key,
+                                                num_buckets=self.item_feature_builder.oov_code + 1)
 
         # wide feature columns
         crossed_feature = CrossedFeatureColumn(categorical_features=[user, item],
@@ -179,9 +246,9 @@ class WideNDeepModel(CoreModel, metaclass=EntryParam):
 
         return wide_columns, deep_columns
 
-    def build_model(self, run_config=None, load_checkpoints=False):
+    def build_model(self, run_config=None, load_checkpoints=False, warm_start_from=None):
         if load_checkpoints:
-            checkpoints_exist = tf.train.latest_checkpoint(self.checkpoints_dir) is not None
+            checkpoints_exist = latest_checkpoint(self.checkpoints_dir) is not None
             if not checkpoints_exist:
                 raise RuntimeError(f"Cannot find checkpoints file in {self.checkpoints_dir}")
 
@@ -210,20 +277,48 @@ class WideNDeepModel(CoreModel, metaclass=EntryParam):
                                                                  dnn_dropout=self.hyper_params.dropout,
                                                                  batch_norm=self.hyper_params.batch_norm,
                                                                  config=run_config,
-                                                                 model_dir=self.checkpoints_dir)
-
-    def train(self, transactions: TransactionDataset):
-        instances_count = transactions.row_size
+                                                                 model_dir=self.checkpoints_dir,
+                                                                 warm_start_from=warm_start_from)
+
+    def train(self, transactions, training_engine: TrainingEngine = TrainingEngine.Estimator,
+              warm_start_from: str = None):
+        """Train the model with either engine, which saves checkpoints of the same variables.
+
+        :param transactions: TransactionDataset in memory, or preprocessed TransactionShards which are streamed shard
+        by shard, see get_shards_input_fn.
+        :param training_engine: TrainingEngine, Estimator trains the model by tf.estimator, and Keras trains the
+        equivalent Keras model with a compiled training step.
+        :param warm_start_from: optional checkpoints directory of a previously trained model of the same structure,
+        whose variables initialize the model instead of random values, see build_warm_start_values.
+        """
+        # feature columns define the inputs fed by the input fn
+        self._build_feature_columns()
+        if isinstance(transactions, TransactionShards):
+            instances_count = sum(self._get_rank_shard_size(count) for count in transactions.instances_counts)
+            input_fn = self.get_shards_input_fn(shards=transactions, batch_size=self.hyper_params.batch_size,
+                                                epochs=self.get_epochs(), shuffle=True)
+        else:
+            transactions = self.get_rank_shard(transactions=transactions)
+            instances_count = transactions.row_size
+            input_fn = self.get_input_fn(transactions=transactions, batch_size=self.hyper_params.batch_size,
+                                         epochs=self.get_epochs(), shuffle=True)
         batches_count = np.ceil(instances_count / self.hyper_params.batch_size)
         module_logger.info(f"Get {instances_count} training instances, and {batches_count} batches per epoch.")
+        warm_start_values = None
+        if warm_start_from is not None:
+            with TimeProfile(f"Load warm start variables from {warm_start_from}"):
+                warm_start_values = self.build_warm_start_values(checkpoints_dir=warm_start_from)
+        if training_engine == TrainingEngine.Keras:
+            self._train_with_keras(input_fn=input_fn, batches_count=int(batches_count),
+                                   warm_start_values=warm_start_values)
+            return
+
         run_config = tf.estimator.RunConfig(tf_random_seed=self.random_seed,
                                             log_step_count_steps=batches_count,  # log loss after each epoch
                                             save_checkpoints_steps=batches_count * self.hyper_params.epochs,
                                             keep_checkpoint_max=1)
         module_logger.info(f"Build model:\n{self.hyper_params}")
-        self.build_model(run_config=run_config)
-        input_fn = self.get_input_fn(transactions=transactions, batch_size=self.hyper_params.batch_size,
-                                     epochs=self.get_epochs(), shuffle=True)
+        self.build_model(run_config=run_config, warm_start_from=self._build_warm_start_settings(warm_start_values))
         hooks = []
         if self.mpi_support:
             hooks.append(_HVD_LIB.BroadcastGlobalVariablesHook(0))
@@ -234,34 +329,252 @@ class WideNDeepModel(CoreModel, metaclass=EntryParam):
         except tf.estimator.NanLossDuringTrainingError as e:
             raise NanLossDuringTrainingError from e
 
+    def _train_with_keras(self, input_fn, batches_count: int, warm_start_values=None):
+        # imported here, because the trainer module depends on this module
+        from azureml.designer.modules.recommendation.dnn.wide_and_deep.common.wide_n_deep_keras_trainer \
+            import WideNDeepKerasTrainer
+
+        module_logger.info(f"Build Keras model:\n{self.hyper_params}")
+        self._build_feature_columns()
+        trainer = WideNDeepKerasTrainer(model=self, distributed_lib=_HVD_LIB if self.mpi_support else None)
+        with TimeProfile("Training Wide & Deep recommendation model with Keras"):
+            module_logger.info(f"Start to train model, rank {self.hvd_rank}")
+            steps = trainer.train(dataset=input_fn(), batches_count=batches_count, epochs=self.get_epochs(),
+                                  warm_start_values=warm_start_values)
+        # only the first rank saves checkpoints in mpi mode
+        if self.checkpoints_dir is not None:
+            trainer.save_checkpoint(checkpoints_dir=self.checkpoints_dir, global_step=steps)
+
+    def build_warm_start_values(self, checkpoints_dir: str):
+        """Load model variables from the checkpoints of a previously trained model of the same structure.
+
+        Id vocabs are extended by appending new ids, so the id tables, i.e. the id weights of the wide part and the
+        id embeddings of the deep part, are grown to the extended vocabs. Rows of existing ids are kept, and rows of
+        new ids are initialized with the OOV row, which is how new ids were scored by the previous model.
+        Optimizer slots and the global step are not loaded, so training restarts with fresh optimizer states.
+        :return: dict of variable name to numpy array.
+        """
+        id_table_rows = {}
+        for column in self.wide_columns:
+            if isinstance(column, CategoricalIdentityFeatureColumn):
+                id_table_rows[f"{LINEAR_MODEL_SCOPE}/{column.name}/weights"] = column.num_buckets
+        for column in self.deep_columns:
+            if isinstance(column, EmbeddingFeatureColumn) and \
+                    isinstance(column.categorical_feature, CategoricalIdentityFeatureColumn):
+                id_table_rows[f"{INPUT_LAYER_SCOPE}/{column.name}/embedding_weights"] = \
+                    column.categorical_feature.num_buckets
+
+        reader = tf.train.load_checkpoint(checkpoints_dir)
+        values = {}
+        for name in reader.get_variable_to_shape_map():
+            if not name.startswith(("dnn/", "linear/")):
+                continue
+            value = reader.get_tensor(name)
+            rows_count = id_table_rows.get(name, len(value))
+            if rows_count > len(value):
+                module_logger.info(f"Grow {name} from {len(value)} to {rows_count} rows")
+                value = np.concatenate([value[:-1], np.repeat(value[-1:], rows_count - len(value) + 1, axis=0)])
+            values[name] = value
+
+        return values
+
+    def _build_warm_start_settings(self, warm_start_values: dict):
+        """Build warm start settings of the estimator, which loads the warm start values from a temp checkpoint."""
+        if not warm_start_values:
+            return None
+
+        # variables are saved eagerly, so large id tables are not embedded into the graph as constants
+        variables = {name: tf.Variable(value, name=name) for name, value in warm_start_values.items()}
+        checkpoint_dir = os.path.join(self._tmp_dir.name, "warm_start")
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        saver = tf.compat.v1.train.Saver(var_list=variables)
+        checkpoint_path = saver.save(sess=None, save_path=os.path.join(checkpoint_dir, "model.ckpt"))
+        # each name is a regex scope, which is anchored by the output index to match the exact variable
+        return tf.estimator.WarmStartSettings(ckpt_to_initialize_from=checkpoint_path,
+                                              vars_to_warm_start=[f"{re.escape(name)}:" for name in warm_start_values])
+
     def predict(self, transactions: TransactionDataset):
         if transactions.row_size == 0:
             return pd.Series()
 
+        # pairs with the same model inputs, e.g. cold-start users rating the same item, are predicted only once
+        with TimeProfile("Group user-item pairs by signatures"):
+            pair_codes, representatives = self._encode_pair_signatures(transactions)
+        if len(representatives) < transactions.row_size:
+            module_logger.info(f"Get {len(representatives)} distinct user-item pairs of {transactions.row_size} "
+                               f"instances by signatures")
+            transactions = TransactionDataset(transactions.df.iloc[representatives].reset_index(drop=True))
+
         instances_count = transactions.row_size
-        log_every_n_instances = instances_count // 5 if instances_count >= 5 else instances_count
         module_logger.info(f"Get {instances_count} test instances")
-        module_logger.info(f"Rebuild model:\n {self.hyper_params}")
-        self.build_model(load_checkpoints=True)
-        input_fn = self.get_input_fn(transactions=transactions, batch_size=self.hyper_params.batch_size)
-        predictions = []
+        predictions = np.empty(instances_count, dtype=np.float32)
+        log_every_n_instances = instances_count // 5 if instances_count >= 5 else instances_count
+        next_log_count = log_every_n_instances
         start_time = time()
 
         with TimeProfile("Making predictions for user-item pairs"):
-            for p in self.estimator.predict(input_fn=input_fn):
-                if len(predictions) % log_every_n_instances == 0 and len(predictions) > 0:
+            for batch_start, batch_predictions in self.predict_batches(transactions):
+                batch_end = batch_start + len(batch_predictions)
+                predictions[batch_start:batch_end] = batch_predictions
+                if batch_end >= next_log_count and batch_end < instances_count:
                     cost_seconds = time() - start_time
-                    remaining_seconds = cost_seconds / len(predictions) * (instances_count - len(predictions))
-                    module_logger.info(f"Finished {len(predictions)} instance predictions, "
+                    remaining_seconds = cost_seconds / batch_end * (instances_count - batch_end)
+                    module_logger.info(f"Finished {batch_end} instance predictions, "
                                        f"cost time: {datetime.timedelta(seconds=cost_seconds)}."
                                        f"Remaining time: {datetime.timedelta(seconds=remaining_seconds)}")
-                predictions.append(p["predictions"][0])
-            module_logger.info(f"Finished {len(predictions)} instance predictions. "
+                    next_log_count = (batch_end // log_every_n_instances + 1) * log_every_n_instances
+            module_logger.info(f"Finished {instances_count} instance predictions. "
                                f"Cost time: {datetime.timedelta(seconds=(time() - start_time))}")
 
-        predictions = pd.Series(predictions)
+        return pd.Series(predictions[pair_codes])
+
+    def _encode_pair_signatures(self, transactions: TransactionDataset):
+        """Encode user-item pairs as signature codes, where pairs with the same model inputs share the same code.
+
+        :return: tuple of (pair_codes, representatives), pair_codes is an int64 array with a code for each instance,
+        and representatives are the positions of the first instance of each code, in ascending order.
+        """
+        # ids are highly repeated, so only unique ids are encoded, and then broadcast back
+        user_codes, users = pd.factorize(transactions.users)
+        user_codes = self.user_feature_builder.encode_signatures(ids=pd.Series(users))[user_codes]
+        item_codes, items = pd.factorize(transactions.items)
+        item_codes = self.item_feature_builder.encode_signatures(ids=pd.Series(items))[item_codes]
+        pair_codes = pd.factorize(user_codes * (item_codes.max() + 1) + item_codes)[0].astype(np.int64)
+        _, representatives = np.unique(pair_codes, return_index=True)
+        return pair_codes, representatives
+
+    def predict_batches(self, transactions: TransactionDataset, batch_size=PREDICTION_BATCH_SIZE):
+        """Predict transactions batch by batch.
+
+        :return: generator of (batch_start, batch_predictions) tuples, where batch_start is the position of the first
+        instance in the batch, and batch_predictions is a 1-D float32 numpy array.
+        """
+        if self.inference_backend == InferenceBackend.NumPy:
+            scorer = self.get_factorized_scorer()
+            if scorer is not None:
+                yield from self._predict_batches_with_numpy(scorer, transactions=transactions, batch_size=batch_size)
+                return
+            module_logger.warning("The model is not supported by the NumPy backend, use TensorFlow backend instead.")
+
+        if self._predictor is None or self._predictor_version != self._get_predictor_version():
+            self.build_predictor()
+        x_df, _ = self.build_input_data(transactions=transactions,
+                                        feature_lookup=bool(self._predictor.lookup_tables))
+        features = {key: x_df[key].values for key in self._predictor.feature_dtypes}
+        del x_df
+        dataset = build_dataset(features=features, batch_size=batch_size, params=self.input_pipeline_params)
+        batch_start = 0
+        for batch_features in dataset:
+            batch_predictions = self._predictor.predict(batch_features)
+            yield batch_start, batch_predictions
+            batch_start += len(batch_predictions)
+
+    @staticmethod
+    def _predict_batches_with_numpy(scorer, transactions: TransactionDataset, batch_size):
+        """Predict transactions batch by batch with the factorized scorer, see predict_batches for details.
+
+        Users and items are factorized, so that their partials are computed once for all their transactions.
+        """
+        with TimeProfile("Build partials for users and items"):
+            user_codes, users = pd.factorize(transactions.users)
+            item_codes, items = pd.factorize(transactions.items)
+            user_partials = scorer.build_user_partials(users=users)
+            item_partials = scorer.build_item_partials(items=items)
+        for batch_start in range(0, transactions.row_size, batch_size):
+            batch_end = batch_start + batch_size
+            yield batch_start, scorer.score_pairs(user_partials=user_partials, item_partials=item_partials,
+                                                  user_positions=user_codes[batch_start:batch_end],
+                                                  item_positions=item_codes[batch_start:batch_end])
+
+    def get_factorized_scorer(self):
+        """Get the scorer evaluating trained weights with numpy, which is built once and reused.
+
+        :return: WideNDeepFactorizedScorer, or None if feature columns of the model cannot be factorized.
+        """
+        if self._factorized_scorer is None:
+            # imported here, because the scorer module depends on this module
+            from azureml.designer.modules.recommendation.dnn.wide_and_deep.common.wide_n_deep_factorized_scorer \
+                import WideNDeepFactorizedScorer
+            # False marks models which cannot be factorized, so that they are not checked again
+            self._factorized_scorer = WideNDeepFactorizedScorer.build(model=self) or False
+        return self._factorized_scorer or None
+
+    def build_predictor(self):
+        """Build the warm predictor, which is reused by all following predict calls.
+
+        The predictor is built lazily by the first predict call, and can also be built in advance, e.g. in the init
+        stage of a parallel scoring job. With the NumPy backend, the factorized scorer is built instead.
+        """
+        if self.inference_backend == InferenceBackend.NumPy and self.get_factorized_scorer() is not None:
+            return
+
+        # imported here, because the predictor module imports tensorflow
+        from azureml.designer.modules.recommendation.dnn.wide_and_deep.common.wide_n_deep_predictor \
+            import WideNDeepPredictor
+
+        module_logger.info(f"Rebuild model:\n {self.hyper_params}")
+        self.build_model(load_checkpoints=True)
+        lookup_tables = self._get_lookup_tables()
+        self._predictor = WideNDeepPredictor(estimator=self.estimator,
+                                             feature_dtypes=self._get_input_dtypes(lookup_tables=lookup_tables),
+                                             lookup_tables=lookup_tables)
+        self._predictor_version = self._get_predictor_version()
+
+    def _get_predictor_version(self):
+        """Get the version of the states embedded in the predictor.
+
+        In feature lookup mode, feature tables are embedded in the predictor, which becomes stale once feature builders
+        are updated with features of new ids.
+        """
+        if not self.input_pipeline_params.feature_lookup:
+            return None
+        return self.user_feature_builder.feature_rows_count, self.item_feature_builder.feature_rows_count
+
+    def _get_lookup_tables(self):
+        """Get feature tables to be gathered in-graph, which is empty if feature lookup mode is disabled."""
+        if not self.input_pipeline_params.feature_lookup:
+            return {}
+
+        basic_feature_keys = {feature.key for feature in
+                              parse_basic_features(feature_columns=[*self.wide_columns, *self.deep_columns])}
+        lookup_tables = {}
+        for index_key, feature_builder in [(_USER_FEATURE_INDEX_KEY, self.user_feature_builder),
+                                           (_ITEM_FEATURE_INDEX_KEY, self.item_feature_builder)]:
+            if not feature_builder.feature_metas:
+                continue
+            tables = {key: table for key, table in feature_builder.build_feature_tables().items()
+                      if key in basic_feature_keys}
+            if tables:
+                module_logger.info(f"Look up {len(tables)} features from {len(next(iter(tables.values())))} "
+                                   f"rows for {feature_builder.id_key} in graph")
+                lookup_tables[index_key] = tables
+
+        return lookup_tables
+
+    def _get_input_dtypes(self, lookup_tables: dict):
+        """Get dtypes of the inputs fed to the model, where looked up features are replaced by their positions."""
+        looked_up_keys = {key for tables in lookup_tables.values() for key in tables}
+        input_dtypes = {key: dtype for key, dtype in self._get_feature_dtypes().items() if key not in looked_up_keys}
+        for index_key in lookup_tables:
+            input_dtypes[index_key] = tf.int64
+
+        return input_dtypes
+
+    def _get_feature_dtypes(self):
+        """Get dtypes of the basic features which the model is expected to be fed with."""
+        basic_features = parse_basic_features(feature_columns=[*self.wide_columns, *self.deep_columns])
+        feature_metas = {**self.user_feature_builder.feature_metas, **self.item_feature_builder.feature_metas}
+        feature_dtypes = {}
+        for feature in basic_features:
+            feature_meta = feature_metas.get(feature.key, None)
+            if isinstance(feature, CategoricalIdentityFeatureColumn):
+                feature_dtypes[feature.key] = tf.int64
+            elif feature_meta is not None and feature_meta.is_numeric_feature():
+                feature_dtypes[feature.key] = tf.float32
+            else:
+                feature_dtypes[feature.key] = tf.string
 
-        return predictions
+        return feature_dtypes
 
     def update_feature_builders(self, user_features: FeatureDataset, item_features: FeatureDataset):
         with TimeProfile("Update features for users"):
@@ -269,11 +582,13 @@ class WideNDeepModel(CoreModel, metaclass=EntryParam):
         with TimeProfile("Update features for items"):
             self.item_feature_builder.update(features=item_features)
 
-    def build_optimizer(self, optimizer_name: OptimizerSelection, learning_rate):
+    def build_optimizer(self, optimizer_name: OptimizerSelection, learning_rate, distributed_wrapper=True):
         """Build the optimizer through optimizer name.
 
         These optimizers come from TensorFlow library, for an overview, please refer to:
         https://www.tensorflow.org/api_docs/python/tf/keras/optimizers
+        :param distributed_wrapper: whether to wrap the optimizer to allreduce gradients in mpi mode, which is not
+        needed if gradients are allreduced before applied.
         """
         optimizers = {OptimizerSelection.Adagrad: tf.optimizers.Adagrad,
                       OptimizerSelection.Adam: tf.optimizers.Adam,
@@ -286,7 +601,9 @@ class WideNDeepModel(CoreModel, metaclass=EntryParam):
             raise ValueError(f"Unsupported optimizer {optimizer_name}")
 
         if self.mpi_support:
-            optimizer = _HVD_LIB.DistributedOptimizer(optimizer(learning_rate=learning_rate * self.hvd_size))
+            optimizer = optimizer(learning_rate=learning_rate * self.hvd_size)
+            if distributed_wrapper:
+                optimizer = _HVD_LIB.DistributedOptimizer(optimizer)
         else:
             optimizer = optimizer(learning_rate=learning_rate)
 
@@ -300,7 +617,6 @@ class WideNDeepModel(CoreModel, metaclass=EntryParam):
         This activation functions come from TensorFlow library, for an overview, please refer to:
         https://www.tensorflow.org/api_docs/python/tf/keras/activations
         """
-
         activation_fns = {ActivationFnSelection.ReLU: tf.nn.relu,
                           ActivationFnSelection.Sigmoid: tf.keras.activations.sigmoid,
                           ActivationFnSelection.Tanh: tf.keras.activations.tanh,
@@ -312,15 +628,41 @@ class WideNDeepModel(CoreModel, metaclass=EntryParam):
 
         return activation_fn
 
-    def get_input_fn(self, transactions: TransactionDataset, batch_size, epochs=1, shuffle=False):
+    def build_input_data(self, transactions: TransactionDataset, shuffle=False, feature_lookup=False):
+        """Build features for users and items of the transactions.
+
+        :param feature_lookup: if True, build feature positions of users and items instead of denormalized features
+        :return: tuple of (x_df, y_sr), where x_df contains user and item features, and y_sr is the ratings or None.
+        """
         user_ids = transactions.users
         item_ids = transactions.items
-        with TimeProfile("Build features for users"):
-            user_features_df = self.user_feature_builder.build(ids=user_ids)
-        with TimeProfile("Build features for items"):
-            item_features_df = self.item_feature_builder.build(ids=item_ids)
+        if feature_lookup:
+            with TimeProfile("Build feature positions for users"):
+                user_ids, user_positions = self.user_feature_builder.build_indices(ids=user_ids)
+            with TimeProfile("Build feature positions for items"):
+                item_ids, item_positions = self.item_feature_builder.build_indices(ids=item_ids)
+            x_df = pd.DataFrame({self.user_feature_builder.id_key: user_ids,
+                                 _USER_FEATURE_INDEX_KEY: user_positions,
+                                 self.item_feature_builder.id_key: item_ids,
+                                 _ITEM_FEATURE_INDEX_KEY: item_positions})
+        else:
+            with TimeProfile("Build features for users"):
+                user_features_df = self.user_feature_builder.build(ids=user_ids)
+            with TimeProfile("Build features for items"):
+                item_features_df = self.item_feature_builder.build(ids=item_ids)
+            x_df = pd.concat([user_features_df, item_features_df], axis=1).reset_index(drop=True)
+
+        integer_coded_keys = {feature.key for feature in
+                              parse_basic_features(feature_columns=[*self.wide_columns, *self.deep_columns])
+                              if isinstance(feature, CategoricalIdentityFeatureColumn)}
+        for feature_builder in [self.user_feature_builder, self.item_feature_builder]:
+            if feature_builder.id_key in integer_coded_keys:
+                with TimeProfile(f"Encode {feature_builder.id_key} ids"):
+                    x_df[feature_builder.id_key] = feature_builder.encode_ids(ids=x_df[feature_builder.id_key])
+            elif x_df[feature_builder.id_key].dtype.name == 'category':
+                # compact ids are fed as strings, if they are not fed as integer codes
+                x_df[feature_builder.id_key] = x_df[feature_builder.id_key].astype(object)
 
-        x_df = pd.concat([user_features_df, item_features_df], axis=1).reset_index(drop=True)
         y_sr = transactions.ratings
         if y_sr is not None:
             y_sr = y_sr.reset_index(drop=True)
@@ -332,8 +674,63 @@ class WideNDeepModel(CoreModel, metaclass=EntryParam):
                 y_sr = y_sr[x_df.index].reset_index(drop=True)
             x_df = x_df.reset_index(drop=True)
 
-        return tf.compat.v1.estimator.inputs.pandas_input_fn(x=x_df, y=y_sr, batch_size=batch_size, num_epochs=epochs,
-                                                             shuffle=False)
+        return x_df, y_sr
+
+    def get_input_fn(self, transactions: TransactionDataset, batch_size, epochs=1, shuffle=False):
+        lookup_tables = self._get_lookup_tables()
+        # in mpi mode, each rank reshuffles its shard per epoch, otherwise transactions are shuffled once
+        shuffle_seed = (self.random_seed, self.hvd_rank) if shuffle and self.mpi_support else None
+        x_df, y_sr = self.build_input_data(transactions=transactions, shuffle=shuffle and shuffle_seed is None,
+                                           feature_lookup=bool(lookup_tables))
+        features = {key: x_df[key].values for key in self._get_input_dtypes(lookup_tables=lookup_tables)}
+        labels = y_sr.values.astype(np.float32) if y_sr is not None else None
+        del x_df, y_sr
+        module_logger.info(f"Build input pipeline:\n{self.input_pipeline_params}")
+
+        def input_fn():
+            return build_dataset(features=features, labels=labels, batch_size=batch_size, epochs=epochs,
+                                 params=self.input_pipeline_params, lookup_tables=lookup_tables,
+                                 shuffle_seed=shuffle_seed)
+
+        return input_fn
+
+    def get_shards_input_fn(self, shards: TransactionShards, batch_size, epochs=1, shuffle=False):
+        """Get the input fn which streams preprocessed transaction shards, reading and preprocessing one at a time.
+
+        Shards are fed in a random order per epoch, the next shard is read while the current one is fed, and instances
+        are shuffled across shards through a buffer of input_pipeline_params.shuffle_buffer_size instances, so that
+        the peak memory is bounded by the shard size and the buffer size instead of the dataset size. In mpi mode,
+        each shard is dealt to ranks as get_rank_shard does, so all ranks get the same number of batches.
+        """
+        lookup_tables = self._get_lookup_tables()
+        input_dtypes = self._get_input_dtypes(lookup_tables=lookup_tables)
+        keys = list(input_dtypes.keys())
+        module_logger.info(f"Build input pipeline of {shards.shards_count} shards:\n{self.input_pipeline_params}")
+
+        def _read_shard(shard_idx):
+            transactions = preprocess_transactions(shards.read_shard(shard_idx))
+            transactions = self.get_rank_shard(transactions=transactions, random_seed=(self.random_seed, shard_idx))
+            x_df, y_sr = self.build_input_data(transactions=transactions, feature_lookup=bool(lookup_tables))
+            return [x_df[key].values for key in keys] + [y_sr.values.astype(np.float32)]
+
+        def _generate_batches():
+            for epoch in range(epochs):
+                shard_order = range(shards.shards_count)
+                random_state = None
+                if shuffle:
+                    shard_order = np.random.RandomState((self.random_seed, epoch)).permutation(shards.shards_count)
+                    random_state = np.random.RandomState((self.random_seed, self.hvd_rank or 0, epoch))
+                yield from batch_chunks(chunks=read_ahead(read_fn=_read_shard, keys=shard_order),
+                                        batch_size=batch_size,
+                                        shuffle_buffer_size=self.input_pipeline_params.shuffle_buffer_size,
+                                        random_state=random_state)
+
+        def input_fn():
+            return build_generator_dataset(generator=_generate_batches, keys=keys,
+                                           dtypes=[*input_dtypes.values(), tf.float32],
+                                           params=self.input_pipeline_params, lookup_tables=lookup_tables)
+
+        return input_fn
 
     def _build_feature_columns(self):
         # if not specify wide and deep feature columns, use default scheme
@@ -360,13 +757,16 @@ class WideNDeepModel(CoreModel, metaclass=EntryParam):
     def save(self, save_to: str, overwrite_if_exists=True):
         with TimeProfile("Saving Wide & Deep recommendation model"):
             self.estimator = None
+            self._predictor = None
+            self._predictor_version = None
+            self._factorized_scorer = None
             for feature_column in [*self.wide_columns, *self.deep_columns]:
                 feature_column.reset()
 
             checkpoints_save_dir = os.path.join(save_to, self.rel_checkpoints_dir)
-            checkpoints_exist = tf.train.latest_checkpoint(checkpoints_save_dir) is not None
-            model_save_path = os.path.join(save_to, MODEL_SAVE_FILE)
-            model_exist = os.path.exists(model_save_path)
+            checkpoints_exist = latest_checkpoint(checkpoints_save_dir) is not None
+            manifest_save_path = os.path.join(save_to, MODEL_MANIFEST_FILE)
+            model_exist = os.path.exists(manifest_save_path)
 
             # if checkpoints and model both exists, and not overwrite, just return
             if checkpoints_exist and model_exist and not overwrite_if_exists:
@@ -382,9 +782,82 @@ class WideNDeepModel(CoreModel, metaclass=EntryParam):
             self.hvd_rank = None
             self.hvd_size = None
 
-            # dump model
-            with open(model_save_path, "wb") as f:
-                pickle.dump(self, f)
+            # dump model, id vocabs and feature tables are saved in Arrow files, and the others in the manifest
+            manifest = {"format_version": MODEL_FORMAT_VERSION,
+                        "hyper_params": self.hyper_params.to_dict(),
+                        "random_seed": self.random_seed,
+                        "rel_checkpoints_dir": self.rel_checkpoints_dir,
+                        "input_pipeline_params": dict(self.input_pipeline_params.__dict__),
+                        "user_feature_builder": self.user_feature_builder.save(save_to=save_to, prefix="user"),
+                        "item_feature_builder": self.item_feature_builder.save(save_to=save_to, prefix="item"),
+                        "wide_columns": [feature_column.to_dict() for feature_column in self.wide_columns],
+                        "deep_columns": [feature_column.to_dict() for feature_column in self.deep_columns]}
+            with open(manifest_save_path, "w") as f:
+                json.dump(manifest, f, indent=2)
+
+    @classmethod
+    def _load_manifest(cls, load_from: str):
+        with open(os.path.join(load_from, MODEL_MANIFEST_FILE), "r") as f:
+            manifest = json.load(f)
+        if manifest["format_version"] > MODEL_FORMAT_VERSION:
+            raise ValueError(f"Unsupported model format version {manifest['format_version']}")
+
+        # basic features are shared by wide and deep columns
+        basic_features = {}
+        model = cls(hyper_params=WideNDeepModelHyperParams.from_dict(manifest["hyper_params"]),
+                    user_feature_builder=FeatureBuilder.load(load_from=load_from,
+                                                             manifest=manifest["user_feature_builder"]),
+                    item_feature_builder=FeatureBuilder.load(load_from=load_from,
+                                                             manifest=manifest["item_feature_builder"]),
+                    wide_columns=[feature_column_from_dict(spec, basic_features) for spec in manifest["wide_columns"]],
+                    deep_columns=[feature_column_from_dict(spec, basic_features) for spec in manifest["deep_columns"]],
+                    random_seed=manifest["random_seed"],
+                    rel_checkpoints_dir=manifest["rel_checkpoints_dir"],
+                    save_dir=load_from)
+        model.input_pipeline_params = InputPipelineParams(**manifest["input_pipeline_params"])
+        return model
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # the predictor is not pickled, and models pickled by previous versions do not have this attribute
+        self._predictor = None
+        self._predictor_version = None
+        self._factorized_scorer = None
+        if "inference_backend" not in state:
+            self.inference_backend = InferenceBackend.TensorFlow
+        if "input_pipeline_params" not in state:
+            self.input_pipeline_params = InputPipelineParams()
+        self._use_integer_coded_ids()
+
+    def _use_integer_coded_ids(self):
+        """Replace user and item id vocab list columns with equivalent integer coded id columns.
+
+        Models trained by previous versions feed ids through vocab list columns, which share variables and crossed
+        feature hashes with identity columns fed with vocab positions, so the checkpoints can be reused as is.
+        """
+        if self.wide_columns is None or self.deep_columns is None:
+            return
+
+        identity_columns = {}
+        for feature_builder in [self.user_feature_builder, self.item_feature_builder]:
+            identity_columns[feature_builder.id_key] = (feature_builder.id_vocab, CategoricalIdentityFeatureColumn(
+                key=feature_builder.id_key, num_buckets=feature_builder.oov_code + 1))
+
+        def _convert(feature):
+            if isinstance(feature, CategoricalVocabListFeatureColumn) and feature.key in identity_columns:
+                id_vocab, identity_column = identity_columns[feature.key]
+                if feature.vocab is id_vocab:
+                    return identity_column
+            return feature
+
+        for feature_columns in [self.wide_columns, self.deep_columns]:
+            for idx, feature in enumerate(feature_columns):
+                if isinstance(feature, CrossedFeatureColumn):
+                    feature.categorical_features = [_convert(f) for f in feature.categorical_features]
+                elif isinstance(feature, EmbeddingFeatureColumn):
+                    feature.categorical_feature = _convert(feature.categorical_feature)
+                else:
+                    feature_columns[idx] = _convert(feature)
 
     @classmethod
     def entry_param_loader(cls, load_from):
@@ -410,10 +883,19 @@ class WideNDeepModel(CoreModel, metaclass=EntryParam):
 
     @classmethod
     def load(cls, load_from: str):
+        """Load the model saved under the load_from directory.
+
+        The directory must outlive the model and its feature builders, because checkpoints are read from it, and the
+        Arrow files of ids and features are memory-mapped on their first access, instead of being read at load time.
+        """
         model_save_path = os.path.join(load_from, MODEL_SAVE_FILE)
         try:
-            with open(model_save_path, "rb") as f:
-                model = pickle.load(f)
+            if os.path.exists(os.path.join(load_from, MODEL_MANIFEST_FILE)):
+                model = cls._load_manifest(load_from=load_from)
+            else:
+                # models saved by previous versions are pickled as a whole
+                with open(model_save_path, "rb") as f:
+                    model = pickle.load(f)
         except Exception as e:
             raise InvalidModelDirectoryError(arg_name=cls.MODEL_NAME,
                                              reason='the model may not be generated by '
@@ -426,7 +908,7 @@ class WideNDeepModel(CoreModel, metaclass=EntryParam):
                                              reason='the model may not be generated by '
                                                     'the "Train Wide & Deep Recommender" module')
 
-        checkpoints_exist = tf.train.latest_checkpoint(model.checkpoints_dir) is not None
+        checkpoints_exist = latest_checkpoint(model.checkpoints_dir) is not None
         if not checkpoints_exist:
             module_logger.error(f"Invalid checkpoints path {model.save_dir}.")
             raise ValueError(f"Invalid checkpoints path {model.save_dir}.")
@@ -0,0 +1,65 @@
+import numpy as np
+import tensorflow as tf
+from tempfile import TemporaryDirectory
+from azureml.studio.core.logger import module_logger, TimeProfile
+from azureml.designer.modules.recommendation.dnn.wide_and_deep.common.input_pipeline import lookup_features
+
+
+class WideNDeepPredictor:
+    """The class wraps a SavedModel exported from a trained Wide & Deep estimator.
+
+    The estimator rebuilds its graph and restores checkpoints for every predict call, which is a fixed cost of several
+    seconds. The predictor exports the estimator once, loads the SavedModel once, and then reuses the loaded predict
+    signature for every batch.
+    """
+    _SIGNATURE_KEY = "predict"
+    _PREDICTIONS_KEY = "predictions"
+
+    def __init__(self, estimator, feature_dtypes: dict, lookup_tables: dict = None):
+        """Export the estimator and load the exported SavedModel.
+
+        :param estimator: the trained estimator, whose model_dir contains checkpoints.
+        :param feature_dtypes: dict of feature key to tf dtype, the features fed to the predictor.
+        :param lookup_tables: optional feature tables embedded into the SavedModel, the features are gathered from
+        these tables by the positions fed with index keys, see input_pipeline.lookup_features for details.
+        """
+        # signature input names must be valid op names, while feature keys come from dataset column names
+        self.feature_aliases = {key: f"feature_{idx}" for idx, key in enumerate(sorted(feature_dtypes))}
+        self.feature_dtypes = feature_dtypes
+        self.lookup_tables = lookup_tables if lookup_tables else {}
+        self._export_dir_base = TemporaryDirectory()
+
+        with TimeProfile("Export and load Wide & Deep SavedModel"):
+            export_dir = estimator.export_saved_model(export_dir_base=self._export_dir_base.name,
+                                                      serving_input_receiver_fn=self._serving_input_receiver_fn)
+            if isinstance(export_dir, bytes):
+                export_dir = export_dir.decode()
+            module_logger.info(f"Exported SavedModel to {export_dir}")
+            self._saved_model = tf.saved_model.load(export_dir)
+            self._predict_fn = self._saved_model.signatures[self._SIGNATURE_KEY]
+
+    def _serving_input_receiver_fn(self):
+        receiver_tensors = {}
+        features = {}
+        for key, dtype in self.feature_dtypes.items():
+            alias = self.feature_aliases[key]
+            receiver_tensors[alias] = tf.compat.v1.placeholder(dtype=dtype, shape=[None], name=alias)
+            features[key] = receiver_tensors[alias]
+        features = lookup_features(features=features, lookup_tables=self.lookup_tables)
+        return tf.estimator.export.ServingInputReceiver(features=features, receiver_tensors=receiver_tensors)
+
+    def predict(self, features: dict):
+        """Predict one batch of instances.
+
+        :param features: dict of feature key to 1-D numpy array or tensor, all values are of the same length.
+        :return: 1-D float32 numpy array, the predictions.
+        """
+        inputs = {}
+        for key, dtype in self.feature_dtypes.items():
+            values = features[key]
+            if not tf.is_tensor(values):
+                values = np.asarray(values, dtype=object).astype(str) if dtype == tf.string else np.asarray(values)
+                values = tf.constant(values)
+            inputs[self.feature_aliases[key]] = values if dtype == tf.string else tf.cast(values, dtype)
+        predictions = self._predict_fn(**inputs)[self._PREDICTIONS_KEY]
+        return predictions.numpy().reshape(-1)
@@ -1,19 +1,32 @@
 import numpy as np
 import pandas as pd
 from abc import abstractmethod
-from azureml.studio.core.logger import TimeProfile
+from azureml.studio.core.logger import module_logger, TimeProfile
 from azureml.studio.internal.error import ErrorMapping, DuplicateFeatureDefinitionError, InvalidColumnTypeError
 from azureml.studio.core.data_frame_schema import ColumnTypeName
 from azureml.designer.modules.recommendation.dnn.common.dataset import Dataset, TransactionDataset, FeatureDataset
 from azureml.designer.modules.recommendation.dnn.wide_and_deep.common.wide_n_deep_model import WideNDeepModel
+from azureml.designer.modules.recommendation.dnn.wide_and_deep.common.wide_n_deep_factorized_scorer import \
+    WideNDeepFactorizedScorer, SidePartials
 from azureml.designer.modules.recommendation.dnn.common.constants import TRANSACTIONS_RATING_COL
 from azureml.designer.modules.recommendation.dnn.wide_and_deep.common.preprocess import preprocess_features, \
     preprocess_transactions
 from azureml.designer.modules.recommendation.dnn.common.score_column_names import USER_COLUMN, ITEM_COLUMN, \
     SCORED_RATING
+from azureml.designer.modules.recommendation.dnn.common.top_k import TopKRecommendations, factorize_ids, \
+    grouped_top_k, dense_top_k, merge_top_k, take_padded
+from azureml.designer.modules.recommendation.dnn.common.sparse_interactions import SparseInteractions
 
 
 class BaseRecommenderScorer:
+    def __init__(self, compact_ids: bool = False):
+        """Init the scorer with the representation of ids.
+
+        :param compact_ids: if True, user and item ids of transactions are held as categorical columns, whose codes are
+        aligned with the id vocabs of the model, so that ids are copied, deduplicated and merged as integer codes.
+        """
+        self.compact_ids = compact_ids
+
     def _validate_parameters(self, learner: WideNDeepModel, test_data: Dataset, user_features: FeatureDataset = None,
                              item_features: FeatureDataset = None, **kwargs):
         ErrorMapping.verify_not_null_or_empty(x=learner, name=WideNDeepModel.MODEL_NAME)
@@ -47,11 +60,12 @@ class BaseRecommenderScorer:
 
     def _preprocess(self, transactions: TransactionDataset, user_features: FeatureDataset = None,
                     item_features: FeatureDataset = None, training_transactions: TransactionDataset = None):
-        transactions = preprocess_transactions(transactions)
+        transactions = preprocess_transactions(transactions, compact_ids=self.compact_ids)
         user_features = preprocess_features(user_features) if user_features is not None else None
         item_features = preprocess_features(item_features) if item_features is not None else None
         training_transactions = (
-            preprocess_transactions(training_transactions) if training_transactions is not None else None
+            preprocess_transactions(training_transactions, compact_ids=self.compact_ids)
+            if training_transactions is not None else None
         )
 
         BaseRecommenderScorer._validate_preprocessed_dataset(user_features=user_features, item_features=item_features)
@@ -74,11 +88,28 @@ class BaseRecommenderScorer:
         training_transactions = kwargs['training_transactions']
         self._preprocess(transactions=test_transactions, user_features=user_features, item_features=item_features,
                          training_transactions=training_transactions)
+        if self.compact_ids:
+            self._align_compact_ids(learner, test_transactions)
+            if training_transactions is not None:
+                self._align_compact_ids(learner, training_transactions)
+
+    @staticmethod
+    def _align_compact_ids(learner: WideNDeepModel, transactions: TransactionDataset):
+        """Align categories of compact ids with the id vocabs of the model, so that codes are shared by datasets."""
+        with TimeProfile("Align compact ids with id vocabs"):
+            if transactions.users is not None:
+                transactions.users = learner.user_feature_builder.to_categorical_ids(transactions.users)
+            if transactions.items is not None:
+                transactions.items = learner.item_feature_builder.to_categorical_ids(transactions.items)
 
     def _predict(self, learner: WideNDeepModel, transactions: TransactionDataset,
                  user_features: FeatureDataset = None,
                  item_features: FeatureDataset = None):
         learner.update_feature_builders(user_features=user_features, item_features=item_features)
+        return self._predict_pairs(learner, transactions)
+
+    @staticmethod
+    def _predict_pairs(learner: WideNDeepModel, transactions: TransactionDataset):
         transactions = TransactionDataset(df=transactions.df.iloc[:, :TRANSACTIONS_RATING_COL].reset_index(drop=True))
         predictions = learner.predict(transactions)
         result_df = transactions.df
@@ -86,35 +117,185 @@ class BaseRecommenderScorer:
         result_df[SCORED_RATING] = predictions
         return result_df
 
+    def _recommend_from_catalog(self, learner: WideNDeepModel, users, items, K: int, memory_budget: int,
+                                user_features: FeatureDataset = None, item_features: FeatureDataset = None,
+                                excluded_transactions: TransactionDataset = None):
+        """Recommend top K items from the items catalog for each user, scoring user-item pairs block by block.
+
+        Users are split into blocks, so that the pairs of each block fit in the memory budget. If a single user's
+        pairs exceed the budget, items are split into blocks too, and each item block's top K are merged into the
+        running top K of the users. Pairs of a block are released as soon as they are scored, so peak memory depends
+        on the budget rather than the number of users.
+        If the model can be factorized by users and items, the partials of all items and of each user block are
+        computed once, and only the remaining layers are evaluated for each pair.
+        If excluded_transactions is provided, its user-item pairs are never scored or recommended, and users without
+        any other candidates are padded with None items.
+        Users with the same signature, e.g. cold-start users with the same features, get the same recommendations,
+        so only one user of each signature is scored, unless the user has excluded pairs.
+        """
+        users = np.sort(np.asarray(users))
+        items = np.asarray(items)
+        if len(users) == 0 or len(items) == 0:
+            return TopKRecommendations.empty(k=K)
+
+        learner.update_feature_builders(user_features=user_features, item_features=item_features)
+        excluded = None
+        if excluded_transactions is not None:
+            excluded = SparseInteractions.from_ids(users=users, items=items,
+                                                   interaction_users=excluded_transactions.users.values,
+                                                   interaction_items=excluded_transactions.items.values)
+            module_logger.info(f"Exclude {len(excluded)} user-item pairs from candidates.")
+
+        signature_codes, representatives = self._group_users_by_signatures(
+            learner, users=users, distinct=None if excluded is None else np.diff(excluded.indptr) > 0)
+        if len(representatives) < len(users):
+            module_logger.info(f"Score {len(representatives)} distinct users of {len(users)} users by signatures.")
+            recommendations = self._score_catalog(
+                learner, users=users[representatives], items=items, K=K, memory_budget=memory_budget,
+                excluded=None if excluded is None else excluded.take_rows(user_codes=representatives))
+            return self._fan_out_recommendations(recommendations, users=users, signature_codes=signature_codes)
+        return self._score_catalog(learner, users=users, items=items, K=K, memory_budget=memory_budget,
+                                   excluded=excluded)
+
+    @staticmethod
+    def _group_users_by_signatures(learner: WideNDeepModel, users, distinct: np.ndarray = None):
+        """Group users by signatures, where users with the same model inputs share the same signature.
+
+        :param distinct: optional bool array, True users are never grouped with other users
+        :return: tuple of (signature_codes, representatives), signature_codes is an int64 array with a code for each
+        user, and representatives are the positions of the first user of each code, in ascending order.
+        """
+        signature_codes = learner.user_feature_builder.encode_signatures(ids=pd.Series(users))
+        if distinct is not None and distinct.any():
+            # codes are less than the number of users, so that the codes of distinct users never collide with them
+            signature_codes = np.where(distinct, len(users) + np.arange(len(users)), signature_codes)
+            signature_codes = pd.factorize(signature_codes)[0].astype(np.int64)
+        _, representatives = np.unique(signature_codes, return_index=True)
+        return signature_codes, representatives
+
+    @staticmethod
+    def _fan_out_recommendations(recommendations: TopKRecommendations, users, signature_codes: np.ndarray):
+        """Copy the recommendations of representative users, which are in the order of signature codes, to users."""
+        return TopKRecommendations(users=users, items=recommendations.items[signature_codes],
+                                   ratings=recommendations.ratings[signature_codes])
+
+    def _score_catalog(self, learner: WideNDeepModel, users: np.ndarray, items: np.ndarray, K: int,
+                       memory_budget: int, excluded: SparseInteractions = None):
+        """Score the items catalog for sorted users block by block, see _recommend_from_catalog for details."""
+        # the factorized scorer computes user and item partials once, instead of evaluating the full model per pair
+        scorer = learner.get_factorized_scorer()
+        pair_size = scorer.estimate_pair_size() if scorer is not None else self._estimate_pair_size(learner)
+        block_pairs_count = max(1, memory_budget // pair_size)
+        item_block_size = min(len(items), block_pairs_count)
+        user_block_size = max(1, block_pairs_count // item_block_size)
+        module_logger.info(f"Score {len(users)} users and {len(items)} items in blocks of {user_block_size} users "
+                           f"and {item_block_size} items.")
+        item_partials = None
+        if scorer is not None:
+            with TimeProfile(f"Build partials of {len(items)} items"):
+                item_partials = scorer.build_item_partials(items=items)
+
+        recommendations = []
+        for user_start in range(0, len(users), user_block_size):
+            block_users = users[user_start:user_start + user_block_size]
+            user_partials = scorer.build_user_partials(users=block_users) if scorer is not None else None
+            running = None
+            for item_start in range(0, len(items), item_block_size):
+                block_items = items[item_start:item_start + item_block_size]
+                candidates = None
+                if excluded is not None:
+                    # excluded pairs are not scored, and their NaN scores are never selected
+                    candidates = ~excluded.block_mask(user_start=user_start, user_end=user_start + len(block_users),
+                                                      item_start=item_start, item_end=item_start + len(block_items))
+                if scorer is None:
+                    scores = self._score_block_pairs(learner, users=block_users, items=block_items,
+                                                     candidates=candidates)
+                else:
+                    scores = self._score_block_factorized(scorer, user_partials=user_partials,
+                                                          item_partials=item_partials, item_start=item_start,
+                                                          block_shape=(len(block_users), len(block_items)),
+                                                          candidates=candidates)
+                positions = dense_top_k(scores, k=K)
+                block = TopKRecommendations(users=block_users,
+                                            items=take_padded(block_items, positions=positions, fill=None),
+                                            ratings=take_padded(scores, positions=positions, fill=0))
+                running = block if running is None else merge_top_k(running, block)
+            recommendations.append(running)
+            module_logger.info(f"Finished recommendations for {user_start + len(block_users)} users.")
+
+        return TopKRecommendations.concat(recommendations, k=K)
+
+    def _score_block_pairs(self, learner: WideNDeepModel, users, items, candidates: np.ndarray = None):
+        """Score the cartesian pairs of a block of users and items with the model, pair by pair.
+
+        :param candidates: optional bool array with shape (len(users), len(items)), only True pairs are scored.
+        :return: float32 array with shape (len(users), len(items)), where pairs not scored are NaN.
+        """
+        pairs_df = self.build_user_item_cartesian_pairs(users=users, items=items)
+        if candidates is None:
+            scores = self._predict_pairs(learner, TransactionDataset(pairs_df))[SCORED_RATING].values
+        else:
+            candidates = candidates.ravel()
+            scores = np.full(len(pairs_df), np.nan, dtype=np.float32)
+            if candidates.any():
+                scores[candidates] = self._predict_pairs(
+                    learner, TransactionDataset(pairs_df[candidates]))[SCORED_RATING].values
+        return scores.reshape(len(users), len(items))
+
+    @staticmethod
+    def _score_block_factorized(scorer: WideNDeepFactorizedScorer, user_partials: SidePartials,
+                                item_partials: SidePartials, item_start: int, block_shape, candidates=None):
+        """Score the cartesian pairs of a block of users and items with the factorized scorer.
+
+        :param item_start: position of the first block item in item_partials, user_partials are of block users only.
+        :param candidates: optional bool array with the block shape, only True pairs are scored.
+        :return: float32 array with the block shape, where pairs not scored are NaN.
+        """
+        if candidates is None:
+            candidates = np.ones(block_shape, dtype=bool)
+        user_positions, item_positions = np.nonzero(candidates)
+        scores = np.full(block_shape, np.nan, dtype=np.float32)
+        if len(user_positions) > 0:
+            scores[user_positions, item_positions] = scorer.score_pairs(
+                user_partials=user_partials, item_partials=item_partials, user_positions=user_positions,
+                item_positions=item_positions + item_start)
+        return scores
+
+    @staticmethod
+    def _estimate_pair_size(learner: WideNDeepModel):
+        """Roughly estimate the memory in bytes taken by one user-item pair during prediction.
+
+        Each pair holds two id strings and the built features, which are copied a few times by the input pipeline.
+        """
+        _ID_SIZE = 64
+        _FEATURE_SIZE = 8
+        _COPIES = 4
+        features_count = len(learner.user_feature_builder.feature_metas) + \
+            len(learner.item_feature_builder.feature_metas)
+        return (2 * _ID_SIZE + features_count * _FEATURE_SIZE) * _COPIES
+
     def _recommend(self, learner: WideNDeepModel, transactions: TransactionDataset, K: int,
                    user_features: FeatureDataset = None, item_features: FeatureDataset = None):
         if transactions.row_size == 0:
-            return pd.DataFrame(columns=[USER_COLUMN, ITEM_COLUMN, SCORED_RATING])
+            return TopKRecommendations.empty(k=K)
         predict_df = self._predict(learner, transactions, user_features=user_features, item_features=item_features)
         with TimeProfile(f"Get top {K} items for each user"):
-            predict_df = (
-                predict_df.groupby(by=[USER_COLUMN]).apply(
-                    lambda x: x.nlargest(columns=SCORED_RATING, n=K)).reset_index(drop=True)
-            )
-            topK_items = predict_df.groupby(USER_COLUMN)[ITEM_COLUMN].apply(
-                lambda x: (list(x) + [None] * K)[:K])
-            topK_ratings = predict_df.groupby(USER_COLUMN)[SCORED_RATING].apply(
-                lambda x: (list(x) + [0] * K)[:K])
-        return pd.DataFrame(
-            {USER_COLUMN: topK_items.index, ITEM_COLUMN: topK_items.values, SCORED_RATING: topK_ratings.values})
-
-    def _format_recommendations(self, recommendations: pd.DataFrame, return_ratings: bool, K: int,
-                                score_column_names_build_method):
-        items = np.array(list(recommendations[ITEM_COLUMN])).reshape([-1, K])
-        ratings = np.array(list(recommendations[SCORED_RATING])).reshape([-1, K])
+            user_codes, users = factorize_ids(predict_df[USER_COLUMN])
+            positions = grouped_top_k(group_codes=user_codes, group_count=len(users),
+                                      scores=predict_df[SCORED_RATING].values, k=K)
+            items = take_padded(predict_df[ITEM_COLUMN].values, positions=positions, fill=None)
+            ratings = take_padded(predict_df[SCORED_RATING].values, positions=positions, fill=0)
+        return TopKRecommendations(users=users, items=items, ratings=ratings)
 
+    def _format_recommendations(self, recommendations: TopKRecommendations, return_ratings: bool, K: int,
+                                score_column_names_build_method):
         score_column_names = score_column_names_build_method(top_k=K)
-        users_df = pd.DataFrame({score_column_names[0]: recommendations[USER_COLUMN]})
-        recommended_items_df = pd.DataFrame(items, columns=score_column_names[1:])
+        users_df = pd.DataFrame({score_column_names[0]: recommendations.users})
+        recommended_items_df = pd.DataFrame(recommendations.items, columns=score_column_names[1:])
 
         if return_ratings:
             score_column_names = self._insert_pred_rating_column_names(score_column_names)
-            recommended_item_ratings_df = pd.DataFrame(ratings, columns=score_column_names[2::2])
+            recommended_item_ratings_df = pd.DataFrame(recommendations.ratings, columns=score_column_names[2::2])
             res_df = pd.concat([users_df, recommended_items_df, recommended_item_ratings_df], axis=1)
         else:
             res_df = pd.concat([users_df, recommended_items_df], axis=1)
@@ -5,7 +5,8 @@ from azureml.designer.modules.recommendation.dnn.wide_and_deep.common.wide_n_dee
 from azureml.designer.modules.recommendation.dnn.wide_and_deep.score. \
     base_recommender_scorer import BaseRecommenderScorer
 from azureml.designer.modules.recommendation.dnn.common.constants import TRANSACTIONS_RATING_COL
-from azureml.designer.modules.recommendation.dnn.common.score_column_names import build_regression_column_names
+from azureml.designer.modules.recommendation.dnn.common.score_column_names import build_regression_column_names, \
+    USER_COLUMN, ITEM_COLUMN
 
 
 class RatingPredictionScorer(BaseRecommenderScorer):
@@ -25,6 +26,9 @@ class RatingPredictionScorer(BaseRecommenderScorer):
         test_transactions_df = test_transactions_df.iloc[(~test_transactions_df.duplicated()).values, :]
         test_transactions = TransactionDataset(test_transactions_df, name=test_transactions.name)
         res_df = self._predict(learner, test_transactions, user_features=user_features, item_features=item_features)
+        if self.compact_ids:
+            # compact ids are decoded, so that the scored dataset holds string ids as usual
+            res_df = res_df.astype({USER_COLUMN: object, ITEM_COLUMN: object})
         res_df.columns = build_regression_column_names()
 
         return res_df
@@ -1,15 +1,24 @@
-import pandas as pd
 from azureml.studio.core.logger import module_logger, TimeProfile
 from azureml.studio.internal.error import ErrorMapping
 from azureml.designer.modules.recommendation.dnn.common.dataset import Dataset, TransactionDataset, FeatureDataset
 from azureml.designer.modules.recommendation.dnn.wide_and_deep.common.wide_n_deep_model import WideNDeepModel
-from azureml.designer.modules.recommendation.dnn.common.constants import TRANSACTIONS_USER_COL
+from azureml.designer.modules.recommendation.dnn.common.constants import TRANSACTIONS_USER_COL, SCORE_MEMORY_BUDGET
 from azureml.designer.modules.recommendation.dnn.wide_and_deep.score. \
     base_recommender_scorer import BaseRecommenderScorer
 from azureml.designer.modules.recommendation.dnn.common.score_column_names import build_ranking_column_names
 
 
 class RecommendAllItemScorer(BaseRecommenderScorer):
+    def __init__(self, memory_budget: int = SCORE_MEMORY_BUDGET, compact_ids: bool = False):
+        """Init the scorer with the memory budget for scoring.
+
+        :param memory_budget: memory in bytes for user-item pairs scored at once, which bounds the peak memory
+        regardless of the number of users to score.
+        :param compact_ids: whether to hold ids of transactions as compact ids, see BaseRecommenderScorer
+        """
+        super().__init__(compact_ids=compact_ids)
+        self.memory_budget = memory_budget
+
     def _validate_parameters(self, learner: WideNDeepModel, test_data: Dataset, user_features: FeatureDataset = None,
                              item_features: FeatureDataset = None, **kwargs):
         super()._validate_parameters(learner, test_data, user_features=user_features, item_features=item_features)
@@ -21,8 +30,7 @@ class RecommendAllItemScorer(BaseRecommenderScorer):
                     item_features: FeatureDataset = None, training_transactions: TransactionDataset = None):
         # remove extra items/ratings column
         if transactions.users is not None:
-            transactions.df = pd.DataFrame(transactions.users)
-            transactions.build_column_attributes()
+            transactions.select_columns([TRANSACTIONS_USER_COL])
         return super()._preprocess(transactions, user_features, item_features, training_transactions)
 
     def score(self, learner: WideNDeepModel, test_transactions: TransactionDataset,
@@ -37,10 +45,15 @@ class RecommendAllItemScorer(BaseRecommenderScorer):
         users = test_transactions_df.iloc[:, TRANSACTIONS_USER_COL].unique()
         module_logger.info(f"Get {len(users)} unique users, and {len(all_items)} unique items.")
 
-        with TimeProfile("Building complete user item transactions dataset"):
-            transactions_df = self.build_user_item_cartesian_pairs(users=users, items=all_items)
-        transactions = TransactionDataset(transactions_df)
-        recommendations = self._recommend(learner, transactions=transactions, K=max_recommended_item_count,
-                                          user_features=user_features, item_features=item_features)
+        with TimeProfile(f"Recommend items from {len(all_items)} items for {len(users)} users"):
+            recommendations = self._recommend_items(learner, users=users, items=all_items,
+                                                    K=max_recommended_item_count,
+                                                    user_features=user_features, item_features=item_features)
         return self._format_recommendations(recommendations, return_ratings, K=max_recommended_item_count,
                                             score_column_names_build_method=build_ranking_column_names)
+
+    def _recommend_items(self, learner: WideNDeepModel, users, items, K: int, user_features: FeatureDataset = None,
+                         item_features: FeatureDataset = None):
+        """Recommend top K items from all items for each user, where all items are scored."""
+        return self._recommend_from_catalog(learner, users=users, items=items, K=K, memory_budget=self.memory_budget,
+                                            user_features=user_features, item_features=item_features)
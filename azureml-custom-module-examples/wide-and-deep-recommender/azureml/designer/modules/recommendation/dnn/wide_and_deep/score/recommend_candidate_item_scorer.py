@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+from azureml.studio.core.logger import module_logger, TimeProfile
+from azureml.studio.internal.error import ErrorMapping
+from azureml.designer.modules.recommendation.dnn.common.constants import TRANSACTIONS_RATING_COL, SCORE_MEMORY_BUDGET
+from azureml.designer.modules.recommendation.dnn.common.dataset import Dataset, TransactionDataset, FeatureDataset
+from azureml.designer.modules.recommendation.dnn.common.top_k import TopKRecommendations, factorize_ids, \
+    segmented_top_k, take_padded
+from azureml.designer.modules.recommendation.dnn.wide_and_deep.common.wide_n_deep_model import WideNDeepModel
+from azureml.designer.modules.recommendation.dnn.wide_and_deep.score. \
+    base_recommender_scorer import BaseRecommenderScorer
+from azureml.designer.modules.recommendation.dnn.common.score_column_names import build_ranking_column_names, \
+    USER_COLUMN, ITEM_COLUMN, SCORED_RATING
+
+
+class RecommendCandidateItemScorer(BaseRecommenderScorer):
+    """Recommend items from the candidates of each user, which are given by the dataset to score.
+
+    Each row of the dataset is a user and one of its candidate items, e.g. produced by an upstream retrieval system.
+    Only the candidate pairs are scored, so the cost depends on the number of candidates instead of the catalog size.
+    """
+
+    def __init__(self, memory_budget: int = SCORE_MEMORY_BUDGET, compact_ids: bool = False):
+        """Init the scorer with the memory budget for scoring.
+
+        :param memory_budget: memory in bytes for user-item pairs scored at once, which bounds the peak memory
+        regardless of the number of candidates to score.
+        :param compact_ids: whether to hold ids of transactions as compact ids, see BaseRecommenderScorer
+        """
+        super().__init__(compact_ids=compact_ids)
+        self.memory_budget = memory_budget
+
+    def _validate_parameters(self, learner: WideNDeepModel, test_data: Dataset, user_features: FeatureDataset = None,
+                             item_features: FeatureDataset = None, **kwargs):
+        super()._validate_parameters(learner, test_data, user_features=user_features, item_features=item_features)
+        ErrorMapping.verify_number_of_columns_greater_than_or_equal_to(curr_column_count=test_data.column_size,
+                                                                       required_column_count=2,
+                                                                       arg_name=test_data.name)
+
+    def _preprocess(self, transactions: TransactionDataset, user_features: FeatureDataset = None,
+                    item_features: FeatureDataset = None, training_transactions: TransactionDataset = None):
+        # remove extra ratings column, e.g. upstream retrieval scores, so that its missing values do not drop candidates
+        transactions.select_columns(slice(None, TRANSACTIONS_RATING_COL))
+        return super()._preprocess(transactions, user_features, item_features, training_transactions)
+
+    def score(self, learner: WideNDeepModel, test_transactions: TransactionDataset,
+              user_features: FeatureDataset = None,
+              item_features: FeatureDataset = None, **kwargs):
+        module_logger.info("Recommendation task: Recommend items from candidate items.")
+        super().score(learner, test_transactions, user_features, item_features, **kwargs)
+        max_recommended_item_count = kwargs["max_recommended_item_count"]
+        return_ratings = kwargs["return_ratings"]
+
+        with TimeProfile("Remove duplicated candidates"):
+            user_codes, users = factorize_ids(test_transactions.users)
+            item_codes, items = factorize_ids(test_transactions.items)
+            pair_keys = user_codes.astype(np.int64) * len(items) + item_codes
+            unique_pairs = ~pd.Series(pair_keys).duplicated(keep='first').values
+            user_codes = user_codes[unique_pairs]
+            item_codes = item_codes[unique_pairs]
+        module_logger.info(f"Get {len(users)} unique users, {len(items)} unique items and {len(user_codes)} "
+                           f"unique candidates.")
+
+        with TimeProfile(f"Recommend items from {len(user_codes)} candidates for {len(users)} users"):
+            recommendations = self._recommend_from_candidates(learner, users=users, items=items,
+                                                              user_codes=user_codes, item_codes=item_codes,
+                                                              K=max_recommended_item_count,
+                                                              user_features=user_features,
+                                                              item_features=item_features)
+        return self._format_recommendations(recommendations, return_ratings, K=max_recommended_item_count,
+                                            score_column_names_build_method=build_ranking_column_names)
+
+    def _recommend_from_candidates(self, learner: WideNDeepModel, users: np.ndarray, items: np.ndarray,
+                                   user_codes: np.ndarray, item_codes: np.ndarray, K: int,
+                                   user_features: FeatureDataset = None, item_features: FeatureDataset = None):
+        """Recommend top K items from the candidates of each user, scoring candidates block by block.
+
+        Candidates are grouped by users, and users are split into blocks, so that the candidates of each block fit in
+        the memory budget. A user whose candidates exceed the budget is scored in a block of its own.
+        :param users: unique users, every user has at least one candidate
+        :param items: unique items
+        :param user_codes: int array, the position in users of each candidate
+        :param item_codes: int array, the position in items of each candidate
+        """
+        learner.update_feature_builders(user_features=user_features, item_features=item_features)
+        scorer = learner.get_factorized_scorer()
+        pair_size = scorer.estimate_pair_size() if scorer is not None else self._estimate_pair_size(learner)
+        block_pairs_count = max(1, self.memory_budget // pair_size)
+        module_logger.info(f"Score candidates in blocks of about {block_pairs_count} candidates.")
+        item_partials = None
+        if scorer is not None:
+            with TimeProfile(f"Build partials of {len(items)} items"):
+                item_partials = scorer.build_item_partials(items=items)
+
+        order = np.argsort(user_codes, kind='stable')
+        user_codes = user_codes[order]
+        item_codes = item_codes[order]
+        # candidates of user i are at [user_offsets[i], user_offsets[i + 1])
+        user_offsets = np.searchsorted(user_codes, np.arange(len(users) + 1))
+
+        recommendations = []
+        user_start = 0
+        while user_start < len(users):
+            user_end = np.searchsorted(user_offsets, user_offsets[user_start] + block_pairs_count, side='right') - 1
+            user_end = max(user_end, user_start + 1)
+            block_users = users[user_start:user_end]
+            pair_start, pair_end = user_offsets[user_start], user_offsets[user_end]
+            user_positions = user_codes[pair_start:pair_end] - user_start
+            item_positions = item_codes[pair_start:pair_end]
+            if scorer is None:
+                pairs_df = pd.DataFrame({USER_COLUMN: block_users[user_positions], ITEM_COLUMN: items[item_positions]})
+                scores = self._predict_pairs(learner, TransactionDataset(pairs_df))[SCORED_RATING].values
+            else:
+                scores = scorer.score_pairs(user_partials=scorer.build_user_partials(users=block_users),
+                                            item_partials=item_partials, user_positions=user_positions,
+                                            item_positions=item_positions)
+            positions = segmented_top_k(group_codes=user_positions, group_count=len(block_users), scores=scores, k=K)
+            recommendations.append(TopKRecommendations(
+                users=block_users, items=take_padded(items[item_positions], positions=positions, fill=None),
+                ratings=take_padded(scores, positions=positions, fill=0)))
+            module_logger.info(f"Finished recommendations for {user_end} users.")
+            user_start = user_end
+
+        return TopKRecommendations.concat(recommendations, k=K)
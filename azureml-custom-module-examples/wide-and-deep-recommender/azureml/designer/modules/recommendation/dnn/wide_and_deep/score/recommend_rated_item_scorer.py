@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 from azureml.studio.internal.error import ErrorMapping
 from azureml.studio.core.logger import module_logger, TimeProfile
@@ -29,16 +30,29 @@ class RecommendRatedItemScorer(BaseRecommenderScorer):
 
         with TimeProfile(f"Filter users with less than {min_recommendation_pool_size} transactions"):
             transactions_df = test_transactions.df.iloc[:, :TRANSACTIONS_RATING_COL]
-            transactions_df = transactions_df.iloc[(~transactions_df.duplicated()).values, :]
             transactions_df = transactions_df.rename(
                 columns=dict(zip(transactions_df.columns, [USER_COLUMN, ITEM_COLUMN])))
-            user_group_size = transactions_df.groupby(USER_COLUMN, as_index=False).count()
-            valid_users_df = user_group_size[[USER_COLUMN]][
-                user_group_size[ITEM_COLUMN] >= min_recommendation_pool_size]
-            transactions_df = pd.merge(left=transactions_df, right=valid_users_df, how='inner')
-            transactions = TransactionDataset(transactions_df)
+            transactions_df = transactions_df[self._filter_pools(users=transactions_df[USER_COLUMN],
+                                                                 items=transactions_df[ITEM_COLUMN],
+                                                                 min_pool_size=min_recommendation_pool_size)]
+            transactions = TransactionDataset(transactions_df.reset_index(drop=True))
 
         recommendations = self._recommend(learner, transactions=transactions, K=max_recommended_item_count,
                                           user_features=user_features, item_features=item_features)
         return self._format_recommendations(recommendations, return_ratings, K=max_recommended_item_count,
                                             score_column_names_build_method=build_rated_ranking_column_names)
+
+    @staticmethod
+    def _filter_pools(users: pd.Series, items: pd.Series, min_pool_size: int):
+        """Get the mask of transactions to recommend from, where duplicated user-item pairs are removed except the
+        first one, and users whose pools have less than min_pool_size unique items are removed.
+
+        Ids are factorized into integer codes once, so that deduplication and pool size counting work on integers.
+        """
+        user_codes, unique_users = pd.factorize(users)
+        item_codes, unique_items = pd.factorize(items)
+        pair_keys = user_codes.astype(np.int64) * len(unique_items) + item_codes
+        mask = ~pd.Series(pair_keys).duplicated(keep='first').values
+        pool_sizes = np.bincount(user_codes[mask], minlength=len(unique_users))
+        mask &= pool_sizes[user_codes] >= min_pool_size
+        return mask
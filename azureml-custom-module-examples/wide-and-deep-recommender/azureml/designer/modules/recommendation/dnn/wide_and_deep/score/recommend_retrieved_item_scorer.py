@@ -0,0 +1,115 @@
+import os
+import numpy as np
+from tempfile import TemporaryDirectory
+from azureml.studio.core.logger import module_logger, TimeProfile
+from azureml.designer.modules.recommendation.dnn.common.dataset import FeatureDataset
+from azureml.designer.modules.recommendation.dnn.wide_and_deep.common.wide_n_deep_model import WideNDeepModel
+from azureml.designer.modules.recommendation.dnn.wide_and_deep.common.wide_n_deep_factorized_scorer import \
+    WideNDeepFactorizedScorer
+from azureml.designer.modules.recommendation.dnn.common.constants import SCORE_MEMORY_BUDGET, \
+    RETRIEVAL_CANDIDATES_COUNT, RANDOM_SEED
+from azureml.designer.modules.recommendation.dnn.common.ivf_index import IVFIndex
+from azureml.designer.modules.recommendation.dnn.common.top_k import TopKRecommendations, segmented_top_k, \
+    take_padded
+from azureml.designer.modules.recommendation.dnn.wide_and_deep.score.recommend_all_items_scorer import \
+    RecommendAllItemScorer
+
+
+class RecommendRetrievedItemScorer(RecommendAllItemScorer):
+    """Recommend items from all items in two stages, where candidates are retrieved first, and then ranked.
+
+    Item partials of the factorized scorer are exported as a memory-mapped matrix, and clustered into an IVF index.
+    For each user, the lists are scored by the model as groups of items, and the lists with top scores are probed
+    until enough candidates are retrieved. Only the candidates are scored exactly, so the recommendations are
+    approximate.
+    """
+
+    _ITEM_PARTIALS_FILE = "item_partials.npy"
+    _SENSITIVITY_USERS_COUNT = 1024
+
+    def __init__(self, candidates_count: int = RETRIEVAL_CANDIDATES_COUNT, memory_budget: int = SCORE_MEMORY_BUDGET,
+                 compact_ids: bool = False):
+        """Init the scorer with the number of candidates and the memory budget for scoring.
+
+        :param candidates_count: min number of candidates retrieved for each user
+        :param memory_budget: memory in bytes for user-item pairs scored at once, which bounds the peak memory
+        regardless of the number of users to score.
+        :param compact_ids: whether to hold ids of transactions as compact ids, see BaseRecommenderScorer
+        """
+        super().__init__(memory_budget=memory_budget, compact_ids=compact_ids)
+        self.candidates_count = candidates_count
+
+    def _recommend_items(self, learner: WideNDeepModel, users, items, K: int, user_features: FeatureDataset = None,
+                         item_features: FeatureDataset = None):
+        candidates_count = max(self.candidates_count, K)
+        learner.update_feature_builders(user_features=user_features, item_features=item_features)
+        scorer = learner.get_factorized_scorer()
+        if scorer is None or candidates_count >= len(items):
+            module_logger.info("Score all items instead of retrieved candidates.")
+            return super()._recommend_items(learner, users=users, items=items, K=K)
+
+        users = np.sort(np.asarray(users))
+        items = np.asarray(items)
+        signature_codes, representatives = self._group_users_by_signatures(learner, users=users)
+        if len(representatives) < len(users):
+            module_logger.info(f"Retrieve for {len(representatives)} distinct users of {len(users)} users by "
+                               f"signatures.")
+            recommendations = self._retrieve_and_rank(scorer, users=users[representatives], items=items, K=K,
+                                                      candidates_count=candidates_count)
+            return self._fan_out_recommendations(recommendations, users=users, signature_codes=signature_codes)
+        return self._retrieve_and_rank(scorer, users=users, items=items, K=K, candidates_count=candidates_count)
+
+    @staticmethod
+    def _get_lists_count(items_count: int):
+        # about sqrt(n) lists balances the cost of scoring centroids and the cost of scoring candidates
+        return int(np.ceil(np.sqrt(items_count)))
+
+    def _retrieve_and_rank(self, scorer: WideNDeepFactorizedScorer, users: np.ndarray, items: np.ndarray, K: int,
+                           candidates_count: int):
+        """Retrieve candidates for sorted users from an IVF index of items, and rank the candidates exactly."""
+        lists_count = self._get_lists_count(items_count=len(items))
+        with TemporaryDirectory() as export_dir:
+            with TimeProfile(f"Export partials of {len(items)} items"):
+                item_partials, item_matrix = scorer.export_item_partials(
+                    items=items, export_to=os.path.join(export_dir, self._ITEM_PARTIALS_FILE))
+            with TimeProfile(f"Build IVF index of {lists_count} lists"):
+                # items are clustered by hidden partials scaled by their sensitivities, together with wide logits,
+                # so that items close to each other get close scores from the same user
+                sampled_users = np.random.RandomState(RANDOM_SEED).choice(
+                    users, min(len(users), self._SENSITIVITY_USERS_COUNT), replace=False)
+                sensitivities = scorer.estimate_hidden_sensitivities(
+                    user_partials=scorer.build_user_partials(users=sampled_users), item_partials=item_partials)
+                index = IVFIndex(vectors=item_matrix, lists_count=lists_count,
+                                 weights=np.append(sensitivities, np.float32(1)))
+                list_partials = scorer.build_group_partials(item_partials, group_codes=index.assignments,
+                                                            groups_count=index.lists_count)
+
+            # pairs of a user are the list centroids and the retrieved candidates, which exceed candidates_count by
+            # less than the largest list
+            user_pairs_count = index.lists_count + candidates_count + index.list_sizes.max()
+            user_block_size = max(1, self.memory_budget // (scorer.estimate_pair_size() * user_pairs_count))
+            module_logger.info(f"Retrieve {candidates_count} candidates from {len(items)} items for {len(users)} "
+                               f"users, in blocks of {user_block_size} users.")
+
+            recommendations = []
+            for user_start in range(0, len(users), user_block_size):
+                block_users = users[user_start:user_start + user_block_size]
+                user_partials = scorer.build_user_partials(users=block_users)
+                user_positions, list_positions = np.divmod(np.arange(len(block_users) * index.lists_count),
+                                                           index.lists_count)
+                list_scores = scorer.score_pairs(user_partials=user_partials, item_partials=list_partials,
+                                                 user_positions=user_positions, item_positions=list_positions)
+                user_positions, item_positions = index.probe(list_scores.reshape(len(block_users), -1),
+                                                             candidates_count=candidates_count)
+                scores = scorer.score_pairs(user_partials=user_partials, item_partials=item_partials,
+                                            user_positions=user_positions, item_positions=item_positions)
+                positions = segmented_top_k(group_codes=user_positions, group_count=len(block_users), scores=scores,
+                                            k=K)
+                recommendations.append(TopKRecommendations(
+                    users=block_users, items=take_padded(items[item_positions], positions=positions, fill=None),
+                    ratings=take_padded(scores, positions=positions, fill=0)))
+                module_logger.info(f"Finished recommendations for {user_start + len(block_users)} users.")
+            # the memory-mapped partials must be released before the export directory is removed
+            del item_partials, item_matrix
+
+        return TopKRecommendations.concat(recommendations, k=K)
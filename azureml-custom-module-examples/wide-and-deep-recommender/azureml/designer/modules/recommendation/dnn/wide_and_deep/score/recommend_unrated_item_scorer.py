@@ -1,16 +1,26 @@
 import pandas as pd
 from azureml.studio.core.logger import module_logger, TimeProfile
 from azureml.studio.internal.error import ErrorMapping
-from azureml.designer.modules.recommendation.dnn.common.constants import TRANSACTIONS_USER_COL, TRANSACTIONS_ITEM_COL
+from azureml.designer.modules.recommendation.dnn.common.constants import TRANSACTIONS_USER_COL, SCORE_MEMORY_BUDGET
 from azureml.designer.modules.recommendation.dnn.common.dataset import Dataset, TransactionDataset, FeatureDataset
+from azureml.designer.modules.recommendation.dnn.common.top_k import TopKRecommendations
 from azureml.designer.modules.recommendation.dnn.wide_and_deep.common.wide_n_deep_model import WideNDeepModel
 from azureml.designer.modules.recommendation.dnn.wide_and_deep.score. \
     base_recommender_scorer import BaseRecommenderScorer
-from azureml.designer.modules.recommendation.dnn.common.score_column_names import build_ranking_column_names, \
-    USER_COLUMN, ITEM_COLUMN
+from azureml.designer.modules.recommendation.dnn.common.score_column_names import build_ranking_column_names
 
 
 class RecommendUnratedItemScorer(BaseRecommenderScorer):
+    def __init__(self, memory_budget: int = SCORE_MEMORY_BUDGET, compact_ids: bool = False):
+        """Init the scorer with the memory budget for scoring.
+
+        :param memory_budget: memory in bytes for user-item pairs scored at once, which bounds the peak memory
+        regardless of the number of users to score.
+        :param compact_ids: whether to hold ids of transactions as compact ids, see BaseRecommenderScorer
+        """
+        super().__init__(compact_ids=compact_ids)
+        self.memory_budget = memory_budget
+
     def _validate_parameters(self, learner: WideNDeepModel, test_data: Dataset, user_features: FeatureDataset = None,
                              item_features: FeatureDataset = None, **kwargs):
         training_transactions = kwargs["training_transactions"]
@@ -40,22 +50,19 @@ class RecommendUnratedItemScorer(BaseRecommenderScorer):
         training_transactions = kwargs["training_transactions"]
 
         all_items = learner.item_feature_builder.id_vocab
-        training_transactions_df = training_transactions.df
-        training_transactions_df = training_transactions_df.rename(
-            columns={training_transactions_df.columns[TRANSACTIONS_USER_COL]: USER_COLUMN,
-                     training_transactions_df.columns[TRANSACTIONS_ITEM_COL]: ITEM_COLUMN})
         users = test_transactions.df.iloc[:, TRANSACTIONS_USER_COL].unique()
         module_logger.info(f"Get {len(users)} unique users, and {len(all_items)} unique items.")
 
-        with TimeProfile("Building complete user item transactions dataset"):
-            transactions_df = self.build_user_item_cartesian_pairs(users=users, items=all_items)
-            transactions_df = pd.merge(transactions_df, training_transactions_df, how='left',
-                                       on=[USER_COLUMN, ITEM_COLUMN], indicator=True)
-            transactions_df = transactions_df[transactions_df['_merge'] == 'left_only']
-            transactions_df = transactions_df.drop(columns=['_merge'])
-            transactions = TransactionDataset(transactions_df)
-
-        recommendations = self._recommend(learner, transactions=transactions, K=max_recommended_item_count,
-                                          user_features=user_features, item_features=item_features)
+        with TimeProfile(f"Recommend unrated items from {len(all_items)} items for {len(users)} users"):
+            recommendations = self._recommend_from_catalog(learner, users=users, items=all_items,
+                                                           K=max_recommended_item_count,
+                                                           memory_budget=self.memory_budget,
+                                                           user_features=user_features, item_features=item_features,
+                                                           excluded_transactions=training_transactions)
+            # users who have rated all items have no candidates to recommend
+            has_candidates = ~pd.isnull(recommendations.items[:, 0])
+            recommendations = TopKRecommendations(users=recommendations.users[has_candidates],
+                                                  items=recommendations.items[has_candidates],
+                                                  ratings=recommendations.ratings[has_candidates])
         return self._format_recommendations(recommendations, return_ratings, K=max_recommended_item_count,
                                             score_column_names_build_method=build_ranking_column_names)
@@ -3,7 +3,8 @@ from enum import Enum
 from azureml.studio.core.io.data_frame_directory import DataFrameDirectory, DataFrameSchema
 from azureml.studio.internal.error import ErrorMapping
 from azureml.designer.modules.recommendation.dnn.common.dataset import TransactionDataset, FeatureDataset
-from azureml.designer.modules.recommendation.dnn.wide_and_deep.common.wide_n_deep_model import WideNDeepModel
+from azureml.designer.modules.recommendation.dnn.wide_and_deep.common.wide_n_deep_model import WideNDeepModel, \
+    InferenceBackend
 from azureml.designer.modules.recommendation.dnn.wide_and_deep.score. \
     rating_prediction_scorer import RatingPredictionScorer
 from azureml.designer.modules.recommendation.dnn.wide_and_deep.score. \
@@ -12,6 +13,10 @@ from azureml.designer.modules.recommendation.dnn.wide_and_deep.score. \
     recommend_unrated_item_scorer import RecommendUnratedItemScorer
 from azureml.designer.modules.recommendation.dnn.wide_and_deep.score.recommend_all_items_scorer import \
     RecommendAllItemScorer
+from azureml.designer.modules.recommendation.dnn.wide_and_deep.score.recommend_retrieved_item_scorer import \
+    RecommendRetrievedItemScorer
+from azureml.designer.modules.recommendation.dnn.wide_and_deep.score.recommend_candidate_item_scorer import \
+    RecommendCandidateItemScorer
 from azureml.designer.modules.recommendation.dnn.common.entry_utils import params_loader
 from azureml.designer.modules.recommendation.dnn.common.entry_param import Boolean
 from azureml.designer.modules.recommendation.dnn.common.score_column_names import \
@@ -27,6 +32,8 @@ class RecommendedItemSelection(Enum):
     FromAllItems = "From All Items"
     FromRatedItems = "From Rated Items (for model evaluation)"
     FromUnratedItems = "From Unrated Items (to suggest new items to users)"
+    FromRetrievedItems = "From Retrieved Items (approximate, for large catalogs)"
+    FromCandidateItems = "From Candidate Items (to rank candidates given by the dataset to score)"
 
 
 class ScoreWideAndDeepRecommenderModule:
@@ -36,6 +43,8 @@ class ScoreWideAndDeepRecommenderModule:
         self.maximum_number_of_items_to_recommend_to_a_user = None
         self.minimum_size_of_the_recommendation_pool_for_a_single_user = None
         self.whether_to_return_the_predicted_ratings_of_the_items_along_with_the_labels = None
+        self.inference_backend = InferenceBackend.TensorFlow
+        self.compact_ids = False
 
     @params_loader
     def on_init(self,
@@ -48,7 +57,9 @@ class ScoreWideAndDeepRecommenderModule:
                 recommended_item_selection: RecommendedItemSelection = None,
                 maximum_number_of_items_to_recommend_to_a_user: int = None,
                 minimum_size_of_the_recommendation_pool_for_a_single_user: int = None,
-                whether_to_return_the_predicted_ratings_of_the_items_along_with_the_labels: Boolean = None):
+                whether_to_return_the_predicted_ratings_of_the_items_along_with_the_labels: Boolean = None,
+                inference_backend: InferenceBackend = None,
+                compact_ids: Boolean = None):
         self.recommender_prediction_kind = recommender_prediction_kind
         self.recommended_item_selection = recommended_item_selection
         self.maximum_number_of_items_to_recommend_to_a_user = maximum_number_of_items_to_recommend_to_a_user
@@ -56,18 +67,27 @@ class ScoreWideAndDeepRecommenderModule:
             minimum_size_of_the_recommendation_pool_for_a_single_user
         self.whether_to_return_the_predicted_ratings_of_the_items_along_with_the_labels = \
             whether_to_return_the_predicted_ratings_of_the_items_along_with_the_labels
+        if inference_backend is not None:
+            self.inference_backend = inference_backend
+        if compact_ids is not None:
+            self.compact_ids = compact_ids
 
     @staticmethod
-    def get_scorer(prediction_kind: RecommenderPredictionKind, recommended_item_selection: RecommendedItemSelection):
+    def get_scorer(prediction_kind: RecommenderPredictionKind, recommended_item_selection: RecommendedItemSelection,
+                   compact_ids=False):
         if prediction_kind == RecommenderPredictionKind.RatingPrediction:
-            return RatingPredictionScorer()
+            return RatingPredictionScorer(compact_ids=compact_ids)
         elif prediction_kind == RecommenderPredictionKind.ItemRecommendation:
             if recommended_item_selection == RecommendedItemSelection.FromAllItems:
-                return RecommendAllItemScorer()
+                return RecommendAllItemScorer(compact_ids=compact_ids)
             elif recommended_item_selection == RecommendedItemSelection.FromRatedItems:
-                return RecommendRatedItemScorer()
+                return RecommendRatedItemScorer(compact_ids=compact_ids)
             elif recommended_item_selection == RecommendedItemSelection.FromUnratedItems:
-                return RecommendUnratedItemScorer()
+                return RecommendUnratedItemScorer(compact_ids=compact_ids)
+            elif recommended_item_selection == RecommendedItemSelection.FromRetrievedItems:
+                return RecommendRetrievedItemScorer(compact_ids=compact_ids)
+            elif recommended_item_selection == RecommendedItemSelection.FromCandidateItems:
+                return RecommendCandidateItemScorer(compact_ids=compact_ids)
             else:
                 raise NotImplementedError(f"{recommended_item_selection} not supported now.")
         else:
@@ -78,7 +98,9 @@ class ScoreWideAndDeepRecommenderModule:
                       recommended_item_selection: RecommendedItemSelection = None,
                       maximum_number_of_items_to_recommend_to_a_user: int = None,
                       minimum_size_of_the_recommendation_pool_for_a_single_user: int = None,
-                      whether_to_return_the_predicted_ratings_of_the_items_along_with_the_labels: Boolean = None):
+                      whether_to_return_the_predicted_ratings_of_the_items_along_with_the_labels: Boolean = None,
+                      inference_backend: InferenceBackend = None,
+                      compact_ids: Boolean = None):
         for attr_name, attr_value in locals().items():
             if attr_name != "self" and attr_value is not None:
                 setattr(self, attr_name, attr_value)
@@ -135,14 +157,20 @@ class ScoreWideAndDeepRecommenderModule:
             maximum_number_of_items_to_recommend_to_a_user: int = None,
             minimum_size_of_the_recommendation_pool_for_a_single_user: int = None,
             whether_to_return_the_predicted_ratings_of_the_items_along_with_the_labels: Boolean = None,
+            inference_backend: InferenceBackend = None,
+            compact_ids: Boolean = None,
             scored_data: str = None):
         self.update_params(recommender_prediction_kind, recommended_item_selection,
                            maximum_number_of_items_to_recommend_to_a_user,
                            minimum_size_of_the_recommendation_pool_for_a_single_user,
-                           whether_to_return_the_predicted_ratings_of_the_items_along_with_the_labels)
+                           whether_to_return_the_predicted_ratings_of_the_items_along_with_the_labels,
+                           inference_backend, compact_ids)
         self.set_inputs_name(dataset_to_score, training_data, user_features=user_features,
                              item_features=item_features)
-        scorer = self.get_scorer(self.recommender_prediction_kind, self.recommended_item_selection)
+        if trained_wide_and_deep_recommendation_model is not None:
+            trained_wide_and_deep_recommendation_model.inference_backend = self.inference_backend
+        scorer = self.get_scorer(self.recommender_prediction_kind, self.recommended_item_selection,
+                                 compact_ids=self.compact_ids)
         scored_data_df = scorer.score(
             trained_wide_and_deep_recommendation_model,
             test_transactions=dataset_to_score,
@@ -4,14 +4,20 @@ from azureml.studio.core.data_frame_schema import ColumnTypeName
 from azureml.designer.modules.recommendation.dnn.common.constants import TRANSACTIONS_RATING_COL, \
     TRANSACTIONS_USER_COL, TRANSACTIONS_ITEM_COL
 from azureml.designer.modules.recommendation.dnn.common.entry_param import IntTuple, Boolean
-from azureml.designer.modules.recommendation.dnn.common.dataset import TransactionDataset, FeatureDataset
+from azureml.designer.modules.recommendation.dnn.common.dataset import TransactionDataset, FeatureDataset, \
+    TransactionShards, TrainingTransactions
 from azureml.designer.modules.recommendation.dnn.common.entry_utils import params_loader
 from azureml.designer.modules.recommendation.dnn.wide_and_deep.common.preprocess import preprocess_features, \
-    preprocess_transactions
+    preprocess_transactions, preprocess_transaction_shards
 from azureml.designer.modules.recommendation.dnn.common.feature_builder import FeatureBuilder
 from azureml.designer.modules.recommendation.dnn.wide_and_deep.common.wide_n_deep_model import WideNDeepModel, \
-    WideNDeepModelHyperParams, OptimizerSelection, ActivationFnSelection
+    WideNDeepModelHyperParams, OptimizerSelection, ActivationFnSelection, TrainingEngine
 from azureml.studio.core.io.model_directory import save_model_to_directory
+from azureml.studio.core.logger import module_logger
+
+# hyper parameters defining variables of the model, which are kept when the training continues from a trained model
+_STRUCTURE_HYPER_PARAMS = ("hidden_units", "activation_fn", "batch_norm", "crossed_dim", "user_dim", "item_dim",
+                           "embed_dim")
 
 
 class TrainWideAndDeepRecommenderModule:
@@ -34,7 +40,7 @@ class TrainWideAndDeepRecommenderModule:
         TrainWideAndDeepRecommenderModule._validate_features_column_type(dataset)
 
     @staticmethod
-    def _validate_datasets(transactions: TransactionDataset, user_features: FeatureDataset = None,
+    def _validate_datasets(transactions, user_features: FeatureDataset = None,
                            item_features: FeatureDataset = None):
         ErrorMapping.verify_number_of_columns_equal_to(curr_column_count=transactions.column_size,
                                                        required_column_count=3,
@@ -44,7 +50,7 @@ class TrainWideAndDeepRecommenderModule:
                                                                     arg_name=transactions.name)
         ErrorMapping.verify_element_type(type_=transactions.get_column_type(TRANSACTIONS_RATING_COL),
                                          expected_type=ColumnTypeName.NUMERIC,
-                                         column_name=transactions.ratings.name,
+                                         column_name=transactions.columns[TRANSACTIONS_RATING_COL],
                                          arg_name=transactions.name)
         if user_features is not None:
             TrainWideAndDeepRecommenderModule._validate_feature_dataset(user_features)
@@ -52,9 +58,12 @@ class TrainWideAndDeepRecommenderModule:
             TrainWideAndDeepRecommenderModule._validate_feature_dataset(item_features)
 
     @staticmethod
-    def _preprocess(transactions: TransactionDataset, user_features: FeatureDataset, item_features: FeatureDataset):
-        # preprocess transactions data
-        transactions = preprocess_transactions(transactions)
+    def _preprocess(transactions, user_features: FeatureDataset, item_features: FeatureDataset):
+        # preprocess transactions data, shards are only scanned for ids here, and preprocessed when streamed
+        if isinstance(transactions, TransactionShards):
+            transactions = preprocess_transaction_shards(transactions)
+        else:
+            transactions = preprocess_transactions(transactions)
 
         # preprocess user features
         user_features = preprocess_features(user_features) if user_features is not None else None
@@ -64,12 +73,12 @@ class TrainWideAndDeepRecommenderModule:
         return transactions, user_features, item_features
 
     @staticmethod
-    def _validate_preprocessed_dataset(transactions: TransactionDataset, user_features: FeatureDataset,
-                                       item_features: FeatureDataset):
+    def _validate_preprocessed_dataset(transactions, user_features: FeatureDataset, item_features: FeatureDataset):
         if transactions.row_size <= 0:
             ErrorMapping.throw(
                 InvalidDatasetError(dataset1=transactions.name, reason=f"dataset does not have any valid samples"))
-        if transactions.df.duplicated(
+        # duplicated ratings are not checked for shards, which would need all user-item pairs in memory
+        if isinstance(transactions, TransactionDataset) and transactions.df.duplicated(
                 subset=transactions.columns[[TRANSACTIONS_USER_COL, TRANSACTIONS_ITEM_COL]]).any():
             ErrorMapping.throw(MoreThanOneRatingError())
 
@@ -79,7 +88,7 @@ class TrainWideAndDeepRecommenderModule:
             ErrorMapping.throw(DuplicateFeatureDefinitionError())
 
     @staticmethod
-    def set_inputs_name(transactions: TransactionDataset, user_features: FeatureDataset = None,
+    def set_inputs_name(transactions, user_features: FeatureDataset = None,
                         item_features: FeatureDataset = None):
         _TRANSACTIONS_NAME = "Training dataset of user-item-rating triples"
         _USER_FEATURES_NAME = "User features"
@@ -93,9 +102,34 @@ class TrainWideAndDeepRecommenderModule:
         if item_features is not None:
             item_features.name = _ITEM_FEATURES_NAME
 
+    @staticmethod
+    def _build_warm_start_model(trained_model: WideNDeepModel, hyper_params: WideNDeepModelHyperParams,
+                                transactions, user_features: FeatureDataset, item_features: FeatureDataset,
+                                mpi_support: bool):
+        """Build the model which continues training from the trained model.
+
+        Feature builders of the trained model are extended with the new ids and features, and the structure of the
+        trained model is kept, so that all its variables can be loaded. The other hyper parameters, e.g. epochs and
+        learning rates, come from this run. Optimizer states are not loaded, so a smaller learning rate, or recent
+        transactions besides the new ones, keeps the model from drifting to the new transactions.
+        """
+        for key in _STRUCTURE_HYPER_PARAMS:
+            trained_value = getattr(trained_model.hyper_params, key)
+            if getattr(hyper_params, key) != trained_value:
+                module_logger.warning(f"Keep {key} {trained_value} of the trained model instead of "
+                                      f"{getattr(hyper_params, key)}.")
+                setattr(hyper_params, key, trained_value)
+
+        user_feature_builder = trained_model.user_feature_builder
+        user_feature_builder.update(features=user_features, ids=transactions.users)
+        item_feature_builder = trained_model.item_feature_builder
+        item_feature_builder.update(features=item_features, ids=transactions.items)
+        return WideNDeepModel(hyper_params=hyper_params, save_dir=None, user_feature_builder=user_feature_builder,
+                              item_feature_builder=item_feature_builder, mpi_support=mpi_support)
+
     @params_loader
     def run(self,
-            training_dataset_of_user_item_rating_triples: TransactionDataset,
+            training_dataset_of_user_item_rating_triples: TrainingTransactions,
             user_features: FeatureDataset,
             item_features: FeatureDataset,
             epochs: int,
@@ -113,7 +147,10 @@ class TrainWideAndDeepRecommenderModule:
             dropout: float,
             batch_normalization: Boolean,
             trained_wide_and_deep_recommendation_model: str,
-            mpi_support: bool = True):
+            mpi_support: bool = True,
+            training_engine: TrainingEngine = None,
+            trained_model_to_warm_start_from: WideNDeepModel = None,
+            feature_lookup: Boolean = None):
         self.set_inputs_name(training_dataset_of_user_item_rating_triples, user_features=user_features,
                              item_features=item_features)
         self._validate_datasets(training_dataset_of_user_item_rating_triples, user_features=user_features,
@@ -135,15 +172,28 @@ class TrainWideAndDeepRecommenderModule:
                                                  user_dim=user_embedding_dimension,
                                                  item_dim=item_embedding_dimension,
                                                  embed_dim=categorical_features_embedding_dimension)
-        user_feature_builder = FeatureBuilder(ids=training_dataset_of_user_item_rating_triples.users,
-                                              id_key="User",
-                                              features=user_features, feat_key_suffix='user_feature')
-        item_feature_builder = FeatureBuilder(ids=training_dataset_of_user_item_rating_triples.items,
-                                              id_key="Item",
-                                              features=item_features, feat_key_suffix='item_feature')
-        model = WideNDeepModel(hyper_params=hyper_params, save_dir=None, user_feature_builder=user_feature_builder,
-                               item_feature_builder=item_feature_builder, mpi_support=mpi_support)
-        model.train(transactions=training_dataset_of_user_item_rating_triples)
+        warm_start_from = None
+        if trained_model_to_warm_start_from is not None:
+            model = self._build_warm_start_model(trained_model_to_warm_start_from, hyper_params=hyper_params,
+                                                 transactions=training_dataset_of_user_item_rating_triples,
+                                                 user_features=user_features, item_features=item_features,
+                                                 mpi_support=mpi_support)
+            warm_start_from = trained_model_to_warm_start_from.checkpoints_dir
+        else:
+            user_feature_builder = FeatureBuilder(ids=training_dataset_of_user_item_rating_triples.users,
+                                                  id_key="User",
+                                                  features=user_features, feat_key_suffix='user_feature')
+            item_feature_builder = FeatureBuilder(ids=training_dataset_of_user_item_rating_triples.items,
+                                                  id_key="Item",
+                                                  features=item_features, feat_key_suffix='item_feature')
+            model = WideNDeepModel(hyper_params=hyper_params, save_dir=None,
+                                   user_feature_builder=user_feature_builder,
+                                   item_feature_builder=item_feature_builder, mpi_support=mpi_support)
+        if feature_lookup is not None:
+            model.input_pipeline_params.feature_lookup = feature_lookup
+        model.train(transactions=training_dataset_of_user_item_rating_triples,
+                    training_engine=training_engine if training_engine is not None else TrainingEngine.Estimator,
+                    warm_start_from=warm_start_from)
         # trained_wide_and_deep_recommendation_model is trained model output path, and the variable name is
         # defined according to the module spec
         if model.hvd_rank == 0 or not model.mpi_support:
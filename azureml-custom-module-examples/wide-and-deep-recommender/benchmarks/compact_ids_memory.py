@@ -0,0 +1,172 @@
+"""Measure the peak memory of the score module with plain ids and with compact ids, for each kind of scorer.
+
+The sample test data is repeated to build a scaled DataFrameDirectory, which is saved shard by shard, so the scaled
+rows are never held in memory by this script. Each scorer is run in a separate process for plain and compact ids,
+which reports its peak RSS, the time of the run, and the memory held by ids of the preprocessed transactions. The
+unrated scorer scores users of a 10x copy of the test data, and excludes items of the scaled data as training data.
+
+Usage, from the wide-and-deep-recommender directory, with a model saved by the train module on the sample data:
+    python benchmarks/compact_ids_memory.py --model <trained model directory> --scale 1000
+"""
+import argparse
+import glob
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+from time import time
+import numpy as np
+import pandas as pd
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_SAMPLE_TEST_DATA = os.path.join(_ROOT, 'sample_data', 'test_parquet_files')
+_RESULT_PREFIX = 'COMPACT_IDS_MEMORY_RESULT '
+_SCORER_KINDS = ['rating', 'rated', 'candidate', 'unrated', 'all']
+_SMALL_SCALE = 10
+_COPIES_PER_SHARD = 10
+
+
+def import_modules():
+    sys.path.insert(0, _ROOT)
+    # This is a workaround to make sure azureml in local directory could be loaded.
+    import azureml
+    import importlib
+    importlib.reload(azureml)
+
+
+def build_scaled_data(save_to: str, scale: int, work_dir: str):
+    """Save the sample test data repeated scale times as a DataFrameDirectory."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from azureml.designer.modules.recommendation.dnn.common.parquet_shards_writer import \
+        save_parquet_shards_to_directory
+
+    test_df = pd.concat([pd.read_parquet(path) for path in sorted(glob.glob(os.path.join(_SAMPLE_TEST_DATA,
+                                                                                         '*.parquet')))],
+                        ignore_index=True)
+    shards_dir = os.path.join(work_dir, f'shards_x{scale}')
+    shutil.rmtree(shards_dir, ignore_errors=True)
+    os.makedirs(shards_dir)
+    for shard_id, start in enumerate(range(0, scale, _COPIES_PER_SHARD)):
+        copies = min(_COPIES_PER_SHARD, scale - start)
+        table = pa.Table.from_pandas(pd.concat([test_df] * copies, ignore_index=True), preserve_index=False)
+        pq.write_table(table, os.path.join(shards_dir, f'{shard_id:05d}.parquet'))
+    shutil.rmtree(save_to, ignore_errors=True)
+    save_parquet_shards_to_directory(save_to=save_to, load_from=shards_dir, max_workers=1)
+    shutil.rmtree(shards_dir)
+    print(f"Saved {len(test_df) * scale} rows to {save_to}", flush=True)
+
+
+def ids_bytes(ids: pd.Series):
+    """Estimate the memory held by ids, where string objects shared by rows are counted once."""
+    if ids is None:
+        return 0
+    if ids.dtype.name == 'category':
+        return ids.cat.codes.values.nbytes + ids.cat.categories.memory_usage(deep=True)
+    values = ids.values
+    if values.dtype != object:
+        return values.nbytes
+    # only the distinct objects are kept while scanning, so that measuring does not raise the peak memory
+    distinct_objects = {}
+    for value in values:
+        distinct_objects.setdefault(id(value), value)
+    return values.nbytes + sum(sys.getsizeof(value) for value in distinct_objects.values())
+
+
+def run_worker(args):
+    import_modules()
+    from azureml.designer.modules.recommendation.dnn.common.dataset import TransactionDataset
+    from azureml.designer.modules.recommendation.dnn.wide_and_deep.common.wide_n_deep_model import WideNDeepModel
+    from azureml.designer.modules.recommendation.dnn.wide_and_deep.score import base_recommender_scorer
+    from azureml.designer.modules.recommendation.dnn.wide_and_deep.score.score_wide_and_deep_recommender import \
+        ScoreWideAndDeepRecommenderModule, RecommenderPredictionKind, RecommendedItemSelection
+
+    # ids of preprocessed transactions are measured once they are built, before scoring releases them, and the
+    # time of measuring is not counted in the time of scoring
+    retained_ids_bytes = []
+    measuring_seconds = []
+    preprocess_transactions = base_recommender_scorer.preprocess_transactions
+
+    def measured_preprocess_transactions(transactions, **kwargs):
+        transactions = preprocess_transactions(transactions, **kwargs)
+        measuring_start_time = time()
+        retained_ids_bytes.append(ids_bytes(transactions.users) + ids_bytes(transactions.items))
+        measuring_seconds.append(time() - measuring_start_time)
+        return transactions
+
+    base_recommender_scorer.preprocess_transactions = measured_preprocess_transactions
+
+    model = WideNDeepModel.load(args.model)
+    if args.kind == 'unrated':
+        dataset_to_score = TransactionDataset.load(os.path.join(args.work_dir, f'test_x{_SMALL_SCALE}'))
+        training_data = TransactionDataset.load(os.path.join(args.work_dir, f'test_x{args.scale}'))
+    else:
+        dataset_to_score = TransactionDataset.load(os.path.join(args.work_dir, f'test_x{args.scale}'))
+        training_data = None
+    item_selections = {'rated': RecommendedItemSelection.FromRatedItems,
+                       'candidate': RecommendedItemSelection.FromCandidateItems,
+                       'unrated': RecommendedItemSelection.FromUnratedItems,
+                       'all': RecommendedItemSelection.FromAllItems}
+    prediction_kind = RecommenderPredictionKind.RatingPrediction if args.kind == 'rating' else \
+        RecommenderPredictionKind.ItemRecommendation
+
+    start_time = time()
+    scored, = ScoreWideAndDeepRecommenderModule().run(
+        trained_wide_and_deep_recommendation_model=model, dataset_to_score=dataset_to_score,
+        training_data=training_data, user_features=None, item_features=None,
+        recommender_prediction_kind=prediction_kind, recommended_item_selection=item_selections.get(args.kind),
+        maximum_number_of_items_to_recommend_to_a_user=5, minimum_size_of_the_recommendation_pool_for_a_single_user=2,
+        whether_to_return_the_predicted_ratings_of_the_items_along_with_the_labels="True",
+        inference_backend='NumPy', compact_ids=str(args.compact_ids))
+    elapsed = time() - start_time - np.sum(measuring_seconds)
+    # ru_maxrss is in kilobytes on linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    print(_RESULT_PREFIX + json.dumps({'elapsed': elapsed, 'peak_rss': peak_rss,
+                                       'ids_bytes': int(np.sum(retained_ids_bytes)),
+                                       'scored_rows': len(scored.data)}), flush=True)
+
+
+def run_driver(args):
+    import_modules()
+    os.makedirs(args.work_dir, exist_ok=True)
+    for scale in (_SMALL_SCALE, args.scale):
+        build_scaled_data(save_to=os.path.join(args.work_dir, f'test_x{scale}'), scale=scale, work_dir=args.work_dir)
+
+    print(f"{'scorer':>10} {'ids':>8} {'peak RSS GB':>12} {'ids MB':>8} {'seconds':>8} {'scored rows':>12}")
+    for kind in args.kinds:
+        for compact_ids in (False, True):
+            command = [sys.executable, os.path.abspath(__file__), '--worker', '--model', args.model, '--scale',
+                       str(args.scale), '--work-dir', args.work_dir, '--kind', kind]
+            if compact_ids:
+                command.append('--compact-ids')
+            output = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                    universal_newlines=True, check=False).stdout
+            results = [json.loads(line.split(_RESULT_PREFIX, 1)[1]) for line in output.splitlines()
+                       if _RESULT_PREFIX in line]
+            if not results:
+                print(output[-5000:])
+                raise RuntimeError(f"Scorer {kind} failed with compact ids {compact_ids}")
+            result = results[0]
+            print(f"{kind:>10} {'compact' if compact_ids else 'plain':>8} {result['peak_rss'] / 2 ** 30:>12.2f} "
+                  f"{result['ids_bytes'] / 2 ** 20:>8.0f} {result['elapsed']:>8.1f} {result['scored_rows']:>12}",
+                  flush=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', required=True, help='directory of a model saved by the train module')
+    parser.add_argument('--scale', type=int, default=1000, help='number of copies of the sample test data')
+    parser.add_argument('--work-dir', default=os.path.join(tempfile.gettempdir(), 'compact_ids_memory'),
+                        help='directory to save the scaled data')
+    parser.add_argument('--kinds', nargs='+', default=_SCORER_KINDS, choices=_SCORER_KINDS)
+    parser.add_argument('--worker', action='store_true', help='run a scorer, launched by the driver')
+    parser.add_argument('--kind', choices=_SCORER_KINDS)
+    parser.add_argument('--compact-ids', action='store_true')
+    arguments = parser.parse_args()
+    if arguments.worker:
+        run_worker(arguments)
+    else:
+        run_driver(arguments)
@@ -0,0 +1,101 @@
+"""Compare convert_to_str, which converts distinct values only, with the former conversion of each row.
+
+Columns of int, float, string, datetime and mixed values are generated with 100k distinct values, and 1% missing
+values in some of them. For each column, the former conversion, convert_to_str and convert_to_str with categorical
+output are timed, and the memory allocated by the results is traced. The results are checked to be equal.
+
+Usage, from the wide-and-deep-recommender directory:
+    python benchmarks/convert_to_str.py --rows 10000000
+"""
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+from time import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# This is a workaround to make sure azureml in local directory could be loaded.
+import azureml  # noqa: E402
+import importlib  # noqa: E402
+importlib.reload(azureml)
+from azureml.studio.core.data_frame_schema import ElementTypeName  # noqa: E402
+from azureml.designer.modules.recommendation.dnn.common.utils import convert_to_str, \
+    _drop_na_and_convert  # noqa: E402
+
+
+def convert_to_str_by_rows(column: pd.Series):
+    """The former convert_to_str, which converts each non-missing value of the column to a string."""
+    # _drop_na_and_convert resets the index of the column given
+    column_new = _drop_na_and_convert(column.copy(), ElementTypeName.STRING)
+    column_new.replace(to_replace=pd.NaT, value=np.nan, inplace=True)
+    return column_new
+
+
+def build_columns(rows_count: int, distinct_count: int, seed: int = 0):
+    random_state = np.random.RandomState(seed)
+    codes = random_state.randint(0, distinct_count, rows_count)
+
+    def with_na(column: pd.Series):
+        column[random_state.rand(rows_count) < 0.01] = None
+        return column
+
+    strings = np.array([f'u{i}' for i in range(distinct_count)], dtype=object)[codes]
+    mixed = np.array([i if i % 2 else str(i) for i in range(distinct_count)], dtype=object)[codes]
+    return {
+        'int': pd.Series(codes),
+        'float with na': with_na(pd.Series(codes.astype(float))),
+        'string': pd.Series(strings),
+        'string with na, dup index': with_na(pd.Series(strings, index=codes)),
+        'datetime with nat': with_na(pd.Series(pd.Timestamp('2020-01-01') + pd.to_timedelta(codes, unit='s'))),
+        'mixed int and string': pd.Series(mixed),
+    }
+
+
+def measure(convert_fn):
+    """Run the conversion twice, and return the result, seconds, and MB allocated by the result and at peak.
+
+    The memory is traced in the second run, since tracing slows down allocations.
+    """
+    gc.collect()
+    start_time = time()
+    result = convert_fn()
+    elapsed = time() - start_time
+    gc.collect()
+    tracemalloc.start()
+    traced_result = convert_fn()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del traced_result
+    return result, elapsed, current / 2 ** 20, peak / 2 ** 20
+
+
+def main(args):
+    columns = build_columns(args.rows, distinct_count=args.distinct)
+    print(f"{args.rows} rows, {args.distinct} distinct values, seconds and result/peak MB")
+    print(f"{'column':<26} {'by rows':>20} {'convert_to_str':>20} {'categorical':>20}")
+    for name, column in columns.items():
+        cells = []
+        results = []
+        for convert_fn in (lambda: convert_to_str_by_rows(column), lambda: convert_to_str(column),
+                           lambda: convert_to_str(column, categorical=True)):
+            result, elapsed, current, peak = measure(convert_fn)
+            results.append(result.astype(object))
+            cells.append(f"{elapsed:6.2f}s {current:5.0f}/{peak:5.0f}")
+            del result
+        expected = results[0]
+        for result in results[1:]:
+            assert result.index.equals(expected.index)
+            assert (result.isna() == expected.isna()).all()
+            assert (result[expected.notna()] == expected[expected.notna()]).all()
+        print(f"{name:<26} " + " ".join(f"{cell:>20}" for cell in cells), flush=True)
+        del results, expected
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10000000)
+    parser.add_argument('--distinct', type=int, default=100000)
+    main(parser.parse_args())
@@ -0,0 +1,97 @@
+"""Measure the training throughput of Wide & Deep models with 1 to N Horovod ranks on the local host.
+
+Each rank trains all epochs on its 1/N shard of the transactions, so the aggregate throughput is expected to scale
+nearly linearly with the number of ranks, as long as there is a CPU core for each rank. The script launches
+horovodrun with the gloo controller for each number of ranks, and checks that all ranks are dealt the same number of
+instances, so that they run the same number of allreduce steps. Ranks beyond the number of cores share cores, so
+the throughput does not scale on such hosts.
+
+Usage, from the wide-and-deep-recommender directory, with horovod built with gloo and tensorflow support:
+    python benchmarks/horovod_scaling.py --ranks 1 2 4 --epochs 1 --batch-size 256
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from time import time
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_SAMPLE_DATA = os.path.join(_ROOT, 'sample_data', 'train_data_frame_directory')
+_RESULT_PREFIX = 'HOROVOD_SCALING_RESULT '
+
+
+def run_worker(args):
+    sys.path.insert(0, _ROOT)
+    # This is a workaround to make sure azureml in local directory could be loaded.
+    import azureml
+    import importlib
+    importlib.reload(azureml)
+
+    from azureml.designer.modules.recommendation.dnn.common.dataset import TransactionDataset
+    from azureml.designer.modules.recommendation.dnn.common.feature_builder import FeatureBuilder
+    from azureml.designer.modules.recommendation.dnn.wide_and_deep.common.preprocess import preprocess_transactions
+    from azureml.designer.modules.recommendation.dnn.wide_and_deep.common.wide_n_deep_model import WideNDeepModel, \
+        WideNDeepModelHyperParams, OptimizerSelection, ActivationFnSelection, TrainingEngine
+
+    transactions = preprocess_transactions(TransactionDataset.load(args.data))
+    hyper_params = WideNDeepModelHyperParams(epochs=args.epochs, batch_size=args.batch_size,
+                                             wide_optimizer=OptimizerSelection.Adagrad, wide_lr=0.1,
+                                             deep_optimizer=OptimizerSelection.Adagrad, deep_lr=0.1,
+                                             hidden_units=(256, 128), activation_fn=ActivationFnSelection.ReLU,
+                                             dropout=0.2, batch_norm=True, crossed_dim=1000, user_dim=16,
+                                             item_dim=16, embed_dim=4)
+    model = WideNDeepModel(hyper_params=hyper_params, save_dir=None,
+                           user_feature_builder=FeatureBuilder(ids=transactions.users, id_key="User"),
+                           item_feature_builder=FeatureBuilder(ids=transactions.items, id_key="Item"),
+                           mpi_support=True)
+    shard_size = model.get_rank_shard(transactions).row_size
+    start_time = time()
+    model.train(transactions=transactions, training_engine=TrainingEngine[args.engine])
+    elapsed = time() - start_time
+
+    print(_RESULT_PREFIX + json.dumps({'rank': model.hvd_rank, 'size': model.hvd_size, 'shard_size': shard_size,
+                                       'elapsed': elapsed}), flush=True)
+
+
+def run_driver(args):
+    print(f"Train on {args.data} for {args.epochs} epochs, batch size {args.batch_size}, engine {args.engine}")
+    print(f"{'ranks':>5} {'shard':>8} {'seconds':>8} {'instances/s':>12} {'speedup':>8} {'efficiency':>10}")
+    base_throughput = None
+    for ranks in args.ranks:
+        command = ['horovodrun', '--gloo', '-np', str(ranks), '-H', f'localhost:{ranks}', sys.executable,
+                   os.path.abspath(__file__), '--worker', '--data', args.data, '--epochs', str(args.epochs),
+                   '--batch-size', str(args.batch_size), '--engine', args.engine]
+        output = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                universal_newlines=True, check=False).stdout
+        results = [json.loads(line.split(_RESULT_PREFIX, 1)[1]) for line in output.splitlines()
+                   if _RESULT_PREFIX in line]
+        if len(results) != ranks:
+            print(output[-5000:])
+            raise RuntimeError(f"Got results of {len(results)} of {ranks} ranks")
+
+        shard_sizes = {result['shard_size'] for result in results}
+        assert len(shard_sizes) == 1, f"ranks are dealt different numbers of instances {shard_sizes}"
+        shard_size = shard_sizes.pop()
+        # ranks run in lockstep, since gradients are allreduced every step, so the slowest rank bounds the throughput
+        elapsed = max(result['elapsed'] for result in results)
+        throughput = shard_size * ranks * args.epochs / elapsed
+        base_throughput = base_throughput or throughput / args.ranks[0]
+        speedup = throughput / base_throughput
+        print(f"{ranks:>5} {shard_size:>8} {elapsed:>8.1f} {throughput:>12.0f} {speedup:>8.2f} "
+              f"{speedup / ranks:>10.0%}", flush=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ranks', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--data', default=_SAMPLE_DATA, help='DataFrameDirectory of user-item-rating triples')
+    parser.add_argument('--epochs', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--engine', default='Estimator', choices=['Estimator', 'Keras'])
+    parser.add_argument('--worker', action='store_true', help='run as a horovod rank, launched by the driver')
+    arguments = parser.parse_args()
+    if arguments.worker:
+        run_worker(arguments)
+    else:
+        run_driver(arguments)
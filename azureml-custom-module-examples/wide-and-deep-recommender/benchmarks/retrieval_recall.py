@@ -0,0 +1,84 @@
+"""Measure recall@K of "From Retrieved Items" against "From All Items", for numbers of candidates and IVF lists.
+
+Users of a trained model are recommended top K items from all its items by both scorers. Recall@K of a user is the
+fraction of exhaustive top K items which are also recommended from retrieved candidates. The numbers of lists are
+the default ceil(sqrt(n)) scaled by the factors given, so that RETRIEVAL_CANDIDATES_COUNT and the number of lists
+can be re-checked on the catalog of the model.
+
+Usage, from the wide-and-deep-recommender directory, with a model saved by the train module:
+    python benchmarks/retrieval_recall.py --model <trained model directory> --users 1000 --k 10
+"""
+import argparse
+import os
+import sys
+from time import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# This is a workaround to make sure azureml in local directory could be loaded.
+import azureml  # noqa: E402
+import importlib  # noqa: E402
+importlib.reload(azureml)
+from azureml.designer.modules.recommendation.dnn.common.constants import RETRIEVAL_CANDIDATES_COUNT  # noqa: E402
+from azureml.designer.modules.recommendation.dnn.wide_and_deep.common.wide_n_deep_model import \
+    WideNDeepModel  # noqa: E402
+from azureml.designer.modules.recommendation.dnn.wide_and_deep.score.recommend_all_items_scorer import \
+    RecommendAllItemScorer  # noqa: E402
+from azureml.designer.modules.recommendation.dnn.wide_and_deep.score.recommend_retrieved_item_scorer import \
+    RecommendRetrievedItemScorer  # noqa: E402
+
+
+def build_retrieved_item_scorer(candidates_count: int, lists_factor: float):
+    class ScaledListsScorer(RecommendRetrievedItemScorer):
+        @staticmethod
+        def _get_lists_count(items_count: int):
+            lists_count = RecommendRetrievedItemScorer._get_lists_count(items_count=items_count)
+            return min(items_count, max(1, int(np.ceil(lists_count * lists_factor))))
+
+    return ScaledListsScorer(candidates_count=candidates_count)
+
+
+def recall_at_k(expected_items: np.ndarray, items: np.ndarray):
+    recalls = []
+    for expected_row, row in zip(expected_items, items):
+        expected_set = {item for item in expected_row if item is not None}
+        if expected_set:
+            recalls.append(len(expected_set.intersection(row)) / len(expected_set))
+    return np.mean(recalls)
+
+
+def main(args):
+    model = WideNDeepModel.load(args.model)
+    if model.get_factorized_scorer() is None:
+        raise ValueError(f"Model {args.model} is not supported by the factorized scorer, and is scored exhaustively")
+    users = np.sort(model.user_feature_builder.id_vocab.values)[:args.users]
+    items = model.item_feature_builder.id_vocab.values
+    default_lists_count = RecommendRetrievedItemScorer._get_lists_count(items_count=len(items))
+
+    start_time = time()
+    expected = RecommendAllItemScorer()._recommend_items(model, users=users, items=items, K=args.k)
+    exhaustive_seconds = time() - start_time
+    print(f"{len(users)} users, {len(items)} items, recall@{args.k}, default {RETRIEVAL_CANDIDATES_COUNT} "
+          f"candidates and {default_lists_count} lists, from all items {exhaustive_seconds:.2f}s")
+    print(f"{'lists':>6} {'candidates':>10} {'recall':>8} {'seconds':>8}")
+    for lists_factor in args.lists_factors:
+        for candidates_count in args.candidates:
+            scorer = build_retrieved_item_scorer(candidates_count=candidates_count, lists_factor=lists_factor)
+            start_time = time()
+            recommendations = scorer._recommend_items(model, users=users, items=items, K=args.k)
+            elapsed = time() - start_time
+            assert (recommendations.users == expected.users).all()
+            lists_count = scorer._get_lists_count(items_count=len(items))
+            print(f"{lists_count:>6} {candidates_count:>10} {recall_at_k(expected.items, recommendations.items):>8.4f} "
+                  f"{elapsed:>8.2f}", flush=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', required=True, help='directory of a model saved by the train module')
+    parser.add_argument('--users', type=int, default=1000, help='number of users to recommend to')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--candidates', type=int, nargs='+', default=[50, 100, 200, RETRIEVAL_CANDIDATES_COUNT])
+    parser.add_argument('--lists-factors', type=float, nargs='+', default=[0.5, 1, 2],
+                        help='factors of the default number of lists, which is ceil(sqrt(number of items))')
+    main(parser.parse_args())
@@ -0,0 +1,106 @@
+"""Time the top k selection of BaseRecommenderScorer._recommend against the former groupby/nlargest selection.
+
+Scores of all user-item pairs are generated block by block of users, like the scorer scores the items catalog, with
+ties and NaN scores. Each block is selected by both the former path and the current one, which is factorize_ids,
+grouped_top_k and take_padded. The selections are checked to be equal by tests/test_top_k.py.
+
+Usage, from the wide-and-deep-recommender directory:
+    python benchmarks/top_k.py --users 100000 --items 5000 --k 10
+"""
+import argparse
+import os
+import sys
+from time import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# This is a workaround to make sure azureml in local directory could be loaded.
+import azureml  # noqa: E402
+import importlib  # noqa: E402
+importlib.reload(azureml)
+from azureml.designer.modules.recommendation.dnn.common.score_column_names import USER_COLUMN, ITEM_COLUMN, \
+    SCORED_RATING  # noqa: E402
+from azureml.designer.modules.recommendation.dnn.common.top_k import factorize_ids, grouped_top_k, \
+    take_padded  # noqa: E402
+
+
+def top_k_by_groupby(predict_df: pd.DataFrame, k: int):
+    """The former selection of _recommend and _format_recommendations, which selects top k of each user by apply."""
+    # nlargest of pandas 0.25 skips NaN scores, while newer versions append them if n is not less than the group
+    # size, so NaN scores are dropped to keep the semantics of the pandas version the modules are built with
+    predict_df = predict_df[predict_df[SCORED_RATING].notna()]
+    predict_df = (
+        predict_df.groupby(by=[USER_COLUMN]).apply(
+            lambda x: x.nlargest(columns=SCORED_RATING, n=k)).reset_index(drop=True)
+    )
+    top_k_items = predict_df.groupby(USER_COLUMN)[ITEM_COLUMN].apply(lambda x: (list(x) + [None] * k)[:k])
+    top_k_ratings = predict_df.groupby(USER_COLUMN)[SCORED_RATING].apply(lambda x: (list(x) + [0] * k)[:k])
+    items = np.array(list(top_k_items.values)).reshape([-1, k])
+    ratings = np.array(list(top_k_ratings.values)).reshape([-1, k])
+    return np.asarray(top_k_items.index), items, ratings
+
+
+def top_k_by_arrays(predict_df: pd.DataFrame, k: int):
+    """The current selection of _recommend."""
+    user_codes, users = factorize_ids(predict_df[USER_COLUMN])
+    positions = grouped_top_k(group_codes=user_codes, group_count=len(users),
+                              scores=predict_df[SCORED_RATING].values, k=k)
+    items = take_padded(predict_df[ITEM_COLUMN].values, positions=positions, fill=None)
+    ratings = take_padded(predict_df[SCORED_RATING].values, positions=positions, fill=0)
+    return users, items, ratings
+
+
+def build_block(user_ids: np.ndarray, item_ids: np.ndarray, random_state: np.random.RandomState, shuffle: bool):
+    """Build the scored user-item pairs of a block of users, in the user major order of cartesian pairs.
+
+    Scores are rounded to create ties, and 1% of them are NaN.
+    """
+    pairs_count = len(user_ids) * len(item_ids)
+    scores = np.round(random_state.rand(pairs_count), 3).astype(np.float32)
+    scores[random_state.rand(pairs_count) < 0.01] = np.nan
+    predict_df = pd.DataFrame({USER_COLUMN: np.repeat(user_ids, len(item_ids)),
+                               ITEM_COLUMN: np.tile(item_ids, len(user_ids)),
+                               SCORED_RATING: scores})
+    if shuffle:
+        predict_df = predict_df.iloc[random_state.permutation(pairs_count)].reset_index(drop=True)
+    return predict_df
+
+
+def main(args):
+    random_state = np.random.RandomState(args.seed)
+    user_ids = np.array([f'user{i:07d}' for i in range(args.users)], dtype=object)
+    item_ids = np.array([f'item{i:07d}' for i in range(args.items)], dtype=object)
+    print(f"{args.users} users, {args.items} items, top {args.k}, blocks of {args.block_users} users, "
+          f"{'shuffled' if args.shuffle else 'user major'} pairs")
+
+    groupby_seconds = 0
+    arrays_seconds = 0
+    for user_start in range(0, args.users, args.block_users):
+        predict_df = build_block(user_ids[user_start:user_start + args.block_users], item_ids,
+                                 random_state=random_state, shuffle=args.shuffle)
+        start_time = time()
+        top_k_by_arrays(predict_df, k=args.k)
+        arrays_seconds += time() - start_time
+        if not args.skip_groupby:
+            start_time = time()
+            top_k_by_groupby(predict_df, k=args.k)
+            groupby_seconds += time() - start_time
+        print(f"{min(user_start + args.block_users, args.users)} users: groupby {groupby_seconds:.1f}s, "
+              f"arrays {arrays_seconds:.1f}s", flush=True)
+
+    if not args.skip_groupby:
+        print(f"Speedup {groupby_seconds / arrays_seconds:.1f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--items', type=int, default=5000)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--block-users', type=int, default=1000,
+                        help='users selected at once, all pairs of a block are held in memory')
+    parser.add_argument('--shuffle', action='store_true', help='shuffle pairs, so that ragged selection is used')
+    parser.add_argument('--skip-groupby', action='store_true', help='time the current selection only')
+    parser.add_argument('--seed', type=int, default=0)
+    main(parser.parse_args())
@@ -0,0 +1,79 @@
+"""Measure training steps per second of the Estimator and Keras training engines on the sample data.
+
+For each batch size and engine, a model is trained for 1 epoch and for the number of epochs given. The end to end
+rate includes building the graph and the input pipeline, and the steady state rate is the rate of the extra steps of
+the longer run, which excludes the fixed costs.
+
+Usage, from the wide-and-deep-recommender directory:
+    python benchmarks/training_engines.py --rows 40000 --batch-sizes 64 1024 --epochs 3
+"""
+import argparse
+import os
+import sys
+from time import time
+import numpy as np
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_SAMPLE_DATA = os.path.join(_ROOT, 'sample_data', 'train_data_frame_directory')
+sys.path.insert(0, _ROOT)
+# This is a workaround to make sure azureml in local directory could be loaded.
+import azureml  # noqa: E402
+import importlib  # noqa: E402
+importlib.reload(azureml)
+from azureml.designer.modules.recommendation.dnn.common.dataset import TransactionDataset  # noqa: E402
+from azureml.designer.modules.recommendation.dnn.common.feature_builder import FeatureBuilder  # noqa: E402
+from azureml.designer.modules.recommendation.dnn.wide_and_deep.common.preprocess import \
+    preprocess_transactions  # noqa: E402
+from azureml.designer.modules.recommendation.dnn.wide_and_deep.common.wide_n_deep_model import WideNDeepModel, \
+    WideNDeepModelHyperParams, OptimizerSelection, ActivationFnSelection, TrainingEngine  # noqa: E402
+
+
+def train(transactions: TransactionDataset, engine: TrainingEngine, batch_size: int, epochs: int):
+    """Train a model on the transactions, and return the number of steps and seconds."""
+    hyper_params = WideNDeepModelHyperParams(epochs=epochs, batch_size=batch_size,
+                                             wide_optimizer=OptimizerSelection.Adagrad, wide_lr=0.1,
+                                             deep_optimizer=OptimizerSelection.Adagrad, deep_lr=0.1,
+                                             hidden_units=(256, 128), activation_fn=ActivationFnSelection.ReLU,
+                                             dropout=0.2, batch_norm=True, crossed_dim=1000, user_dim=16,
+                                             item_dim=16, embed_dim=4)
+    model = WideNDeepModel(hyper_params=hyper_params, save_dir=None,
+                           user_feature_builder=FeatureBuilder(ids=transactions.users, id_key="User"),
+                           item_feature_builder=FeatureBuilder(ids=transactions.items, id_key="Item"),
+                           mpi_support=False)
+    start_time = time()
+    model.train(transactions=transactions, training_engine=engine)
+    elapsed = time() - start_time
+    steps = epochs * int(np.ceil(transactions.row_size / batch_size))
+    return steps, elapsed
+
+
+def main(args):
+    df = TransactionDataset.load(args.data).df
+    df = df.sample(n=min(args.rows, len(df)), random_state=0).reset_index(drop=True)
+    transactions = preprocess_transactions(TransactionDataset(df))
+    print(f"Train on {transactions.row_size} transactions, end to end rates of {args.epochs} epochs, and steady "
+          f"state rates of the steps after the first epoch")
+    print(f"{'batch':>6} {'engine':>10} {'steps':>7} {'seconds':>8} {'steps/s':>8} {'steady steps/s':>15}")
+    warmed_up_engines = set()
+    for batch_size in args.batch_sizes:
+        for engine_name in args.engines:
+            engine = TrainingEngine[engine_name]
+            # the first training of an engine in the process initializes tensorflow, which is not timed
+            if engine_name not in warmed_up_engines:
+                train(transactions, engine=engine, batch_size=batch_size, epochs=1)
+                warmed_up_engines.add(engine_name)
+            first_steps, first_elapsed = train(transactions, engine=engine, batch_size=batch_size, epochs=1)
+            steps, elapsed = train(transactions, engine=engine, batch_size=batch_size, epochs=args.epochs)
+            steady_rate = (steps - first_steps) / (elapsed - first_elapsed) if args.epochs > 1 else np.nan
+            print(f"{batch_size:>6} {engine_name:>10} {steps:>7} {elapsed:>8.2f} {steps / elapsed:>8.1f} "
+                  f"{steady_rate:>15.1f}", flush=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', default=_SAMPLE_DATA, help='DataFrameDirectory of user-item-rating triples')
+    parser.add_argument('--rows', type=int, default=40000, help='number of transactions sampled from the data')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[64, 1024])
+    parser.add_argument('--epochs', type=int, default=3)
+    parser.add_argument('--engines', nargs='+', default=['Estimator', 'Keras'], choices=['Estimator', 'Keras'])
+    main(parser.parse_args())
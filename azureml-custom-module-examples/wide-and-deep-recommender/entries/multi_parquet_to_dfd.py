@@ -1,14 +1,23 @@
+# flake8: noqa: E402
 import argparse
-import pandas as pd
-from azureml.studio.core.io.data_frame_directory import save_data_frame_to_directory
+import azureml
+import importlib
 
+# This is a workaround to make sure azureml in local directory could be loaded.
+importlib.reload(azureml)
+
+from azureml.designer.modules.recommendation.dnn.common.constants import PARQUET_READ_WORKERS
+from azureml.designer.modules.recommendation.dnn.common.parquet_shards_writer import \
+    save_parquet_shards_to_directory
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--input', default='inputdir')
     parser.add_argument('--output', default='outputdfd')
+    parser.add_argument('--columns', default=None, help='Comma separated names of columns to save')
+    parser.add_argument('--parallel-readers', type=int, default=PARQUET_READ_WORKERS)
     args, _ = parser.parse_known_args()
-    df = pd.read_parquet(args.input)
-    save_data_frame_to_directory(args.output, data=df, compute_stats_in_visualization=True)
-    print(f"Dataframe is saved to {args.output}")
-    print(df)
+    columns = [column.strip() for column in args.columns.split(',')] if args.columns else None
+    rows_count = save_parquet_shards_to_directory(args.output, load_from=args.input, columns=columns,
+                                                  max_workers=args.parallel_readers)
+    print(f"Dataframe of {rows_count} rows is saved to {args.output}")
@@ -7,13 +7,19 @@ print(azureml.__path__)
 
 import os
 import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from threading import BoundedSemaphore
+from time import time
 import pandas as pd
 
 from azureml.designer.modules.recommendation.dnn.wide_and_deep.score. \
     score_wide_and_deep_recommender import ScoreWideAndDeepRecommenderModule
-from azureml.designer.modules.recommendation.dnn.wide_and_deep.common.wide_n_deep_model import WideNDeepModel
+from azureml.designer.modules.recommendation.dnn.wide_and_deep.common.wide_n_deep_model import WideNDeepModel, \
+    InferenceBackend
 from azureml.designer.modules.recommendation.dnn.common.entry_utils import build_cli_args
+from azureml.designer.modules.recommendation.dnn.common.entry_param import EntryParam
 from azureml.studio.core.io.data_frame_directory import DataFrameDirectory
 from azureml.studio.core.io.model_directory import ModelDirectory
 from azureml.studio.core.utils.fileutils import iter_files
@@ -27,9 +33,18 @@ def init():
     for f in iter_files(input_dir):
         print(f)
     kwargs[model_key] = ModelDirectory.load_instance(load_from_dir=input_dir, model_class=WideNDeepModel)
+    inference_backend = EntryParam.load(InferenceBackend, kwargs['inference_backend'])
+    if inference_backend is not None:
+        kwargs[model_key].inference_backend = inference_backend
+    # build the predictor of the chosen backend once, and reuse it for all mini batches
+    kwargs[model_key].build_predictor()
     parser = argparse.ArgumentParser()
     parser.add_argument('--output', default='outputdir')
+    # number of files in the pipeline at the same time, which bounds the data frames resident in memory
+    parser.add_argument('--max-in-flight-files', type=int, default=3)
     args, _ = parser.parse_known_args()
+    global max_in_flight_files
+    max_in_flight_files = max(args.max_in_flight_files, 1)
 
     output_dir = Path(args.output)
     # We dump a mock DataFrameDirectory to let the downstream module could read the parquets as a DataFrameDirectory
@@ -46,19 +61,81 @@ def init():
     print()
 
 
+def read_file(f):
+    start_time = time()
+    df = pd.read_parquet(f)
+    dfd = DataFrameDirectory.create(data=df)
+    return dfd, time() - start_time
+
+
+def write_file(scored_df, output_path):
+    start_time = time()
+    scored_df.to_parquet(output_path)
+    return str(output_path), time() - start_time
+
+
 def run(files):
+    """Score files in a pipeline, where the following files are read and the scored files are written in background
+    threads, while the current file is scored in the main thread.
+
+    Each file takes one of max_in_flight_files slots from the start of its read to the end of its write, so that at
+    most max_in_flight_files files are being read, scored or written, and the main thread waits for a write to finish
+    before reading ahead if all slots are taken.
+    """
+    start_time = time()
+    stage_seconds = {'read': 0, 'score': 0, 'write': 0}
     results = []
-    for f in files:
-        df = pd.read_parquet(f)
-        dfd = DataFrameDirectory.create(data=df)
-        kwargs['dataset_to_score'] = dfd
-        scored_dfd, = ScoreWideAndDeepRecommenderModule().run(**kwargs)
-        fname = Path(f).name
-        output_path = output_df_dir / fname
-        scored_dfd.data.to_parquet(output_path)
-        print(f"Score finished, shape of df = {df.shape}, columns={df.columns.tolist()} output path={output_path}")
-        print()
-        results.append(str(output_path))
+    files_to_read = iter(files)
+    pending_reads = deque()
+    pending_writes = deque()
+    slots = BoundedSemaphore(max_in_flight_files)
+
+    def _submit_read():
+        f = next(files_to_read, None)
+        if f is not None:
+            slots.acquire()
+            pending_reads.append((f, reader.submit(read_file, f)))
+
+    def _submit_write(scored_df, output_path):
+        write_future = writer.submit(write_file, scored_df, output_path)
+        write_future.add_done_callback(lambda _: slots.release())
+        pending_writes.append(write_future)
+
+    def _collect_writes(wait: bool):
+        while pending_writes and (wait or pending_writes[0].done()):
+            output_path, write_seconds = pending_writes.popleft().result()
+            stage_seconds['write'] += write_seconds
+            results.append(output_path)
+
+    with ThreadPoolExecutor(max_workers=max_in_flight_files) as reader, ThreadPoolExecutor(max_workers=1) as writer:
+        for _ in range(max_in_flight_files):
+            _submit_read()
+
+        while pending_reads:
+            f, read_future = pending_reads.popleft()
+            dfd, read_seconds = read_future.result()
+            stage_seconds['read'] += read_seconds
+
+            score_start_time = time()
+            kwargs['dataset_to_score'] = dfd
+            scored_dfd, = ScoreWideAndDeepRecommenderModule().run(**kwargs)
+            stage_seconds['score'] += time() - score_start_time
+
+            output_path = output_df_dir / Path(f).name
+            print(f"Score finished, shape of df = {dfd.data.shape}, columns={dfd.data.columns.tolist()} "
+                  f"output path={output_path}")
+            print()
+            # the slot of the file is released after its write, so the input frame is released before reading ahead
+            kwargs['dataset_to_score'] = dfd = read_future = None
+            _submit_write(scored_dfd.data, output_path)
+            scored_dfd = None
+            _collect_writes(wait=False)
+            _submit_read()
+
+        _collect_writes(wait=True)
+
+    print(f"Scored {len(files)} files in {time() - start_time:.2f} seconds, stage seconds: "
+          f"read {stage_seconds['read']:.2f}, score {stage_seconds['score']:.2f}, write {stage_seconds['write']:.2f}")
     return results
 
 
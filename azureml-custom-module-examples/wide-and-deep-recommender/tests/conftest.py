@@ -0,0 +1,4 @@
+# This is a workaround to make sure azureml in local directory could be loaded.
+import azureml
+import importlib
+importlib.reload(azureml)
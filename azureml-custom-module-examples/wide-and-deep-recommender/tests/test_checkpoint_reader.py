@@ -0,0 +1,34 @@
+import os
+import numpy as np
+import tensorflow as tf
+from azureml.designer.modules.recommendation.dnn.common.checkpoint_reader import load_checkpoint, latest_checkpoint
+
+
+def test_checkpoint_reader_equals_tensorflow_reader(tmp_path):
+    random_state = np.random.RandomState(0)
+    values = {"dnn/hiddenlayer_0/kernel": random_state.randn(300, 16).astype(np.float32),
+              "dnn/logits/bias": np.zeros(1, dtype=np.float32),
+              "linear/linear_model/bias_weights": random_state.randn(1).astype(np.float64),
+              "global_step": np.int64(125),
+              "int_codes": random_state.randint(-5, 5, size=(3, 4, 5)).astype(np.int32)}
+    checkpoint = tf.train.Checkpoint(**{name.replace("/", "_"): tf.Variable(value) for name, value in values.items()})
+    tf.train.CheckpointManager(checkpoint, directory=str(tmp_path), max_to_keep=1).save()
+
+    assert latest_checkpoint(str(tmp_path)) == tf.train.latest_checkpoint(str(tmp_path))
+    reader = load_checkpoint(str(tmp_path))
+    expected_reader = tf.train.load_checkpoint(str(tmp_path))
+    assert reader.get_variable_to_shape_map() == expected_reader.get_variable_to_shape_map()
+    for name in expected_reader.get_variable_to_shape_map():
+        if expected_reader.get_variable_to_dtype_map()[name] == tf.string:
+            continue
+        expected = expected_reader.get_tensor(name)
+        actual = reader.get_tensor(name)
+        assert actual.dtype == expected.dtype
+        np.testing.assert_array_equal(actual, expected)
+
+
+def test_latest_checkpoint_not_found(tmp_path):
+    assert latest_checkpoint(str(tmp_path)) is None
+    with open(os.path.join(str(tmp_path), "checkpoint"), "w") as f:
+        f.write('model_checkpoint_path: "model.ckpt-1"\n')
+    assert latest_checkpoint(str(tmp_path)) is None
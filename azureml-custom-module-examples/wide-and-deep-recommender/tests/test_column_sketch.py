@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import pytest
+from azureml.studio.core.io.data_frame_visualizer import BoxplotLayout
+from azureml.designer.modules.recommendation.dnn.common.column_sketch import ColumnSketch
+from azureml.designer.modules.recommendation.dnn.common.parquet_shards_writer import SketchDataFrameVisualizer
+
+
+def _merged_sketch(values: np.ndarray, shard_size: int, extremes_count: int):
+    sketch = ColumnSketch(numeric=True, extremes_count=extremes_count)
+    for start in range(0, len(values), shard_size):
+        shard_sketch = ColumnSketch(numeric=True, extremes_count=extremes_count)
+        shard_sketch.update(pd.Series(values[start:start + shard_size]))
+        sketch.merge(shard_sketch)
+    return sketch
+
+
+@pytest.mark.parametrize('rows_count', [7, 100, 199, 200, 201, 1000])
+@pytest.mark.parametrize('shard_size', [1, 3, 50])
+def test_small_shards_keep_each_value_once(rows_count, shard_size):
+    values = np.random.RandomState(rows_count).standard_cauchy(rows_count)
+    sketch = _merged_sketch(values, shard_size=shard_size, extremes_count=100)
+    sorted_values = np.sort(values)
+
+    assert sketch.count == rows_count
+    assert sketch.min == sorted_values[0] and sketch.max == sorted_values[-1]
+    extremes = sketch.extremes()
+    if sketch.exact:
+        np.testing.assert_array_equal(extremes, sorted_values)
+    else:
+        np.testing.assert_array_equal(extremes, np.concatenate([sorted_values[:100], sorted_values[-100:]]))
+
+    xs = np.concatenate([sorted_values[:10], sorted_values[-10:], [sorted_values[0] - 1, sorted_values[-1] + 1]])
+    np.testing.assert_array_equal(sketch.ranks(xs), np.searchsorted(sorted_values, xs, side='left'))
+
+
+@pytest.mark.parametrize('rows_count', [5, 150, 250])
+def test_histogram_and_boxplot_of_small_shards(rows_count):
+    values = np.random.RandomState(0).standard_cauchy(rows_count)
+    sketch = _merged_sketch(values, shard_size=2, extremes_count=100)
+
+    histogram = SketchDataFrameVisualizer._numeric_histogram(sketch)
+    counts = [bin_['y'] for bin_ in histogram['Bins']]
+    expected_counts, _ = np.histogram(values, bins=len(counts))
+    assert counts == expected_counts.tolist()
+
+    outliers = SketchDataFrameVisualizer._boxplot(sketch)['outliers']
+    assert len(outliers) == len(set(outliers)) <= BoxplotLayout.MAX_NUMBER_OF_OUTLIERS * 2
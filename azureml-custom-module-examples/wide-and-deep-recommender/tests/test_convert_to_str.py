@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import pytest
+from azureml.designer.modules.recommendation.dnn.common.utils import convert_to_str
+
+NA = np.nan
+# columns and their expected strings, which are the strings of each non-missing value converted by rows before
+_CASES = {
+    'int': (pd.Series([3, 1, 2, 2, 3]), ['3', '1', '2', '2', '3']),
+    'duplicate index': (pd.Series(['a', None, 'b', np.nan, 'a'], index=[0, 0, 1, 1, 2], name='id'),
+                        ['a', NA, 'b', NA, 'a']),
+    'duplicate index without na': (pd.Series([5, 6, 5], index=[1, 1, 1]), ['5', '6', '5']),
+    # times are omitted if all times of the column are 00:00:00
+    'nat': (pd.Series(pd.to_datetime(['2020-01-01', None, '2020-01-02'])), ['2020-01-01', NA, '2020-01-02']),
+    'nat with times': (pd.Series(pd.to_datetime(['2020-01-01 10:00', None, '2020-01-01 00:00'])),
+                       ['2020-01-01 10:00:00', NA, '2020-01-01 00:00:00']),
+    'negative zero': (pd.Series([1.0, -0.0, 0.0, np.nan, 2.5, -0.0]), ['1.0', '-0.0', '0.0', NA, '2.5', '-0.0']),
+    'negative zero float32': (pd.Series(np.array([-0.0, 0.0, 1.5, np.nan], dtype=np.float32)),
+                              ['-0.0', '0.0', '1.5', NA]),
+    # values equal to each other have different strings
+    'mixed 1, 1.0 and True': (pd.Series([1, 1.0, True, 1, 1.0, True, None], dtype=object),
+                              ['1', '1.0', 'True', '1', '1.0', 'True', NA]),
+    'mixed with strings and nat': (pd.Series([1, 'a', 1.0, pd.NaT, 'a', None], dtype=object),
+                                   ['1', 'a', '1.0', NA, 'a', NA]),
+    'bool': (pd.Series([True, False, True]), ['True', 'False', 'True']),
+    'all na': (pd.Series([None, np.nan], dtype=object), [NA, NA]),
+    'empty': (pd.Series([], dtype=object), []),
+}
+
+
+@pytest.mark.parametrize('categorical', [False, True])
+@pytest.mark.parametrize('name', list(_CASES))
+def test_convert_to_str(name, categorical):
+    column, expected_values = _CASES[name]
+    original = column.copy()
+    strings = convert_to_str(column, categorical=categorical)
+
+    assert strings.dtype.name == ('category' if categorical else 'object')
+    assert strings.index.equals(column.index)
+    assert strings.name == column.name
+    values = strings.astype(object).values
+    na_mask = pd.isnull(expected_values)
+    np.testing.assert_array_equal(pd.isnull(values), na_mask)
+    # missing values are kept as np.nan, so that the column can be dumped into parquet
+    assert all(isinstance(value, float) and np.isnan(value) for value in values[na_mask])
+    assert all(type(value) is str for value in values[~na_mask])
+    assert list(values[~na_mask]) == list(np.asarray(expected_values, dtype=object)[~na_mask])
+    # the column given is not changed
+    pd.testing.assert_series_equal(column, original)
@@ -0,0 +1,68 @@
+import pickle
+import numpy as np
+import pandas as pd
+import pytest
+from azureml.designer.modules.recommendation.dnn.common.dataset import FeatureDataset
+from azureml.designer.modules.recommendation.dnn.common.feature_builder import FeatureBuilder
+
+
+def _build_feature_builder(ids_count: int = 100):
+    random_state = np.random.RandomState(0)
+    ids = pd.Series(np.arange(ids_count)).astype(str)
+    features = pd.DataFrame({'Id': ids[::2].values, 'Age': random_state.rand(ids_count // 2),
+                             'Genre': random_state.choice(['a', 'b', None], ids_count // 2)})
+    features.loc[3, 'Age'] = np.nan
+    return FeatureBuilder(ids=ids, id_key='User', features=FeatureDataset(features), feat_key_suffix='user_feature')
+
+
+def _save_and_load(feature_builder: FeatureBuilder, save_to: str):
+    manifest = feature_builder.save(save_to=save_to, prefix='user')
+    return FeatureBuilder.load(load_from=save_to, manifest=manifest)
+
+
+def test_loaded_feature_builder_builds_from_memory_mapped_features(tmp_path):
+    feature_builder = _build_feature_builder()
+    loaded = _save_and_load(feature_builder, save_to=str(tmp_path))
+    ids = pd.Series(['3', '4', '0', 'unseen', '4'])
+
+    pd.testing.assert_series_equal(loaded.id_vocab, feature_builder.id_vocab)
+    assert loaded.feature_rows_count == feature_builder.feature_rows_count
+    pd.testing.assert_frame_equal(loaded.build(ids=ids), feature_builder.build(ids=ids))
+    np.testing.assert_array_equal(loaded.encode_signatures(ids=ids), feature_builder.encode_signatures(ids=ids))
+    # features are converted column by column, without converting the whole table to a data frame
+    assert loaded._features_table is not None
+
+
+def test_loaded_feature_builder_reads_files_on_first_access(tmp_path):
+    feature_builder = _build_feature_builder()
+    manifest = feature_builder.save(save_to=str(tmp_path), prefix='user')
+    loaded = FeatureBuilder.load(load_from=str(tmp_path), manifest=manifest)
+    assert loaded.feature_metas.keys() == feature_builder.feature_metas.keys()
+
+    (tmp_path / manifest['ids_file']).unlink()
+    with pytest.raises(FileNotFoundError, match='should be kept'):
+        loaded.id_vocab
+
+
+def test_loaded_feature_builder_is_pickled_and_updated(tmp_path):
+    feature_builder = _build_feature_builder()
+    loaded = _save_and_load(feature_builder, save_to=str(tmp_path))
+    ids = pd.Series(['2', '101', '102'])
+
+    unpickled = pickle.loads(pickle.dumps(loaded))
+    pd.testing.assert_frame_equal(unpickled.build(ids=ids), feature_builder.build(ids=ids))
+
+    new_features = FeatureDataset(pd.DataFrame({'Id': ['2', '101'], 'Age': [0.5, 0.25], 'Genre': ['b', 'a']}))
+    loaded.update(features=new_features, ids=pd.Series(['101']))
+    feature_builder.update(features=new_features, ids=pd.Series(['101']))
+    pd.testing.assert_frame_equal(loaded.build(ids=ids), feature_builder.build(ids=ids))
+    assert loaded.oov_code == feature_builder.oov_code
+
+
+def test_loaded_feature_builder_without_features(tmp_path):
+    feature_builder = FeatureBuilder(ids=pd.Series(['a', 'b']), id_key='Item')
+    loaded = _save_and_load(feature_builder, save_to=str(tmp_path))
+
+    assert loaded.feature_rows_count == 0
+    pd.testing.assert_frame_equal(loaded.build(ids=pd.Series(['b', 'c'])),
+                                  feature_builder.build(ids=pd.Series(['b', 'c'])))
@@ -0,0 +1,122 @@
+"""Check the sharding contract of training transactions across Horovod ranks.
+
+The test launches this file with horovodrun and the gloo controller, each rank writes its shard of the transactions
+and the batches fed by build_dataset, and the test checks them together.
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_RANKS_COUNT = 2
+# an odd number of transactions, so that the shard of one rank is padded
+_TRANSACTIONS_COUNT = 1001
+_BATCH_SIZE = 64
+_EPOCHS = 3
+
+
+def _iterate_row_ids(row_ids, seed):
+    from azureml.designer.modules.recommendation.dnn.wide_and_deep.common.input_pipeline import build_dataset
+
+    dataset = build_dataset(features={'row_id': row_ids}, batch_size=_BATCH_SIZE, epochs=_EPOCHS, shuffle_seed=seed)
+    return [batch['row_id'].numpy().tolist() for batch in dataset]
+
+
+def run_rank(output_dir: str):
+    sys.path.insert(0, _ROOT)
+    # This is a workaround to make sure azureml in local directory could be loaded.
+    import azureml
+    import importlib
+    importlib.reload(azureml)
+    from azureml.designer.modules.recommendation.dnn.common.dataset import TransactionDataset
+    from azureml.designer.modules.recommendation.dnn.common.feature_builder import FeatureBuilder
+    from azureml.designer.modules.recommendation.dnn.wide_and_deep.common.wide_n_deep_model import WideNDeepModel, \
+        WideNDeepModelHyperParams, OptimizerSelection, ActivationFnSelection
+
+    # ratings are the row ids of transactions, so that the rows of each shard and batch are identified
+    transactions = TransactionDataset(pd.DataFrame({'User': np.arange(_TRANSACTIONS_COUNT) % 7,
+                                                    'Item': np.arange(_TRANSACTIONS_COUNT) % 11,
+                                                    'Rating': np.arange(_TRANSACTIONS_COUNT)}))
+    hyper_params = WideNDeepModelHyperParams(epochs=_EPOCHS, batch_size=_BATCH_SIZE,
+                                             wide_optimizer=OptimizerSelection.Adagrad, wide_lr=0.1,
+                                             deep_optimizer=OptimizerSelection.Adagrad, deep_lr=0.1,
+                                             hidden_units=(8,), activation_fn=ActivationFnSelection.ReLU,
+                                             dropout=0.0, batch_norm=False, crossed_dim=100, user_dim=4,
+                                             item_dim=4, embed_dim=4)
+    model = WideNDeepModel(hyper_params=hyper_params, save_dir=None,
+                           user_feature_builder=FeatureBuilder(ids=transactions.users, id_key="User"),
+                           item_feature_builder=FeatureBuilder(ids=transactions.items, id_key="Item"),
+                           mpi_support=True)
+    shard = model.get_rank_shard(transactions).ratings.values.astype(np.int64)
+    # the seed is the one get_input_fn reshuffles the shard with in mpi mode
+    seed = (model.random_seed, model.hvd_rank)
+    result = {'rank': model.hvd_rank, 'size': model.hvd_size, 'random_seed': model.random_seed,
+              'shard': shard.tolist(), 'batches': _iterate_row_ids(shard, seed=seed),
+              'rebuilt_batches': _iterate_row_ids(shard, seed=seed)}
+    with open(os.path.join(output_dir, f'rank_{model.hvd_rank}.json'), 'w') as f:
+        json.dump(result, f)
+
+
+@pytest.fixture(scope='module')
+def rank_results(tmp_path_factory):
+    pytest.importorskip('horovod.tensorflow')
+    if shutil.which('horovodrun') is None:
+        pytest.skip('horovodrun is not found')
+
+    output_dir = str(tmp_path_factory.mktemp('horovod_sharding'))
+    command = ['horovodrun', '--gloo', '-np', str(_RANKS_COUNT), '-H', f'localhost:{_RANKS_COUNT}', sys.executable,
+               os.path.abspath(__file__), output_dir]
+    completed = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True,
+                               timeout=600, check=False)
+    assert completed.returncode == 0, completed.stdout[-5000:]
+
+    results = []
+    for rank in range(_RANKS_COUNT):
+        with open(os.path.join(output_dir, f'rank_{rank}.json')) as f:
+            results.append(json.load(f))
+    return results
+
+
+def _split_epochs(batches):
+    batches_count = len(batches) // _EPOCHS
+    return [np.concatenate(batches[epoch * batches_count:(epoch + 1) * batches_count]) for epoch in range(_EPOCHS)]
+
+
+def test_rank_shards_are_disjoint_and_cover_all_transactions(rank_results):
+    assert [result['size'] for result in rank_results] == [_RANKS_COUNT] * _RANKS_COUNT
+    shards = [set(result['shard']) for result in rank_results]
+    for rank, shard in enumerate(shards):
+        assert all(shard.isdisjoint(other_shard) for other_shard in shards[rank + 1:])
+    assert set.union(*shards) == set(range(_TRANSACTIONS_COUNT))
+    # shards are padded to the same size with their own transactions
+    expected_shard_size = int(np.ceil(_TRANSACTIONS_COUNT / _RANKS_COUNT))
+    assert all(len(result['shard']) == expected_shard_size for result in rank_results)
+
+
+def test_ranks_feed_the_same_number_of_batches_per_epoch(rank_results):
+    expected_batches_count = int(np.ceil(len(rank_results[0]['shard']) / _BATCH_SIZE)) * _EPOCHS
+    assert all(len(result['batches']) == expected_batches_count for result in rank_results)
+    for result in rank_results:
+        # each epoch feeds every instance of the shard once
+        for epoch_rows in _split_epochs(result['batches']):
+            np.testing.assert_array_equal(np.sort(epoch_rows), np.sort(result['shard']))
+
+
+def test_shards_are_reshuffled_deterministically_per_epoch(rank_results):
+    for result in rank_results:
+        assert result['batches'] == result['rebuilt_batches']
+        shard = np.array(result['shard'])
+        epochs_rows = _split_epochs(result['batches'])
+        for epoch, epoch_rows in enumerate(epochs_rows):
+            permutation = np.random.RandomState([result['random_seed'], result['rank'], epoch]).permutation(len(shard))
+            np.testing.assert_array_equal(epoch_rows, shard[permutation])
+        assert not any(np.array_equal(epochs_rows[0], epoch_rows) for epoch_rows in epochs_rows[1:])
+
+
+if __name__ == '__main__':
+    run_rank(output_dir=sys.argv[1])
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+from azureml.designer.modules.recommendation.dnn.common.ivf_index import IVFIndex
+
+_VECTORS_COUNT = 500
+_LISTS_COUNT = 20
+
+
+@pytest.fixture(scope='module')
+def index():
+    random_state = np.random.RandomState(0)
+    vectors = random_state.randn(_VECTORS_COUNT, 4).astype(np.float32)
+    return IVFIndex(vectors=vectors, lists_count=_LISTS_COUNT, weights=random_state.rand(4), chunk_size=64)
+
+
+def _probe_by_loop(index: IVFIndex, list_scores: np.ndarray, candidates_count: int):
+    """Probe lists of each query one by one in the descending score order, until enough candidates are retrieved."""
+    candidates = []
+    for scores in list_scores:
+        query_candidates = []
+        for list_id in np.argsort(-scores):
+            if len(query_candidates) >= candidates_count:
+                break
+            query_candidates.extend(np.flatnonzero(index.assignments == list_id))
+        candidates.append(query_candidates)
+    return candidates
+
+
+def test_index_lists_partition_vectors(index):
+    assert index.lists_count == _LISTS_COUNT
+    np.testing.assert_array_equal(np.sort(index.indices), np.arange(_VECTORS_COUNT))
+    for list_id in range(index.lists_count):
+        list_vectors = index.indices[index.indptr[list_id]:index.indptr[list_id + 1]]
+        np.testing.assert_array_equal(list_vectors, np.flatnonzero(index.assignments == list_id))
+
+
+@pytest.mark.parametrize('candidates_count', [1, 30, 200, _VECTORS_COUNT, _VECTORS_COUNT + 1])
+def test_probe_gathers_lists_of_top_scores(index, candidates_count):
+    list_scores = np.random.RandomState(candidates_count).rand(7, index.lists_count)
+    query_positions, vector_positions = index.probe(list_scores=list_scores, candidates_count=candidates_count)
+
+    # pairs of the same query are contiguous
+    assert (np.diff(query_positions) >= 0).all()
+    expected = _probe_by_loop(index, list_scores=list_scores, candidates_count=candidates_count)
+    for query, expected_candidates in enumerate(expected):
+        candidates = vector_positions[query_positions == query]
+        np.testing.assert_array_equal(candidates, expected_candidates)
+        assert len(candidates) >= min(candidates_count, _VECTORS_COUNT)
+
+
+def test_probe_returns_all_lists_if_candidates_exceed_catalog(index):
+    list_scores = np.random.RandomState(0).rand(3, index.lists_count)
+    query_positions, vector_positions = index.probe(list_scores=list_scores, candidates_count=_VECTORS_COUNT * 2)
+
+    np.testing.assert_array_equal(np.bincount(query_positions), [_VECTORS_COUNT] * 3)
+    for query in range(3):
+        np.testing.assert_array_equal(np.sort(vector_positions[query_positions == query]), np.arange(_VECTORS_COUNT))
@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pytest
+from azureml.designer.modules.recommendation.dnn.common.dataset import TransactionDataset, FeatureDataset
+from azureml.designer.modules.recommendation.dnn.common.feature_builder import FeatureBuilder
+from azureml.designer.modules.recommendation.dnn.common.tf_feature_columns import CategoricalVocabListFeatureColumn, \
+    CrossedFeatureColumn, EmbeddingFeatureColumn
+from azureml.designer.modules.recommendation.dnn.wide_and_deep.common.preprocess import preprocess_features, \
+    preprocess_transactions
+from azureml.designer.modules.recommendation.dnn.wide_and_deep.common.wide_n_deep_model import WideNDeepModel, \
+    WideNDeepModelHyperParams, OptimizerSelection, ActivationFnSelection, InferenceBackend
+
+_USERS_COUNT = 40
+_ITEMS_COUNT = 30
+
+
+@pytest.fixture(scope='module')
+def datasets():
+    random_state = np.random.RandomState(0)
+    users = np.array([f'u{i}' for i in range(_USERS_COUNT)])
+    items = np.array([f'i{i}' for i in range(_ITEMS_COUNT)])
+    transactions = pd.DataFrame({'User': random_state.choice(users, 600), 'Item': random_state.choice(items, 600),
+                                 'Rating': random_state.randint(1, 6, 600).astype(float)})
+    transactions = transactions.drop_duplicates(subset=['User', 'Item']).reset_index(drop=True)
+    # some users have no features, so the missing features are filled. Numeric features are of unit scale, because
+    # with raw values such as years, linear layers without batch norm sum large terms, whose float32 rounding in
+    # the estimator alone exceeds the tolerance
+    user_features = pd.DataFrame({'User': users[::2], 'Age': random_state.rand(_USERS_COUNT // 2),
+                                  'Genre': random_state.choice(['m', 'f'], _USERS_COUNT // 2)})
+    item_features = pd.DataFrame({'Item': items, 'Popularity': random_state.rand(_ITEMS_COUNT)})
+    return (preprocess_transactions(TransactionDataset(transactions)),
+            preprocess_features(FeatureDataset(user_features)), preprocess_features(FeatureDataset(item_features)))
+
+
+def _train_model(datasets, activation_fn: ActivationFnSelection, batch_norm: bool):
+    transactions, user_features, item_features = datasets
+    hyper_params = WideNDeepModelHyperParams(epochs=2, batch_size=64, wide_optimizer=OptimizerSelection.Adagrad,
+                                             wide_lr=0.1, deep_optimizer=OptimizerSelection.Adagrad, deep_lr=0.1,
+                                             hidden_units=(8, 4), activation_fn=activation_fn, dropout=0.1,
+                                             batch_norm=batch_norm, crossed_dim=50, user_dim=4, item_dim=4,
+                                             embed_dim=3)
+    model = WideNDeepModel(hyper_params=hyper_params,
+                           user_feature_builder=FeatureBuilder(ids=transactions.users, id_key='User',
+                                                               features=user_features, feat_key_suffix='user'),
+                           item_feature_builder=FeatureBuilder(ids=transactions.items, id_key='Item',
+                                                               features=item_features, feat_key_suffix='item'))
+    # the default columns, and an embedding of user genres crossed with items
+    wide_columns, deep_columns = model.default_columns()
+    _, item, _ = wide_columns
+    genre_key, = [key for key, meta in model.user_feature_builder.feature_metas.items()
+                  if not meta.is_numeric_feature()]
+    genre = CategoricalVocabListFeatureColumn(key=genre_key,
+                                              vocab=model.user_feature_builder.feature_metas[genre_key].vocab)
+    crossed_feature = CrossedFeatureColumn(categorical_features=[genre, item], hash_bucket_size=30)
+    model.wide_columns = wide_columns
+    model.deep_columns = [*deep_columns, EmbeddingFeatureColumn(categorical_feature=crossed_feature, dimension=3)]
+    model.train(transactions=transactions)
+    return model
+
+
+@pytest.mark.parametrize('batch_norm', [False, True])
+@pytest.mark.parametrize('activation_fn', list(ActivationFnSelection))
+def test_numpy_backend_predictions_equal_tensorflow_predictions(datasets, activation_fn, batch_norm):
+    model = _train_model(datasets, activation_fn=activation_fn, batch_norm=batch_norm)
+    # all pairs of seen users and items, and pairs of unseen ones
+    users = np.append(model.user_feature_builder.id_vocab.values, 'unseen')
+    items = np.append(model.item_feature_builder.id_vocab.values, 'unseen')
+    pairs = TransactionDataset(pd.DataFrame({'User': np.repeat(users, len(items)), 'Item': np.tile(items, len(users))}))
+
+    model.inference_backend = InferenceBackend.TensorFlow
+    expected = model.predict(pairs).values
+    model.inference_backend = InferenceBackend.NumPy
+    assert model.get_factorized_scorer() is not None
+    actual = model.predict(pairs).values
+
+    assert actual.dtype == np.float32
+    np.testing.assert_allclose(actual, expected, rtol=1e-5, atol=1e-5)
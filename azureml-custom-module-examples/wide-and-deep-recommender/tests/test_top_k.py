@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+import pytest
+from azureml.designer.modules.recommendation.dnn.common.top_k import TopKRecommendations, segmented_top_k, \
+    dense_top_k, grouped_top_k, merge_top_k, take_padded
+
+
+def _top_k_by_nlargest(group_codes: np.ndarray, group_count: int, scores: np.ndarray, k: int):
+    """Select top k positions of each group by nlargest of each group, which is the selection replaced by arrays."""
+    df = pd.DataFrame({'group': group_codes, 'score': scores})
+    # nlargest of pandas 0.25 skips NaN scores, while newer versions append them if n is not less than the group
+    # size, so NaN scores are dropped to keep the semantics of the pandas version the modules are built with
+    df = df[df['score'].notna()]
+    positions = np.full((group_count, k), -1, dtype=np.int64)
+    for group, group_df in df.groupby('group'):
+        if k < len(group_df):
+            selected = group_df.nlargest(n=k, columns='score', keep='first')
+        else:
+            # nlargest sorts the whole group by an unstable sort in this case, so ties are ordered by position here
+            selected = group_df.sort_values(by='score', ascending=False, kind='mergesort')
+        positions[group, :len(selected)] = selected.index.values
+    return positions
+
+
+def _build_scores(random_state: np.random.RandomState, count: int):
+    # scores are rounded to create ties, and some of them are NaN
+    scores = np.round(random_state.rand(count), 1)
+    scores[random_state.rand(count) < 0.2] = np.nan
+    return scores
+
+
+@pytest.mark.parametrize('k', [0, 1, 3, 50])
+def test_segmented_top_k_equals_nlargest(k):
+    random_state = np.random.RandomState(k)
+    # groups 7 to 9 have no scores, and groups are smaller than k = 50
+    group_count = 10
+    group_codes = random_state.randint(0, 7, 200)
+    scores = _build_scores(random_state, count=200)
+    # all scores of group 6 are NaN
+    scores[group_codes == 6] = np.nan
+
+    positions = segmented_top_k(group_codes=group_codes, group_count=group_count, scores=scores, k=k)
+    np.testing.assert_array_equal(positions, _top_k_by_nlargest(group_codes, group_count, scores, k=k))
+
+
+def test_segmented_top_k_without_valid_scores():
+    positions = segmented_top_k(group_codes=np.array([0, 1]), group_count=3, scores=np.array([np.nan, np.nan]), k=2)
+    np.testing.assert_array_equal(positions, np.full((3, 2), -1))
+
+
+@pytest.mark.parametrize('k', [1, 4, 12, 20])
+def test_dense_top_k_equals_nlargest(k):
+    random_state = np.random.RandomState(k)
+    rows_count, columns_count = 9, 12
+    scores = _build_scores(random_state, count=rows_count * columns_count).reshape(rows_count, columns_count)
+    scores[0] = np.nan
+    scores[1, 1:] = np.nan
+    # all scores of a row are tied
+    scores[2] = 0.5
+
+    flat_positions = _top_k_by_nlargest(np.repeat(np.arange(rows_count), columns_count), rows_count,
+                                        scores.ravel(), k=k)
+    expected = np.where(flat_positions < 0, -1, flat_positions % columns_count)
+    np.testing.assert_array_equal(dense_top_k(scores, k=k), expected)
+
+
+def test_dense_top_k_without_columns():
+    np.testing.assert_array_equal(dense_top_k(np.empty((3, 0)), k=2), np.full((3, 2), -1))
+
+
+@pytest.mark.parametrize('shuffle', [False, True])
+@pytest.mark.parametrize('k', [1, 5, 30])
+def test_grouped_top_k_equals_nlargest(k, shuffle):
+    random_state = np.random.RandomState(k)
+    # scores of user-item cartesian pairs in user major order, with users coded in a different order
+    group_count, block_size = 8, 20
+    group_codes = np.repeat(random_state.permutation(group_count), block_size)
+    scores = _build_scores(random_state, count=group_count * block_size)
+    if shuffle:
+        permutation = random_state.permutation(len(scores))
+        group_codes, scores = group_codes[permutation], scores[permutation]
+
+    positions = grouped_top_k(group_codes=group_codes, group_count=group_count, scores=scores, k=k)
+    np.testing.assert_array_equal(positions, _top_k_by_nlargest(group_codes, group_count, scores, k=k))
+
+
+def test_grouped_top_k_with_empty_groups():
+    random_state = np.random.RandomState(0)
+    # 3 blocks of 4 scores, but 6 groups, so groups 3 to 5 are empty
+    group_codes = np.repeat([2, 0, 1], 4)
+    scores = _build_scores(random_state, count=12)
+
+    positions = grouped_top_k(group_codes=group_codes, group_count=6, scores=scores, k=3)
+    np.testing.assert_array_equal(positions, _top_k_by_nlargest(group_codes, 6, scores, k=3))
+
+
+def _select_recommendations(users, items, scores, k):
+    """Select top k recommendations of users from their candidates, items and scores of shape (users, candidates)."""
+    positions = _top_k_by_nlargest(np.repeat(np.arange(len(users)), scores.shape[1]), len(users), scores.ravel(), k=k)
+    return TopKRecommendations(users=users, items=take_padded(items.ravel(), positions=positions, fill=None),
+                               ratings=take_padded(scores.ravel(), positions=positions, fill=0))
+
+
+@pytest.mark.parametrize('k', [1, 3, 8])
+def test_merge_top_k_equals_selecting_all_candidates_at_once(k):
+    random_state = np.random.RandomState(k)
+    users = np.array(['a', 'b', 'c', 'd'], dtype=object)
+    items = np.array([[f'item{i}' for i in range(10)]] * len(users), dtype=object)
+    scores = _build_scores(random_state, count=items.size).reshape(items.shape)
+    # user d has no valid candidates in the running part, so its running recommendations are padded
+    scores[3, :6] = np.nan
+
+    running = _select_recommendations(users, items[:, :6], scores[:, :6], k=k)
+    block = _select_recommendations(users, items[:, 6:], scores[:, 6:], k=k)
+    merged = merge_top_k(running, block)
+    expected = _select_recommendations(users, items, scores, k=k)
+
+    np.testing.assert_array_equal(merged.users, expected.users)
+    np.testing.assert_array_equal(merged.items, expected.items)
+    np.testing.assert_array_equal(merged.ratings, expected.ratings)